@@ -0,0 +1,234 @@
+"""
+Planes de pago con amortización francesa (cuota fija), calculados con NumPy.
+
+El saldo después de k cuotas tiene forma cerrada:
+
+    saldo_k = monto * (1 + r)^k - cuota * ((1 + r)^k - 1) / r
+
+así que cada periodo se calcula sin depender del anterior y un lote de préstamos
+se resuelve con operaciones sobre arreglos, sin ciclos en Python.
+"""
+from collections import OrderedDict
+from datetime import date, datetime
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Días entre cuotas
+DIAS_PERIODO = 30
+
+# Límites de la caché de planes compartida por todas las sesiones
+MAXIMO_PLANES = int(os.environ.get('PRESTAMOS_CACHE_PLANES_ENTRADAS', '512'))
+MAXIMO_MB_PLANES = float(os.environ.get('PRESTAMOS_CACHE_PLANES_MB', '64'))
+
+_cache_planes = None
+_lock_cache_planes = threading.Lock()
+
+COLUMNAS_PLAN = ['num_pago', 'fecha_pago', 'cuota', 'capital', 'interes', 'saldo']
+# Tipos de las columnas del plan, iguales para cualquier plazo (también plazo=1, donde
+# el cálculo cuota a cuota original dejaba el saldo final como entero)
+TIPOS_PLAN = {'num_pago': 'int64', 'fecha_pago': 'object', 'cuota': 'float64',
+              'capital': 'float64', 'interes': 'float64', 'saldo': 'float64'}
+
+def cuota_fija(monto, tasa_mensual, plazo_meses):
+    """Cuota mensual de la amortización francesa (admite escalares o arreglos)"""
+    monto = np.asarray(monto, dtype=float)
+    tasa_mensual = np.asarray(tasa_mensual, dtype=float)
+    plazo_meses = np.asarray(plazo_meses)
+    factor = (1 + tasa_mensual) ** plazo_meses
+    with np.errstate(divide='ignore', invalid='ignore'):
+        con_interes = monto * tasa_mensual * factor / (factor - 1)
+    return np.where(tasa_mensual > 0, con_interes, monto / plazo_meses)
+
+def _fechas_inicio(fechas_inicio, cantidad):
+    """Convierte la(s) fecha(s) de inicio a un arreglo datetime64[D] de largo cantidad"""
+    if fechas_inicio is None:
+        fechas_inicio = datetime.now()
+    if isinstance(fechas_inicio, (str, datetime)) or not np.iterable(fechas_inicio):
+        fechas_inicio = [fechas_inicio]
+    fechas = np.asarray(fechas_inicio, dtype=object).astype('datetime64[D]')
+    return np.broadcast_to(fechas, (cantidad,)) if fechas.size == 1 else fechas
+
+def amortizar(montos, tasas_interes, plazos_meses, fechas_inicio=None):
+    """
+    Calcula los planes de pago de varios préstamos a la vez.
+
+    Args:
+        montos: Montos de los préstamos
+        tasas_interes: Tasas de interés anuales (en porcentaje)
+        plazos_meses: Plazos en meses (al menos 1)
+        fechas_inicio: Fecha de inicio común o una por préstamo (por defecto, hoy)
+
+    Returns:
+        Diccionario de arreglos con una fila por cuota: 'prestamo' (posición del préstamo
+        en la entrada) y las columnas de COLUMNAS_PLAN, con 'fecha_pago' como datetime64[D]
+    """
+    montos = np.atleast_1d(np.asarray(montos, dtype=float))
+    tasas = np.atleast_1d(np.asarray(tasas_interes, dtype=float)) / 100 / 12
+    plazos = np.atleast_1d(np.asarray(plazos_meses, dtype=np.int64))
+    montos, tasas, plazos = np.broadcast_arrays(montos, tasas, plazos)
+    if (plazos < 1).any():
+        raise ValueError("El plazo debe ser de al menos un mes")
+    inicios = _fechas_inicio(fechas_inicio, len(montos))
+
+    cuotas = cuota_fija(montos, tasas, plazos)
+
+    # Una fila por cuota: cada préstamo se repite tantas veces como su plazo y
+    # num_pago cuenta 1..plazo dentro de cada préstamo
+    prestamo = np.repeat(np.arange(len(montos)), plazos)
+    inicio_grupo = np.repeat(np.cumsum(plazos) - plazos, plazos)
+    num_pago = np.arange(prestamo.size) - inicio_grupo + 1
+
+    r = tasas[prestamo]
+    monto = montos[prestamo]
+    cuota = cuotas[prestamo]
+
+    # Saldo al inicio del periodo (después de num_pago - 1 cuotas)
+    factor = (1 + r) ** (num_pago - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        saldo_anterior = np.where(
+            r > 0,
+            monto * factor - cuota * (factor - 1) / r,
+            monto - cuota * (num_pago - 1),
+        )
+    interes = saldo_anterior * r
+    capital = cuota - interes
+    saldo = saldo_anterior - capital
+
+    # Ajuste para el último pago (por redondeos): salda exactamente el capital restante
+    ultimo = num_pago == plazos[prestamo]
+    capital = np.where(ultimo, saldo_anterior, capital)
+    cuota = np.where(ultimo, saldo_anterior + interes, cuota)
+    saldo = np.where(ultimo, 0.0, saldo)
+
+    fecha_pago = inicios[prestamo] + num_pago * DIAS_PERIODO
+
+    return {
+        'prestamo': prestamo,
+        'num_pago': num_pago,
+        'fecha_pago': fecha_pago,
+        'cuota': cuota,
+        'capital': capital,
+        'interes': interes,
+        'saldo': saldo,
+    }
+
+def plan_pagos_lote(montos, tasas_interes, plazos_meses, fechas_inicio=None):
+    """Planes de pago de varios préstamos en un solo DataFrame, con la columna 'prestamo'
+    indicando la posición de cada préstamo en la entrada"""
+    plan = amortizar(montos, tasas_interes, plazos_meses, fechas_inicio)
+    plan['fecha_pago'] = np.datetime_as_string(plan['fecha_pago'], unit='D')
+    return pd.DataFrame(plan, columns=['prestamo'] + COLUMNAS_PLAN).astype(TIPOS_PLAN)
+
+def plan_pagos(monto, tasa_interes, plazo_meses, fecha_inicio=None):
+    """Plan de pagos de un préstamo con las columnas de COLUMNAS_PLAN y los tipos de TIPOS_PLAN"""
+    plan = amortizar(monto, tasa_interes, plazo_meses, fecha_inicio)
+    plan['fecha_pago'] = np.datetime_as_string(plan['fecha_pago'], unit='D')
+    return pd.DataFrame(plan, columns=COLUMNAS_PLAN).astype(TIPOS_PLAN)
+
+def clave_plan(monto, tasa_interes, plazo_meses, fecha_inicio=None):
+    """Normaliza los parámetros de un plan a una tupla (monto, tasa, plazo, 'AAAA-MM-DD')
+    que sirve como clave de la caché y es lo único que necesita guardar una sesión"""
+    if fecha_inicio is None:
+        fecha_inicio = datetime.now()
+    if isinstance(fecha_inicio, (date, datetime)):
+        fecha_inicio = fecha_inicio.strftime('%Y-%m-%d')
+    return (round(float(monto), 2), float(tasa_interes), int(plazo_meses), str(fecha_inicio)[:10])
+
+class CachePlanes:
+    """Caché LRU de planes de pago compartida por el proceso, limitada por cantidad
+    de entradas y por memoria ocupada"""
+
+    def __init__(self, maximo_entradas=MAXIMO_PLANES, maximo_bytes=int(MAXIMO_MB_PLANES * 1024 * 1024)):
+        self.maximo_entradas = maximo_entradas
+        self.maximo_bytes = maximo_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave):
+        """Devuelve el plan de la clave, calculándolo si no está en la caché.
+        El DataFrame se comparte entre sesiones: quien lo reciba no debe modificarlo."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+
+        # Calcular fuera del lock: dos sesiones con la misma clave a la vez solo repiten trabajo
+        plan = plan_pagos(*clave)
+        tamano = int(plan.memory_usage(deep=True).sum())
+        with self._lock:
+            if clave not in self._entradas and tamano <= self.maximo_bytes:
+                self._entradas[clave] = (plan, tamano)
+                self._bytes += tamano
+                while len(self._entradas) > self.maximo_entradas or self._bytes > self.maximo_bytes:
+                    _, (_, tamano_expulsado) = self._entradas.popitem(last=False)
+                    self._bytes -= tamano_expulsado
+                    self.expulsiones += 1
+        return plan
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    @property
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            }
+
+def obtener_cache_planes():
+    """Devuelve la caché de planes de pago compartida del proceso"""
+    global _cache_planes
+    if _cache_planes is None:
+        with _lock_cache_planes:
+            if _cache_planes is None:
+                _cache_planes = CachePlanes()
+    return _cache_planes
+
+def plan_pagos_cacheado(clave):
+    """Plan de pagos de una clave de clave_plan, servido desde la caché del proceso"""
+    return obtener_cache_planes().obtener(clave)
+
+def matriz_sensibilidad(montos, tasas_interes, plazos_meses):
+    """
+    Cuota mensual, interés total y total pagado para cada combinación de monto,
+    tasa de interés anual (%) y plazo en meses, calculados en una sola pasada.
+
+    Returns:
+        DataFrame con una fila por combinación: monto, tasa_interes, plazo_meses,
+        cuota, interes_total y total_pagado
+    """
+    monto, tasa, plazo = np.meshgrid(
+        np.asarray(montos, dtype=float),
+        np.asarray(tasas_interes, dtype=float),
+        np.asarray(plazos_meses, dtype=np.int64),
+        indexing='ij',
+    )
+    cuota = cuota_fija(monto, tasa / 100 / 12, plazo)
+    # Con la última cuota ajustada el total coincide con cuota * plazo (salvo redondeo)
+    total_pagado = cuota * plazo
+    return pd.DataFrame({
+        'monto': monto.ravel(),
+        'tasa_interes': tasa.ravel(),
+        'plazo_meses': plazo.ravel(),
+        'cuota': cuota.ravel(),
+        'interes_total': (total_pagado - monto).ravel(),
+        'total_pagado': total_pagado.ravel(),
+    })
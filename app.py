@@ -1,20 +1,31 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 import os
 import plotly.express as px
 import plotly.graph_objects as go
 from passlib.hash import pbkdf2_sha256
 import uuid
+from types import MappingProxyType
+from dataclasses import dataclass
 import json
 import time
 import io
-from xlsxwriter import Workbook
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+import csv
+import gzip
+import tempfile
+from base_datos import (usar_conexion, ejecutar_escritura, ejecutar_sql_escritura, migrar,
+                        leer_marca, guardar_marca, ejecutar_una_vez, programar_tarea, reconstruir_saldos,
+                        cachear_lectura, obtener_cache_lecturas, obtener_generaciones, consulta_fts)
+from amortizacion import clave_plan, matriz_sensibilidad, obtener_cache_planes, plan_pagos_cacheado
+from exportaciones import (escribir_excel, escribir_pdf, excel_dataframe, formatear_lotes, hash_dataframe,
+                           obtener_cache_exportaciones, parquet_disponible, pdf_dataframe)
+from trabajos import (REPORTES, FORMATOS_TRABAJO, crear_trabajo, obtener_trabajos, obtener_pool_exportaciones,
+                      limpiar_exportaciones_vencidas, reporte_permitido)
+from auditoria import (registrar_evento, vaciar_auditoria, obtener_auditoria, archivar_auditoria,
+                       inventario_archivo_auditoria, consultar_archivo_auditoria, DIAS_RETENCION)
 
 # Configuración de la página
 st.set_page_config(
@@ -34,234 +45,286 @@ def verify_password(stored_password, provided_password):
 
 def registrar_actividad(usuario, accion, detalles=None):
     """Registra una actividad en el log de auditoría"""
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     ip_address = "local"  # En un entorno real, se obtendría la IP del cliente
     
     if detalles:
-        detalles_json = json.dumps(detalles)
+        # Sin escapar acentos para que la búsqueda de texto completo los encuentre
+        detalles_json = json.dumps(detalles, ensure_ascii=False)
     else:
         detalles_json = None
-        
-    c.execute(
-        "INSERT INTO log_auditoria (timestamp, usuario, accion, detalles, ip_address) VALUES (?, ?, ?, ?, ?)", 
-        (timestamp, usuario, accion, detalles_json, ip_address)
-    )
     
-    conn.commit()
-    conn.close()
+    # Se escribe en segundo plano por lotes; quien llama no espera la escritura
+    registrar_evento(timestamp, usuario, accion, detalles_json, ip_address)
 
 def autenticar(usuario, contrasena):
     """Autentica a un usuario verificando su contraseña hasheada"""
     try:
-        conn = sqlite3.connect('prestamos.db')
-        c = conn.cursor()
-        
-        # Verificar que los campos no estén vacíos
-        if not usuario or not contrasena:
-            return False, None, "Usuario y contraseña son obligatorios"
-        
-        # Buscar el usuario en la base de datos
-        c.execute("SELECT id, usuario, password_hash, nivel_acceso, activo FROM usuarios WHERE usuario = ?", (usuario,))
-        resultado = c.fetchone()
-        
-        if not resultado:
-            conn.close()
-            # Registrar intento fallido
-            registrar_actividad("sistema", "intento_login_fallido", {"usuario_intentado": usuario, "motivo": "usuario_no_existe"})
-            return False, None, "Usuario no encontrado"
-        
-        user_id, username, password_hash, nivel_acceso, activo = resultado
-        
-        # Verificar si la cuenta está activa
-        if activo != 1:
-            conn.close()
-            registrar_actividad("sistema", "intento_login_fallido", {"usuario": usuario, "motivo": "cuenta_inactiva"})
-            return False, None, "Cuenta desactivada. Contacte al administrador."
-        
-        # Verificar la contraseña
-        try:
-            if verify_password(password_hash, contrasena):
-                # Actualizar último acceso
-                ultimo_acceso = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                c.execute("UPDATE usuarios SET ultimo_acceso = ? WHERE id = ?", (ultimo_acceso, user_id))
-                conn.commit()
-                conn.close()
-                
-                # Registrar login exitoso
-                registrar_actividad(usuario, "login_exitoso")
-                
-                return True, nivel_acceso, "Autenticación exitosa"
-            else:
-                conn.close()
+        with usar_conexion() as conn:
+            c = conn.cursor()
+            
+            # Verificar que los campos no estén vacíos
+            if not usuario or not contrasena:
+                return False, None, "Usuario y contraseña son obligatorios"
+            
+            # Buscar el usuario en la base de datos
+            c.execute("SELECT id, usuario, password_hash, nivel_acceso, activo FROM usuarios WHERE usuario = ?", (usuario,))
+            resultado = c.fetchone()
+            
+            if not resultado:
                 # Registrar intento fallido
-                registrar_actividad("sistema", "intento_login_fallido", {"usuario": usuario, "motivo": "contrasena_incorrecta"})
-                return False, None, "Contraseña incorrecta"
-        except Exception as e:
-            conn.close()
-            # Registrar error en verificación de contraseña
-            registrar_actividad("sistema", "error_autenticacion", {"usuario": usuario, "error": str(e)})
-            return False, None, f"Error en la verificación: {str(e)}"
+                registrar_actividad("sistema", "intento_login_fallido", {"usuario_intentado": usuario, "motivo": "usuario_no_existe"})
+                return False, None, "Usuario no encontrado"
+            
+            user_id, username, password_hash, nivel_acceso, activo = resultado
+            
+            # Verificar si la cuenta está activa
+            if activo != 1:
+                registrar_actividad("sistema", "intento_login_fallido", {"usuario": usuario, "motivo": "cuenta_inactiva"})
+                return False, None, "Cuenta desactivada. Contacte al administrador."
+            
+            # Verificar la contraseña
+            try:
+                if verify_password(password_hash, contrasena):
+                    # Actualizar último acceso
+                    ultimo_acceso = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    ejecutar_sql_escritura("UPDATE usuarios SET ultimo_acceso = ? WHERE id = ?", (ultimo_acceso, user_id))
+                    
+                    # Registrar login exitoso
+                    registrar_actividad(usuario, "login_exitoso")
+                    
+                    return True, nivel_acceso, "Autenticación exitosa"
+                else:
+                    # Registrar intento fallido
+                    registrar_actividad("sistema", "intento_login_fallido", {"usuario": usuario, "motivo": "contrasena_incorrecta"})
+                    return False, None, "Contraseña incorrecta"
+            except Exception as e:
+                # Registrar error en verificación de contraseña
+                registrar_actividad("sistema", "error_autenticacion", {"usuario": usuario, "error": str(e)})
+                return False, None, f"Error en la verificación: {str(e)}"
     except Exception as e:
         # Capturar cualquier error inesperado
-        try:
-            conn.close()
-        except:
-            pass
         return False, None, f"Error de autenticación: {str(e)}"
 
-def obtener_usuarios():
+@cachear_lectura('usuarios')
+def obtener_usuarios(conn=None):
     """Obtiene la lista de usuarios del sistema"""
-    conn = sqlite3.connect('prestamos.db')
-    query = """
-    SELECT id, usuario, nivel_acceso, nombre_completo, email, ultimo_acceso, activo 
-    FROM usuarios
-    ORDER BY usuario
-    """
-    usuarios = pd.read_sql_query(query, conn)
-    conn.close()
-    return usuarios
+    with usar_conexion(conn) as conn:
+        query = """
+        SELECT id, usuario, nivel_acceso, nombre_completo, email, ultimo_acceso, activo 
+        FROM usuarios
+        ORDER BY usuario
+        """
+        usuarios = pd.read_sql_query(query, conn)
+        return usuarios
 
 def crear_usuario(usuario, contrasena, nivel_acceso, nombre_completo=None, email=None):
     """Crea un nuevo usuario en el sistema"""
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
     try:
         # Verificar si el usuario ya existe
-        c.execute("SELECT id FROM usuarios WHERE usuario = ?", (usuario,))
-        if c.fetchone():
-            conn.close()
+        with usar_conexion() as conn:
+            existente = conn.execute("SELECT id FROM usuarios WHERE usuario = ?", (usuario,)).fetchone()
+        if existente:
             return False, "El nombre de usuario ya está en uso"
         
-        # Hash de la contraseña
+        # Hash de la contraseña (fuera de la transacción de escritura, es costoso)
         password_hash = hash_password(contrasena)
         
         # Insertar nuevo usuario
-        c.execute(
+        ejecutar_sql_escritura(
             "INSERT INTO usuarios (usuario, password_hash, nivel_acceso, nombre_completo, email, activo) VALUES (?, ?, ?, ?, ?, 1)",
             (usuario, password_hash, nivel_acceso, nombre_completo, email)
         )
         
-        conn.commit()
-        
         # Registrar la creación del usuario
         usuario_actual = st.session_state.get('usuario', 'sistema')
         registrar_actividad(usuario_actual, "creacion_usuario", {"usuario_creado": usuario, "nivel": nivel_acceso})
         
-        conn.close()
         return True, "Usuario creado exitosamente"
     except Exception as e:
-        conn.close()
         return False, f"Error al crear usuario: {str(e)}"
 
 def cambiar_contrasena(usuario_id, contrasena_actual, nueva_contrasena):
     """Cambia la contraseña de un usuario"""
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
     try:
         # Obtener hash actual
-        c.execute("SELECT password_hash FROM usuarios WHERE id = ?", (usuario_id,))
-        resultado = c.fetchone()
+        with usar_conexion() as conn:
+            resultado = conn.execute("SELECT usuario, password_hash FROM usuarios WHERE id = ?", (usuario_id,)).fetchone()
         
         if not resultado:
-            conn.close()
             return False, "Usuario no encontrado"
         
-        password_hash = resultado[0]
+        nombre_usuario, password_hash = resultado
         
         # Verificar contraseña actual
         if not verify_password(password_hash, contrasena_actual):
-            conn.close()
             return False, "Contraseña actual incorrecta"
         
         # Generar nuevo hash
         nuevo_hash = hash_password(nueva_contrasena)
         
         # Actualizar contraseña
-        c.execute("UPDATE usuarios SET password_hash = ? WHERE id = ?", (nuevo_hash, usuario_id))
-        conn.commit()
+        ejecutar_sql_escritura("UPDATE usuarios SET password_hash = ? WHERE id = ?", (nuevo_hash, usuario_id))
         
         # Registrar cambio de contraseña
-        c.execute("SELECT usuario FROM usuarios WHERE id = ?", (usuario_id,))
-        nombre_usuario = c.fetchone()[0]
-        
         usuario_actual = st.session_state.get('usuario', 'sistema')
         registrar_actividad(usuario_actual, "cambio_contrasena", {"usuario_modificado": nombre_usuario})
         
-        conn.close()
         return True, "Contraseña actualizada exitosamente"
     except Exception as e:
-        conn.close()
         return False, f"Error al cambiar contraseña: {str(e)}"
 
 def actualizar_estado_usuario(usuario_id, activo):
     """Activa o desactiva un usuario"""
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
     try:
         # Verificar si el usuario existe
-        c.execute("SELECT usuario FROM usuarios WHERE id = ?", (usuario_id,))
-        resultado = c.fetchone()
+        with usar_conexion() as conn:
+            resultado = conn.execute("SELECT usuario FROM usuarios WHERE id = ?", (usuario_id,)).fetchone()
         
         if not resultado:
-            conn.close()
             return False, "Usuario no encontrado"
         
         nombre_usuario = resultado[0]
         
         # No permitir desactivar al usuario admin
         if nombre_usuario == 'admin' and activo == 0:
-            conn.close()
             return False, "No se puede desactivar al usuario administrador principal"
         
         # Actualizar estado
-        c.execute("UPDATE usuarios SET activo = ? WHERE id = ?", (activo, usuario_id))
-        conn.commit()
+        ejecutar_sql_escritura("UPDATE usuarios SET activo = ? WHERE id = ?", (activo, usuario_id))
         
         # Registrar cambio de estado
         estado = "activado" if activo == 1 else "desactivado"
         usuario_actual = st.session_state.get('usuario', 'sistema')
         registrar_actividad(usuario_actual, f"usuario_{estado}", {"usuario_modificado": nombre_usuario})
         
-        conn.close()
         return True, f"Usuario {estado} exitosamente"
     except Exception as e:
-        conn.close()
         return False, f"Error al actualizar estado del usuario: {str(e)}"
 
-def obtener_log_auditoria(limite=100, filtro_usuario=None, filtro_accion=None):
-    """Obtiene el registro de actividad del sistema"""
-    conn = sqlite3.connect('prestamos.db')
-    
-    query = "SELECT id, timestamp, usuario, accion, detalles, ip_address FROM log_auditoria"
+def filtros_log_auditoria(filtro_usuario=None, filtro_accion=None, texto=None, fecha_desde=None, fecha_hasta=None):
+    """Condiciones WHERE y parámetros para los filtros del log de auditoría.
+    filtro_accion busca solo en la acción y texto en acción, usuario y detalles (índice de texto completo).
+    fecha_desde y fecha_hasta (YYYY-MM-DD) son inclusivas."""
+    where_clauses = []
     params = []
     
-    # Aplicar filtros si existen
-    where_clauses = []
     if filtro_usuario:
         where_clauses.append("usuario = ?")
         params.append(filtro_usuario)
     
-    if filtro_accion:
-        where_clauses.append("accion LIKE ?")
-        params.append(f"%{filtro_accion}%")
+    busquedas = [consulta_fts(filtro_accion, 'accion') if filtro_accion else None,
+                 consulta_fts(texto) if texto else None]
+    busquedas = [busqueda for busqueda in busquedas if busqueda]
+    if busquedas:
+        where_clauses.append("id IN (SELECT rowid FROM log_auditoria_fts WHERE log_auditoria_fts MATCH ?)")
+        params.append(" AND ".join(busquedas))
     
-    if where_clauses:
-        query += " WHERE " + " AND ".join(where_clauses)
-    
-    query += " ORDER BY timestamp DESC LIMIT ?"
-    params.append(limite)
+    if fecha_desde:
+        where_clauses.append("timestamp >= ?")
+        params.append(str(fecha_desde))
     
-    log = pd.read_sql_query(query, conn, params=params)
-    conn.close()
+    if fecha_hasta:
+        where_clauses.append("timestamp < ?")
+        params.append((pd.Timestamp(fecha_hasta) + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
     
+    return where_clauses, params
+
+def obtener_log_auditoria(limite=100, filtro_usuario=None, filtro_accion=None, texto=None,
+                          fecha_desde=None, fecha_hasta=None, conn=None):
+    """Obtiene el registro de actividad del sistema (los más recientes primero)"""
+    log, _, _ = obtener_pagina_log_auditoria(limite, None, 'siguiente', filtro_usuario, filtro_accion,
+                                             texto, fecha_desde, fecha_hasta, conn=conn)
     return log
 
+def obtener_pagina_log_auditoria(tamano_pagina=100, cursor=None, direccion='siguiente', filtro_usuario=None,
+                                 filtro_accion=None, texto=None, fecha_desde=None, fecha_hasta=None, conn=None):
+    """Obtiene una página del log de auditoría paginando por (timestamp, id).
+    cursor es el (timestamp, id) del borde de la página actual; 'siguiente' avanza hacia registros
+    más antiguos y 'anterior' hacia más recientes. Devuelve (log, cursor_anterior, cursor_siguiente),
+    donde un cursor es None si no hay más registros en esa dirección."""
+    # Escribir los eventos que aún están en memoria para que el registro esté completo
+    if conn is None:
+        vaciar_auditoria()
+    
+    where_clauses, params = filtros_log_auditoria(filtro_usuario, filtro_accion, texto, fecha_desde, fecha_hasta)
+    hacia_antiguos = direccion == 'siguiente'
+    if cursor:
+        where_clauses.append("(timestamp, id) < (?, ?)" if hacia_antiguos else "(timestamp, id) > (?, ?)")
+        params.extend(cursor)
+    
+    query = "SELECT id, timestamp, usuario, accion, detalles, ip_address FROM log_auditoria"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    orden = "DESC" if hacia_antiguos else "ASC"
+    query += f" ORDER BY timestamp {orden}, id {orden} LIMIT ?"
+    # Un registro extra indica si hay más allá de esta página
+    params.append(tamano_pagina + 1)
+    
+    with usar_conexion(conn) as conn:
+        log = pd.read_sql_query(query, conn, params=params)
+    
+    hay_mas = len(log) > tamano_pagina
+    log = log.iloc[:tamano_pagina]
+    if not hacia_antiguos:
+        log = log.iloc[::-1]
+    log = log.reset_index(drop=True)
+    
+    if log.empty:
+        return log, None, None
+    
+    primero = (log['timestamp'].iloc[0], int(log['id'].iloc[0]))
+    ultimo = (log['timestamp'].iloc[-1], int(log['id'].iloc[-1]))
+    if hacia_antiguos:
+        return log, (primero if cursor else None), (ultimo if hay_mas else None)
+    return log, (primero if hay_mas else None), ultimo
+
+def iterar_log_auditoria(filtro_usuario=None, filtro_accion=None, texto=None, fecha_desde=None,
+                         fecha_hasta=None, tamano_lote=5000):
+    """Recorre todo el log de auditoría filtrado en lotes de filas, sin cargarlo completo en memoria"""
+    vaciar_auditoria()
+    
+    where_clauses, params = filtros_log_auditoria(filtro_usuario, filtro_accion, texto, fecha_desde, fecha_hasta)
+    query = "SELECT id, timestamp, usuario, accion, detalles, ip_address FROM log_auditoria"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    query += " ORDER BY timestamp DESC, id DESC"
+    
+    with usar_conexion() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                break
+            yield filas
+
+COLUMNAS_LOG_AUDITORIA = ['id', 'timestamp', 'usuario', 'accion', 'detalles', 'ip_address']
+TIPOS_EXCEL_LOG_AUDITORIA = ['entero', 'fecha_hora', 'texto', 'texto', 'texto', 'texto']
+
+def exportar_log_auditoria(archivo, formato='csv', **filtros):
+    """Escribe el log de auditoría filtrado en un archivo binario abierto, por lotes.
+    formato 'csv', 'ndjson.gz' (una línea JSON por registro, comprimido) o 'xlsx'. Devuelve las filas escritas."""
+    total = 0
+    if formato == 'xlsx':
+        total = escribir_excel(archivo, COLUMNAS_LOG_AUDITORIA, iterar_log_auditoria(**filtros),
+                               TIPOS_EXCEL_LOG_AUDITORIA, st.session_state.get('usuario'))
+    elif formato == 'ndjson.gz':
+        with gzip.GzipFile(fileobj=archivo, mode='wb') as comprimido:
+            for filas in iterar_log_auditoria(**filtros):
+                lineas = [json.dumps(dict(zip(COLUMNAS_LOG_AUDITORIA, fila)), ensure_ascii=False) for fila in filas]
+                comprimido.write(("\n".join(lineas) + "\n").encode('utf-8'))
+                total += len(filas)
+    else:
+        texto = io.TextIOWrapper(archivo, encoding='utf-8', newline='')
+        escritor = csv.writer(texto)
+        escritor.writerow(COLUMNAS_LOG_AUDITORIA)
+        for filas in iterar_log_auditoria(**filtros):
+            escritor.writerows(filas)
+            total += len(filas)
+        texto.flush()
+        texto.detach()
+    return total
+
 def cerrar_sesion():
     """Cierra la sesión del usuario actual"""
     # Registrar la actividad de cierre de sesión
@@ -287,93 +350,45 @@ def verificar_permiso(nivel_requerido):
     
     return nivel_usuario >= nivel_necesario
 
-# Crear base de datos si no existe
+# Crear o actualizar la base de datos
 def init_db():
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
+    # Aplicar las migraciones pendientes del esquema (crea las tablas en una base nueva)
+    migrar()
     
-    # Crear tabla de usuarios con nivel de acceso
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY,
-            usuario TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            nivel_acceso TEXT NOT NULL,
-            nombre_completo TEXT,
-            email TEXT,
-            ultimo_acceso TEXT,
-            activo INTEGER DEFAULT 1
-        )
-    ''')
-    
-    # Crear tabla de log de auditoría
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS log_auditoria (
-            id INTEGER PRIMARY KEY,
-            timestamp TEXT NOT NULL,
-            usuario TEXT NOT NULL,
-            accion TEXT NOT NULL,
-            detalles TEXT,
-            ip_address TEXT
-        )
-    ''')
-    
-    # Verificar si existe el usuario admin
-    c.execute("SELECT * FROM usuarios WHERE usuario = 'admin'")
-    if not c.fetchone():
-        # Crear usuario admin con contraseña hasheada
-        admin_password_hash = hash_password('admin123')
-        c.execute(
-            "INSERT INTO usuarios (usuario, password_hash, nivel_acceso, nombre_completo, email) VALUES (?, ?, ?, ?, ?)", 
-            ('admin', admin_password_hash, 'administrador', 'Administrador del Sistema', 'admin@sistema.com')
-        )
+    def crear_admin(conn):
+        c = conn.cursor()
         
-        # Registrar la creación del usuario admin en el log
-        c.execute(
-            "INSERT INTO log_auditoria (timestamp, usuario, accion, detalles, ip_address) VALUES (?, ?, ?, ?, ?)",
-            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'sistema', 'creacion_usuario', json.dumps({'usuario': 'admin', 'nivel': 'administrador'}), 'local')
-        )
-    
-    # Crear tabla de clientes
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS clientes (
-            id INTEGER PRIMARY KEY,
-            nombre TEXT NOT NULL,
-            cedula TEXT UNIQUE NOT NULL,
-            telefono TEXT NOT NULL
-        )
-    ''')
-    
-    # Crear tabla de préstamos
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS prestamos (
-            id INTEGER PRIMARY KEY,
-            cliente_id INTEGER NOT NULL,
-            monto REAL NOT NULL,
-            fecha_prestamo DATE NOT NULL,
-            fecha_vencimiento DATE NOT NULL,
-            tasa_interes REAL,
-            estado TEXT DEFAULT 'Pendiente',
-            FOREIGN KEY (cliente_id) REFERENCES clientes(id)
-        )
-    ''')
-    
-    # Crear tabla de pagos
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS pagos (
-            id INTEGER PRIMARY KEY,
-            prestamo_id INTEGER NOT NULL,
-            fecha_pago DATE NOT NULL,
-            monto_pagado REAL NOT NULL,
-            FOREIGN KEY (prestamo_id) REFERENCES prestamos(id)
-        )
-    ''')
+        # Verificar si existe el usuario admin
+        c.execute("SELECT * FROM usuarios WHERE usuario = 'admin'")
+        if not c.fetchone():
+            # Crear usuario admin con contraseña hasheada
+            admin_password_hash = hash_password('admin123')
+            c.execute(
+                "INSERT INTO usuarios (usuario, password_hash, nivel_acceso, nombre_completo, email) VALUES (?, ?, ?, ?, ?)", 
+                ('admin', admin_password_hash, 'administrador', 'Administrador del Sistema', 'admin@sistema.com')
+            )
+            
+            # Registrar la creación del usuario admin en el log
+            c.execute(
+                "INSERT INTO log_auditoria (timestamp, usuario, accion, detalles, ip_address) VALUES (?, ?, ?, ?, ?)",
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'sistema', 'creacion_usuario', json.dumps({'usuario': 'admin', 'nivel': 'administrador'}), 'local')
+            )
     
-    conn.commit()
-    conn.close()
+    ejecutar_escritura(crear_admin)
 
-# Inicializar la base de datos
-init_db()
+# Intervalo de la tarea que marca préstamos atrasados (en segundos)
+INTERVALO_ESTADOS_PRESTAMOS = int(os.environ.get('PRESTAMOS_INTERVALO_ESTADOS', '900'))
+
+def inicializar_sistema():
+    """Prepara la base de datos y las tareas de fondo; se ejecuta una vez por proceso"""
+    init_db()
+    programar_tarea("estados_prestamos", actualizar_estados_prestamos, INTERVALO_ESTADOS_PRESTAMOS)
+    # La retención borra historial de auditoría: solo se programa si se configuró PRESTAMOS_AUDITORIA_RETENCION_DIAS
+    if DIAS_RETENCION > 0:
+        programar_tarea("retencion_auditoria", archivar_auditoria, 24 * 3600)
+    programar_tarea("exportaciones_vencidas", limpiar_exportaciones_vencidas, 3600)
+    obtener_pool_exportaciones()
+    return True
 
 # La función de autenticación ya está definida al inicio del archivo
 
@@ -392,197 +407,421 @@ if 'prestamo_creado' not in st.session_state:
 def cerrar_sesion():
     st.session_state.autenticado = False
 
+# Máximo de resultados que muestra la búsqueda de clientes
+LIMITE_BUSQUEDA_CLIENTES = 100
+
 # Funciones para gestión de clientes
 def agregar_cliente(nombre, cedula, telefono):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO clientes (nombre, cedula, telefono) VALUES (?, ?, ?)", 
-                 (nombre, cedula, telefono))
-        conn.commit()
+        ejecutar_sql_escritura("INSERT INTO clientes (nombre, cedula, telefono) VALUES (?, ?, ?)", 
+                               (nombre, cedula, telefono))
         exito = True
         mensaje = "Cliente agregado exitosamente"
     except sqlite3.IntegrityError:
         exito = False
         mensaje = "Error: La cédula ya existe en la base de datos"
-    conn.close()
     return exito, mensaje
 
-def obtener_clientes():
-    conn = sqlite3.connect('prestamos.db')
-    query = "SELECT id, nombre, cedula, telefono FROM clientes"
-    clientes = pd.read_sql_query(query, conn)
-    conn.close()
-    return clientes
-
-def obtener_cliente(id_cliente):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    c.execute("SELECT id, nombre, cedula, telefono FROM clientes WHERE id = ?", (id_cliente,))
-    cliente = c.fetchone()
-    conn.close()
-    return cliente
+# Índices id -> etiqueta para los selectores. Se construyen una vez por versión de los datos
+# y se comparten entre sesiones (son de solo lectura), así format_func es una búsqueda O(1)
+ETIQUETA_CLIENTE = "{nombre} - {cedula}"
+ETIQUETA_CLIENTE_CEDULA = "{nombre} - Cédula: {cedula}"
+
+@cachear_lectura('clientes', copiar=False)
+def obtener_etiquetas_clientes(plantilla=ETIQUETA_CLIENTE, conn=None):
+    """Devuelve {id: etiqueta} de todos los clientes ordenados por nombre"""
+    with usar_conexion(conn) as conn:
+        filas = conn.execute("SELECT id, nombre, cedula, telefono FROM clientes ORDER BY nombre, id")
+        return MappingProxyType({
+            fila[0]: plantilla.format(nombre=fila[1], cedula=fila[2], telefono=fila[3])
+            for fila in filas
+        })
+
+ETIQUETA_PRESTAMO = "ID: {id} - Cliente: {nombre} - Monto: ${monto} - Vence: {fecha_vencimiento}"
+ETIQUETA_PRESTAMO_ESTADO = "ID: {id} - Cliente: {nombre} - Monto: {monto} - Estado: {estado}"
+
+@cachear_lectura('prestamos', 'clientes', copiar=False)
+def obtener_etiquetas_prestamos(plantilla=ETIQUETA_PRESTAMO, conn=None):
+    """Devuelve {id: etiqueta} de todos los préstamos"""
+    with usar_conexion(conn) as conn:
+        filas = conn.execute("""
+        SELECT p.id, c.nombre, p.monto, p.fecha_vencimiento, p.estado
+        FROM prestamos p
+        JOIN clientes c ON p.cliente_id = c.id
+        ORDER BY p.id
+        """)
+        return MappingProxyType({
+            fila[0]: plantilla.format(id=fila[0], nombre=fila[1], monto=fila[2],
+                                      fecha_vencimiento=fila[3], estado=fila[4])
+            for fila in filas
+        })
+
+def etiquetas_por_id(df, columna_id, etiqueta):
+    """Arma {id: etiqueta} a partir de un DataFrame; etiqueta recibe cada fila como namedtuple"""
+    return {getattr(fila, columna_id): etiqueta(fila) for fila in df.itertuples(index=False)}
+
+# Columnas por las que se puede ordenar cada listado (nombre visible -> expresión SQL)
+ORDEN_CLIENTES = {
+    'Nombre': 'nombre',
+    'Cédula': 'cedula',
+    'Teléfono': 'telefono',
+    'ID': 'id',
+}
+ORDEN_PRESTAMOS = {
+    'ID': 'p.id',
+    'Cliente': 'c.nombre',
+    'Monto': 'p.monto',
+    'Fecha Préstamo': 'p.fecha_prestamo',
+    'Fecha Vencimiento': 'p.fecha_vencimiento',
+    'Estado': 'p.estado',
+}
+
+@cachear_lectura('clientes')
+def obtener_pagina_clientes(tamano_pagina=50, pagina=1, orden='Nombre', descendente=False, conn=None):
+    """Devuelve (clientes, total) con una sola página de clientes ordenada en la base de datos"""
+    columna = ORDEN_CLIENTES.get(orden, 'nombre')
+    direccion = "DESC" if descendente else "ASC"
+    query = f"""
+    SELECT id, nombre, cedula, telefono
+    FROM clientes
+    ORDER BY {columna} {direccion}, id {direccion}
+    LIMIT ? OFFSET ?
+    """
+    with usar_conexion(conn) as conn:
+        clientes = pd.read_sql_query(query, conn, params=(tamano_pagina, (pagina - 1) * tamano_pagina))
+        total = conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0]
+    return clientes, total
+
+def _filtros_prestamos(cliente_id=None, estado=None):
+    where_clauses = []
+    params = []
+    if cliente_id is not None:
+        where_clauses.append("p.cliente_id = ?")
+        params.append(int(cliente_id))
+    if estado:
+        where_clauses.append("p.estado = ?")
+        params.append(estado)
+    return (" WHERE " + " AND ".join(where_clauses) if where_clauses else ""), params
+
+@cachear_lectura('prestamos')
+def contar_prestamos(cliente_id=None, estado=None, conn=None):
+    """Cantidad de préstamos que cumplen los filtros"""
+    where, params = _filtros_prestamos(cliente_id, estado)
+    with usar_conexion(conn) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM prestamos p{where}", params).fetchone()[0]
+
+@cachear_lectura('prestamos', 'clientes')
+def obtener_pagina_prestamos(tamano_pagina=50, pagina=1, orden='ID', descendente=True, cliente_id=None,
+                             estado=None, conn=None):
+    """Devuelve (prestamos, total) con una sola página de préstamos, filtrada y ordenada en la base de datos"""
+    where, params = _filtros_prestamos(cliente_id, estado)
+    
+    columna = ORDEN_PRESTAMOS.get(orden, 'p.id')
+    direccion = "DESC" if descendente else "ASC"
+    query = f"""
+    SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
+           p.tasa_interes, p.estado, p.cliente_id
+    FROM prestamos p
+    JOIN clientes c ON p.cliente_id = c.id
+    {where}
+    ORDER BY {columna} {direccion}, p.id {direccion}
+    LIMIT ? OFFSET ?
+    """
+    with usar_conexion(conn) as conn:
+        prestamos = pd.read_sql_query(query, conn, params=params + [tamano_pagina, (pagina - 1) * tamano_pagina])
+        total = conn.execute(f"SELECT COUNT(*) FROM prestamos p{where}", params).fetchone()[0]
+    return prestamos, total
+
+COLUMNAS_EXPORTACION_PRESTAMOS = ['ID', 'Cliente', 'Cédula', 'Monto', 'Fecha Préstamo', 'Fecha Vencimiento',
+                                  'Tasa Interés', 'Estado']
+TIPOS_EXPORTACION_PRESTAMOS = ['entero', 'texto', 'texto', 'moneda', 'fecha', 'fecha', 'porcentaje', 'texto']
+
+def iterar_prestamos(orden='ID', descendente=True, cliente_id=None, estado=None, tamano_lote=5000):
+    """Recorre los préstamos filtrados y ordenados en lotes de filas, sin cargarlos completos en memoria"""
+    where, params = _filtros_prestamos(cliente_id, estado)
+    columna = ORDEN_PRESTAMOS.get(orden, 'p.id')
+    direccion = "DESC" if descendente else "ASC"
+    query = f"""
+    SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, p.tasa_interes, p.estado
+    FROM prestamos p
+    JOIN clientes c ON p.cliente_id = c.id
+    {where}
+    ORDER BY {columna} {direccion}, p.id {direccion}
+    """
+    with usar_conexion() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                break
+            yield filas
+
+def exportar_lotes(archivo, formato, columnas, tipos, lotes, titulo, columnas_total=()):
+    """Escribe lotes de filas en un archivo binario abierto: 'xlsx' con columnas tipadas,
+    'csv' y 'pdf' con los valores formateados. Devuelve las filas escritas."""
+    usuario = st.session_state.get('usuario')
+    if formato == 'xlsx':
+        return escribir_excel(archivo, columnas, lotes, tipos, usuario)
+    lotes = formatear_lotes(lotes, tipos)
+    if formato == 'pdf':
+        return escribir_pdf(archivo, columnas, lotes, titulo, usuario, columnas_total)
+    total = 0
+    texto = io.TextIOWrapper(archivo, encoding='utf-8', newline='')
+    escritor = csv.writer(texto)
+    escritor.writerow(columnas)
+    for filas in lotes:
+        escritor.writerows(filas)
+        total += len(filas)
+    texto.flush()
+    texto.detach()
+    return total
+
+def exportar_prestamos(archivo, formato='csv', **filtros):
+    """Escribe la lista de préstamos filtrada en un archivo binario abierto, por lotes"""
+    return exportar_lotes(archivo, formato, COLUMNAS_EXPORTACION_PRESTAMOS, TIPOS_EXPORTACION_PRESTAMOS,
+                          iterar_prestamos(**filtros), "Reporte: lista_prestamos", ['Monto'])
+
+def iterar_clientes(orden='Nombre', descendente=False, tamano_lote=5000):
+    """Recorre todos los clientes ordenados en lotes de filas, sin cargarlos completos en memoria"""
+    columna = ORDEN_CLIENTES.get(orden, 'nombre')
+    direccion = "DESC" if descendente else "ASC"
+    with usar_conexion() as conn:
+        cursor = conn.execute(f"SELECT id, nombre, cedula, telefono FROM clientes ORDER BY {columna} {direccion}, id {direccion}")
+        while True:
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                break
+            yield filas
+
+def exportar_clientes(archivo, formato='csv', **filtros):
+    """Escribe la lista de clientes en un archivo binario abierto, por lotes"""
+    return exportar_lotes(archivo, formato, ['ID', 'Nombre', 'Cédula', 'Teléfono'], ['entero', 'texto', 'texto', 'texto'],
+                          iterar_clientes(**filtros), "Reporte: lista_clientes")
+
+@cachear_lectura('clientes')
+def contar_clientes(conn=None):
+    with usar_conexion(conn) as conn:
+        return conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0]
+
+@cachear_lectura('clientes')
+def buscar_clientes(texto, limite=100, desplazamiento=0, conn=None):
+    """Busca clientes por nombre, cédula o teléfono (subcadenas, sin distinguir mayúsculas).
+    Devuelve (clientes, total) con la página pedida ordenada por relevancia y el total de coincidencias."""
+    # El índice trigram solo sirve para términos de al menos 3 caracteres; los más cortos
+    # se filtran con LIKE sobre las filas que ya coinciden
+    terminos = texto.split()
+    indexables = [t for t in terminos if len(t) >= 3]
+    cortos = [t for t in terminos if len(t) < 3]
+    
+    where_clauses = []
+    params = []
+    if indexables:
+        origen = "clientes_fts f JOIN clientes c ON c.id = f.rowid"
+        where_clauses.append("clientes_fts MATCH ?")
+        params.append(" ".join('"' + t.replace('"', '""') + '"' for t in indexables))
+        orden = "bm25(clientes_fts)"
+    else:
+        origen = "clientes c"
+        orden = "c.nombre"
+    for termino in cortos:
+        where_clauses.append("(c.nombre LIKE ? OR c.cedula LIKE ? OR c.telefono LIKE ?)")
+        params.extend([f"%{termino}%"] * 3)
+    where = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    
+    query = f"SELECT c.id, c.nombre, c.cedula, c.telefono FROM {origen}{where} ORDER BY {orden} LIMIT ? OFFSET ?"
+    params_pagina = params + [limite, desplazamiento]
+    
+    with usar_conexion(conn) as conn:
+        clientes = pd.read_sql_query(query, conn, params=params_pagina)
+        total = conn.execute(f"SELECT COUNT(*) FROM {origen}{where}", params).fetchone()[0]
+    return clientes, total
+
+def obtener_cliente(id_cliente, conn=None):
+    with usar_conexion(conn) as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, nombre, cedula, telefono FROM clientes WHERE id = ?", (id_cliente,))
+        cliente = c.fetchone()
+        return cliente
 
 def actualizar_cliente(id_cliente, nombre, cedula, telefono):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
     try:
-        c.execute("UPDATE clientes SET nombre = ?, cedula = ?, telefono = ? WHERE id = ?", 
-                 (nombre, cedula, telefono, id_cliente))
-        conn.commit()
+        ejecutar_sql_escritura("UPDATE clientes SET nombre = ?, cedula = ?, telefono = ? WHERE id = ?", 
+                               (nombre, cedula, telefono, id_cliente))
         exito = True
         mensaje = "Cliente actualizado exitosamente"
     except sqlite3.IntegrityError:
         exito = False
         mensaje = "Error: La cédula ya existe en la base de datos"
-    conn.close()
     return exito, mensaje
 
 def eliminar_cliente(id_cliente):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    c.execute("DELETE FROM clientes WHERE id = ?", (id_cliente,))
-    conn.commit()
-    conn.close()
+    ejecutar_sql_escritura("DELETE FROM clientes WHERE id = ?", (id_cliente,))
+
+# Máximo de préstamos que muestra la búsqueda de préstamos activos
+LIMITE_BUSQUEDA_PRESTAMOS = 50
+
+@cachear_lectura('prestamos', 'clientes')
+def buscar_prestamos_activos(texto="", limite=LIMITE_BUSQUEDA_PRESTAMOS, conn=None):
+    """Busca préstamos no pagados por ID, nombre o cédula del cliente y devuelve los primeros
+    resultados; sin texto devuelve los próximos a vencer"""
+    terminos = texto.split()
+    indexables = [t for t in terminos if len(t) >= 3]
+    cortos = [t for t in terminos if len(t) < 3]
+    
+    where_clauses = ["p.estado != 'Pagado'"]
+    params = []
+    # Los clientes se filtran con el índice trigram; los términos cortos con LIKE
+    if indexables:
+        where_clauses.append("p.cliente_id IN (SELECT rowid FROM clientes_fts WHERE clientes_fts MATCH ?)")
+        params.append(" ".join('"' + t.replace('"', '""') + '"' for t in indexables))
+    for termino in cortos:
+        where_clauses.append("(c.nombre LIKE ? OR c.cedula LIKE ?)")
+        params.extend([f"%{termino}%"] * 2)
+    where = " AND ".join(where_clauses)
+    
+    # Un número también puede ser el ID del préstamo (búsqueda por clave primaria)
+    orden = "p.fecha_vencimiento, p.id"
+    if texto.isdigit():
+        where = f"({where}) OR (p.id = ? AND p.estado != 'Pagado')"
+        params.append(int(texto))
+        orden = f"p.id = {int(texto)} DESC, {orden}"
+    
+    query = f"""
+    SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_vencimiento, p.estado, p.saldo_pendiente
+    FROM prestamos p
+    JOIN clientes c ON p.cliente_id = c.id
+    WHERE {where}
+    ORDER BY {orden}
+    LIMIT ?
+    """
+    with usar_conexion(conn) as conn:
+        return pd.read_sql_query(query, conn, params=params + [limite])
 
 # Funciones para gestión de préstamos
 def crear_prestamo(cliente_id, monto, fecha_prestamo, fecha_vencimiento, tasa_interes=None):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO prestamos (cliente_id, monto, fecha_prestamo, fecha_vencimiento, tasa_interes) VALUES (?, ?, ?, ?, ?)", 
-                 (cliente_id, monto, fecha_prestamo, fecha_vencimiento, tasa_interes))
-        conn.commit()
+        estado = estado_inicial_prestamo(fecha_vencimiento)
+        ejecutar_sql_escritura("INSERT INTO prestamos (cliente_id, monto, fecha_prestamo, fecha_vencimiento, tasa_interes, estado) VALUES (?, ?, ?, ?, ?, ?)", 
+                               (cliente_id, monto, fecha_prestamo, fecha_vencimiento, tasa_interes, estado))
         exito = True
         mensaje = "Préstamo registrado exitosamente"
     except Exception as e:
         exito = False
         mensaje = f"Error al registrar el préstamo: {str(e)}"
-    conn.close()
     return exito, mensaje
 
-def obtener_prestamos():
-    conn = sqlite3.connect('prestamos.db')
-    query = """
-    SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
-           p.tasa_interes, p.estado, p.cliente_id
-    FROM prestamos p
-    JOIN clientes c ON p.cliente_id = c.id
-    """
-    prestamos = pd.read_sql_query(query, conn)
-    conn.close()
-    return prestamos
+@cachear_lectura('prestamos', 'clientes')
+def obtener_prestamos_cliente(cliente_id, conn=None):
+    with usar_conexion(conn) as conn:
+        query = """
+        SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
+               p.tasa_interes, p.estado
+        FROM prestamos p
+        JOIN clientes c ON p.cliente_id = c.id
+        WHERE p.cliente_id = ?
+        """
+        prestamos = pd.read_sql_query(query, conn, params=(cliente_id,))
+        return prestamos
 
-def obtener_prestamos_cliente(cliente_id):
-    conn = sqlite3.connect('prestamos.db')
-    query = """
-    SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
-           p.tasa_interes, p.estado
-    FROM prestamos p
-    JOIN clientes c ON p.cliente_id = c.id
-    WHERE p.cliente_id = ?
-    """
-    prestamos = pd.read_sql_query(query, conn, params=(cliente_id,))
-    conn.close()
-    return prestamos
-
-def obtener_prestamo(id_prestamo):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    c.execute("""
-    SELECT p.id, p.cliente_id, c.nombre, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
-           p.tasa_interes, p.estado
-    FROM prestamos p
-    JOIN clientes c ON p.cliente_id = c.id
-    WHERE p.id = ?
-    """, (id_prestamo,))
-    prestamo = c.fetchone()
-    conn.close()
-    return prestamo
+def obtener_prestamo(id_prestamo, conn=None):
+    with usar_conexion(conn) as conn:
+        c = conn.cursor()
+        c.execute("""
+        SELECT p.id, p.cliente_id, c.nombre, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
+               p.tasa_interes, p.estado
+        FROM prestamos p
+        JOIN clientes c ON p.cliente_id = c.id
+        WHERE p.id = ?
+        """, (id_prestamo,))
+        prestamo = c.fetchone()
+        return prestamo
 
 def actualizar_estado_prestamo(id_prestamo, estado):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    c.execute("UPDATE prestamos SET estado = ? WHERE id = ?", (estado, id_prestamo))
-    conn.commit()
-    conn.close()
+    ejecutar_sql_escritura("UPDATE prestamos SET estado = ? WHERE id = ?", (estado, id_prestamo))
 
 def actualizar_estados_prestamos():
-    # Actualiza el estado de los préstamos según la fecha actual
+    """Marca como atrasados los préstamos cuyo vencimiento pasó desde la última ejecución"""
     fecha_actual = datetime.now().strftime('%Y-%m-%d')
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
     
-    # Marcar préstamos como atrasados si la fecha de vencimiento ha pasado
-    c.execute("""
-    UPDATE prestamos 
-    SET estado = 'Atrasado' 
-    WHERE fecha_vencimiento < ? AND estado = 'Pendiente'
-    """, (fecha_actual,))
+    def actualizar(conn):
+        # La marca de agua indica hasta qué fecha ya se revisaron los vencimientos
+        revisado_hasta = leer_marca(conn, 'estados_prestamos_hasta')
+        if revisado_hasta == fecha_actual:
+            return 0
+        
+        query = "UPDATE prestamos SET estado = 'Atrasado' WHERE estado = 'Pendiente' AND fecha_vencimiento < ?"
+        params = [fecha_actual]
+        if revisado_hasta:
+            query += " AND fecha_vencimiento >= ?"
+            params.append(revisado_hasta)
+        
+        actualizados = conn.execute(query, params).rowcount
+        guardar_marca(conn, 'estados_prestamos_hasta', fecha_actual)
+        return actualizados
     
-    conn.commit()
-    conn.close()
+    return ejecutar_escritura(actualizar)
+
+def estado_inicial_prestamo(fecha_vencimiento, estado='Pendiente'):
+    """Un préstamo pendiente con vencimiento pasado nace atrasado (la tarea periódica no lo revisará)"""
+    if estado == 'Pendiente' and fecha_vencimiento < datetime.now().strftime('%Y-%m-%d'):
+        return 'Atrasado'
+    return estado
     
 # Función para editar un préstamo
 def editar_prestamo(id_prestamo, monto, fecha_prestamo, fecha_vencimiento, tasa_interes, estado):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
+    estado = estado_inicial_prestamo(fecha_vencimiento, estado)
     try:
-        c.execute("""
+        ejecutar_sql_escritura("""
         UPDATE prestamos 
         SET monto = ?, fecha_prestamo = ?, fecha_vencimiento = ?, tasa_interes = ?, estado = ? 
         WHERE id = ?
         """, (monto, fecha_prestamo, fecha_vencimiento, tasa_interes, estado, id_prestamo))
-        conn.commit()
         exito = True
         mensaje = "Préstamo actualizado exitosamente"
     except Exception as e:
         exito = False
         mensaje = f"Error al actualizar el préstamo: {str(e)}"
-    conn.close()
     return exito, mensaje
 
 # Función para eliminar un préstamo
 def eliminar_prestamo(id_prestamo):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    try:
+    def eliminar(conn):
         # Primero eliminar los pagos asociados al préstamo
-        c.execute("DELETE FROM pagos WHERE prestamo_id = ?", (id_prestamo,))
+        conn.execute("DELETE FROM pagos WHERE prestamo_id = ?", (id_prestamo,))
         
         # Luego eliminar el préstamo
-        c.execute("DELETE FROM prestamos WHERE id = ?", (id_prestamo,))
-        
-        conn.commit()
+        conn.execute("DELETE FROM prestamos WHERE id = ?", (id_prestamo,))
+    
+    try:
+        ejecutar_escritura(eliminar)
         exito = True
         mensaje = "Préstamo eliminado exitosamente"
     except Exception as e:
         exito = False
         mensaje = f"Error al eliminar el préstamo: {str(e)}"
-    conn.close()
     return exito, mensaje
 
 # Obtiene distribución de préstamos por cliente (top 10)
-def obtener_top_clientes():
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
+@cachear_lectura('prestamos', 'clientes')
+def obtener_top_clientes(conn=None):
+    with usar_conexion(conn) as conn:
+        c = conn.cursor()
     
-    c.execute("""
-        SELECT c.nombre, COUNT(p.id) as num_prestamos, SUM(p.monto) as monto_total
-        FROM prestamos p
-        JOIN clientes c ON p.cliente_id = c.id
-        GROUP BY p.cliente_id
-        ORDER BY monto_total DESC
-        LIMIT 10
-    """)
+        c.execute("""
+            SELECT c.nombre, COUNT(p.id) as num_prestamos, SUM(p.monto) as monto_total
+            FROM prestamos p
+            JOIN clientes c ON p.cliente_id = c.id
+            GROUP BY p.cliente_id
+            ORDER BY monto_total DESC
+            LIMIT 10
+        """)
     
-    resultados = c.fetchall()
-    conn.close()
+        resultados = c.fetchall()
     
-    if not resultados:
-        return pd.DataFrame(columns=['nombre', 'num_prestamos', 'monto_total'])
+        if not resultados:
+            return pd.DataFrame(columns=['nombre', 'num_prestamos', 'monto_total'])
     
-    return pd.DataFrame(resultados, columns=['nombre', 'num_prestamos', 'monto_total'])
+        return pd.DataFrame(resultados, columns=['nombre', 'num_prestamos', 'monto_total'])
 
 # Funciones para calculadora de préstamos
 def calcular_plan_pagos(monto, tasa_interes, plazo_meses, fecha_inicio=None):
@@ -596,346 +835,213 @@ def calcular_plan_pagos(monto, tasa_interes, plazo_meses, fecha_inicio=None):
         fecha_inicio: Fecha de inicio del préstamo (opcional)
     
     Returns:
-        DataFrame con el plan de pagos
+        DataFrame con el plan de pagos (ver amortizacion.plan_pagos). Se comparte
+        con otras sesiones a través de la caché de planes: no modificarlo.
     """
-    if fecha_inicio is None:
-        fecha_inicio = datetime.now()
-    elif isinstance(fecha_inicio, str):
-        fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-    
-    # Convertir tasa anual a mensual
-    tasa_mensual = tasa_interes / 100 / 12
-    
-    # Calcular cuota mensual (fórmula de amortización francesa)
-    if tasa_mensual > 0:
-        cuota_mensual = monto * (tasa_mensual * (1 + tasa_mensual) ** plazo_meses) / ((1 + tasa_mensual) ** plazo_meses - 1)
-    else:
-        cuota_mensual = monto / plazo_meses
-    
-    # Generar plan de pagos
-    plan = []
-    saldo = monto
-    
-    for mes in range(1, plazo_meses + 1):
-        # Calcular fecha de pago
-        fecha_pago = fecha_inicio + timedelta(days=30 * mes)
-        
-        # Calcular interés del periodo
-        interes = saldo * tasa_mensual
-        
-        # Calcular amortización
-        amortizacion = cuota_mensual - interes
-        
-        # Actualizar saldo
-        nuevo_saldo = saldo - amortizacion
-        
-        # Ajuste para el último pago (por redondeos)
-        if mes == plazo_meses:
-            amortizacion = saldo
-            cuota_mensual = amortizacion + interes
-            nuevo_saldo = 0
-        
-        # Agregar al plan
-        plan.append({
-            'num_pago': mes,
-            'fecha_pago': fecha_pago.strftime('%Y-%m-%d'),
-            'cuota': cuota_mensual,
-            'capital': amortizacion,
-            'interes': interes,
-            'saldo': nuevo_saldo
-        })
-        
-        # Actualizar saldo para el siguiente mes
-        saldo = nuevo_saldo
-    
-    return pd.DataFrame(plan)
+    return plan_pagos_cacheado(clave_plan(monto, tasa_interes, plazo_meses, fecha_inicio))
 
 # Funciones para dashboard
-def obtener_datos_tendencias(meses=6):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
-    # Fecha actual
-    fecha_actual = datetime.now()
-    
-    # Obtener datos de los últimos X meses
-    datos_meses = []
-    
-    for i in range(meses, 0, -1):
-        # Calcular el primer y último día del mes
-        fecha_mes = fecha_actual - timedelta(days=30*i)
-        primer_dia = datetime(fecha_mes.year, fecha_mes.month, 1).strftime('%Y-%m-%d')
-        
-        if fecha_mes.month == 12:
-            ultimo_dia = datetime(fecha_mes.year + 1, 1, 1) - timedelta(days=1)
-        else:
-            ultimo_dia = datetime(fecha_mes.year, fecha_mes.month + 1, 1) - timedelta(days=1)
-        ultimo_dia = ultimo_dia.strftime('%Y-%m-%d')
-        
-        # Nombre del mes para mostrar
-        nombre_mes = fecha_mes.strftime('%b %Y')
-        
-        # Contar préstamos creados en ese mes
-        c.execute("""
-            SELECT COUNT(*), SUM(monto) 
-            FROM prestamos 
-            WHERE fecha_prestamo BETWEEN ? AND ?
-        """, (primer_dia, ultimo_dia))
-        prestamos_creados = c.fetchone()
-        num_prestamos = prestamos_creados[0] if prestamos_creados[0] else 0
-        monto_prestamos = prestamos_creados[1] if prestamos_creados[1] else 0
-        
-        # Contar pagos realizados en ese mes
-        c.execute("""
-            SELECT COUNT(*), SUM(monto_pagado) 
-            FROM pagos 
-            WHERE fecha_pago BETWEEN ? AND ?
-        """, (primer_dia, ultimo_dia))
-        pagos_realizados = c.fetchone()
-        num_pagos = pagos_realizados[0] if pagos_realizados[0] else 0
-        monto_pagos = pagos_realizados[1] if pagos_realizados[1] else 0
-        
-        # Contar préstamos morosos al final del mes
-        c.execute("""
-            SELECT COUNT(*) 
-            FROM prestamos 
-            WHERE estado = 'Atrasado' AND fecha_vencimiento <= ?
-        """, (ultimo_dia,))
-        morosos = c.fetchone()
-        num_morosos = morosos[0] if morosos[0] else 0
-        
-        datos_meses.append({
-            'mes': nombre_mes,
-            'num_prestamos': num_prestamos,
-            'monto_prestamos': monto_prestamos,
-            'num_pagos': num_pagos,
-            'monto_pagos': monto_pagos,
-            'num_morosos': num_morosos
-        })
-    
-    conn.close()
-    return pd.DataFrame(datos_meses)
-
-def obtener_distribucion_estados():
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
-    c.execute("""
-        SELECT estado, COUNT(*) as cantidad, SUM(monto) as monto_total
-        FROM prestamos
-        GROUP BY estado
-    """)
-    
-    resultados = c.fetchall()
-    conn.close()
-    
-    if not resultados:
-        return pd.DataFrame(columns=['estado', 'cantidad', 'monto_total'])
-    
-    return pd.DataFrame(resultados, columns=['estado', 'cantidad', 'monto_total'])
+def obtener_datos_tendencias(meses=6, conn=None):
+    """Préstamos otorgados, pagos recibidos y morosidad por mes calendario en los `meses`
+    meses completos anteriores al actual (el mes en curso no se incluye)"""
+    # Meses calendario de la ventana, terminando en el mes anterior al actual
+    periodos = pd.period_range(end=pd.Period(datetime.now(), freq='M') - 1, periods=meses, freq='M')
+    inicio = periodos[0].start_time.strftime('%Y-%m-%d')
+    fin = (periodos[-1] + 1).start_time.strftime('%Y-%m-%d')
+    primer_mes = periodos[0].strftime('%Y-%m')
+    
+    # Una sola consulta para toda la ventana; los morosos anteriores a la ventana
+    # se acumulan en el primer mes
+    query = """
+    SELECT 'prestamos' AS serie, strftime('%Y-%m', fecha_prestamo) AS mes, COUNT(*) AS cantidad, SUM(monto) AS monto
+    FROM prestamos
+    WHERE fecha_prestamo >= ? AND fecha_prestamo < ?
+    GROUP BY mes
+    UNION ALL
+    SELECT 'pagos', strftime('%Y-%m', fecha_pago) AS mes, COUNT(*), SUM(monto_pagado)
+    FROM pagos
+    WHERE fecha_pago >= ? AND fecha_pago < ?
+    GROUP BY mes
+    UNION ALL
+    SELECT 'morosos', MAX(strftime('%Y-%m', fecha_vencimiento), ?) AS mes, COUNT(*), NULL
+    FROM prestamos
+    WHERE estado = 'Atrasado' AND fecha_vencimiento < ?
+    GROUP BY mes
+    """
+    with usar_conexion(conn) as conn:
+        filas = pd.read_sql_query(query, conn, params=(inicio, fin, inicio, fin, primer_mes, fin))
+    
+    # Una fila por mes de la ventana, rellenando los meses sin movimientos
+    tabla = filas.pivot(index='mes', columns='serie', values=['cantidad', 'monto'])
+    tabla.columns = [f"{valor}_{serie}" for valor, serie in tabla.columns]
+    tabla = tabla.reindex(
+        index=periodos.strftime('%Y-%m'),
+        columns=['cantidad_prestamos', 'monto_prestamos', 'cantidad_pagos', 'monto_pagos', 'cantidad_morosos']
+    ).fillna(0)
+    
+    return pd.DataFrame({
+        'mes': periodos.strftime('%b %Y'),
+        'num_prestamos': tabla['cantidad_prestamos'].astype(int).to_numpy(),
+        'monto_prestamos': tabla['monto_prestamos'].to_numpy(),
+        'num_pagos': tabla['cantidad_pagos'].astype(int).to_numpy(),
+        'monto_pagos': tabla['monto_pagos'].to_numpy(),
+        # Préstamos atrasados con vencimiento hasta el final de cada mes
+        'num_morosos': tabla['cantidad_morosos'].cumsum().astype(int).to_numpy(),
+    })
 
-# Calcular estadísticas generales para el dashboard
-def calcular_estadisticas_prestamos():
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
-    # Total de préstamos y monto total
-    c.execute("""
-        SELECT COUNT(*), SUM(monto) 
-        FROM prestamos
-    """)
-    resultado = c.fetchone()
-    total_prestamos = resultado[0] if resultado[0] else 0
-    monto_total = resultado[1] if resultado[1] else 0
-    
-    # Total de préstamos pendientes y atrasados y su monto
-    c.execute("""
-        SELECT SUM(monto) 
-        FROM prestamos 
-        WHERE estado IN ('Pendiente', 'Atrasado')
-    """)
-    resultado = c.fetchone()
-    monto_pendiente = resultado[0] if resultado[0] else 0
+@cachear_lectura('prestamos')
+def obtener_distribucion_estados(conn=None):
+    with usar_conexion(conn) as conn:
+        c = conn.cursor()
     
-    # Total de préstamos morosos
-    c.execute("""
-        SELECT COUNT(*) 
-        FROM prestamos 
-        WHERE estado = 'Atrasado'
-    """)
-    resultado = c.fetchone()
-    total_morosos = resultado[0] if resultado[0] else 0
+        c.execute("""
+            SELECT estado, COUNT(*) as cantidad, SUM(monto) as monto_total
+            FROM prestamos
+            GROUP BY estado
+        """)
     
-    # Total de pagos realizados
-    c.execute("""
-        SELECT COUNT(*), SUM(monto_pagado) 
-        FROM pagos
-    """)
-    resultado = c.fetchone()
-    total_pagos = resultado[0] if resultado[0] else 0
-    monto_pagado = resultado[1] if resultado[1] else 0
+        resultados = c.fetchall()
     
-    conn.close()
+        if not resultados:
+            return pd.DataFrame(columns=['estado', 'cantidad', 'monto_total'])
     
-    return {
-        'total_prestamos': total_prestamos,
-        'monto_total': monto_total,
-        'monto_pendiente': monto_pendiente,
-        'total_morosos': total_morosos,
-        'total_pagos': total_pagos,
-        'monto_pagado': monto_pagado
-    }
+        return pd.DataFrame(resultados, columns=['estado', 'cantidad', 'monto_total'])
 
 # Funciones para reportes
-def obtener_prestamos_activos():
+@cachear_lectura('prestamos', 'clientes')
+def obtener_prestamos_activos(conn=None):
     """Obtiene todos los préstamos activos (pendientes o atrasados)"""
-    conn = sqlite3.connect('prestamos.db')
-    query = """
-    SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
-           p.tasa_interes, p.estado, c.id as cliente_id
-    FROM prestamos p
-    JOIN clientes c ON p.cliente_id = c.id
-    WHERE p.estado != 'Pagado'
-    ORDER BY p.fecha_vencimiento ASC
-    """
-    prestamos = pd.read_sql_query(query, conn)
-    conn.close()
-    return prestamos
+    with usar_conexion(conn) as conn:
+        query = """
+        SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
+               p.tasa_interes, p.estado, c.id as cliente_id, p.saldo_pendiente
+        FROM prestamos p
+        JOIN clientes c ON p.cliente_id = c.id
+        WHERE p.estado != 'Pagado'
+        ORDER BY p.fecha_vencimiento ASC
+        """
+        prestamos = pd.read_sql_query(query, conn)
+        return prestamos
 
-def obtener_prestamos_morosos():
+@cachear_lectura('prestamos', 'clientes')
+def obtener_prestamos_morosos(conn=None):
     """Obtiene todos los préstamos morosos (atrasados)"""
-    conn = sqlite3.connect('prestamos.db')
+    with usar_conexion(conn) as conn:
+        query = """
+        SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
+               p.tasa_interes, p.estado, c.id as cliente_id, p.saldo_pendiente
+        FROM prestamos p
+        JOIN clientes c ON p.cliente_id = c.id
+        WHERE p.estado = 'Atrasado'
+        ORDER BY p.fecha_vencimiento ASC
+        """
+        prestamos = pd.read_sql_query(query, conn)
+        return prestamos
+
+# Indicadores generales para el Dashboard y Reportes
+@dataclass
+class EstadisticasPrestamos:
+    total_prestamos: int = 0
+    total_activos: int = 0
+    total_morosos: int = 0
+    monto_total: float = 0.0
+    monto_pendiente: float = 0.0
+    total_pagos: int = 0
+    monto_pagado: float = 0.0
+
+    @property
+    def indice_morosidad(self):
+        """Porcentaje de préstamos en estado moroso"""
+        return (self.total_morosos / self.total_prestamos * 100) if self.total_prestamos > 0 else 0
+
+@cachear_lectura('prestamos', 'pagos')
+def calcular_estadisticas_prestamos(conn=None):
+    """Calcula los indicadores generales de los préstamos en una sola consulta"""
     query = """
-    SELECT p.id, c.nombre, c.cedula, p.monto, p.fecha_prestamo, p.fecha_vencimiento, 
-           p.tasa_interes, p.estado, c.id as cliente_id
+    SELECT COUNT(*),
+           COALESCE(SUM(p.estado != 'Pagado'), 0),
+           COALESCE(SUM(p.estado = 'Atrasado'), 0),
+           COALESCE(SUM(p.monto), 0.0),
+           COALESCE(SUM(CASE WHEN p.estado != 'Pagado' THEN p.saldo_pendiente END), 0.0),
+           COALESCE(SUM(pg.num_pagos), 0),
+           COALESCE(SUM(pg.monto_pagado), 0.0)
     FROM prestamos p
-    JOIN clientes c ON p.cliente_id = c.id
-    WHERE p.estado = 'Atrasado'
-    ORDER BY p.fecha_vencimiento ASC
+    LEFT JOIN (
+        SELECT prestamo_id, COUNT(*) AS num_pagos, SUM(monto_pagado) AS monto_pagado
+        FROM pagos
+        GROUP BY prestamo_id
+    ) pg ON pg.prestamo_id = p.id
     """
-    prestamos = pd.read_sql_query(query, conn)
-    conn.close()
-    return prestamos
-
-def calcular_estadisticas_prestamos():
-    """Calcula estadísticas generales de los préstamos"""
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
-    # Total de préstamos
-    c.execute("SELECT COUNT(*) FROM prestamos")
-    total_prestamos = c.fetchone()[0]
-    
-    # Total de préstamos activos
-    c.execute("SELECT COUNT(*) FROM prestamos WHERE estado != 'Pagado'")
-    total_activos = c.fetchone()[0]
-    
-    # Total de préstamos morosos
-    c.execute("SELECT COUNT(*) FROM prestamos WHERE estado = 'Atrasado'")
-    total_morosos = c.fetchone()[0]
-    
-    # Monto total prestado
-    c.execute("SELECT SUM(monto) FROM prestamos")
-    monto_total = c.fetchone()[0] or 0
-    
-    # Monto total pendiente
-    monto_pendiente = 0
-    c.execute("SELECT id FROM prestamos WHERE estado != 'Pagado'")
-    prestamos_activos = c.fetchall()
-    for prestamo in prestamos_activos:
-        monto_pendiente += calcular_saldo_pendiente(prestamo[0])
-    
-    conn.close()
-    
-    return {
-        "total_prestamos": total_prestamos,
-        "total_activos": total_activos,
-        "total_morosos": total_morosos,
-        "monto_total": monto_total,
-        "monto_pendiente": monto_pendiente
-    }
+    with usar_conexion(conn) as conn:
+        fila = conn.execute(query).fetchone()
+    return EstadisticasPrestamos(*fila)
 
 # Funciones para gestión de pagos
 def registrar_pago(prestamo_id, fecha_pago, monto_pagado):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    try:
-        c.execute("INSERT INTO pagos (prestamo_id, fecha_pago, monto_pagado) VALUES (?, ?, ?)", 
-                 (prestamo_id, fecha_pago, monto_pagado))
-        conn.commit()
+    def registrar(conn):
+        conn.execute("INSERT INTO pagos (prestamo_id, fecha_pago, monto_pagado) VALUES (?, ?, ?)", 
+                     (prestamo_id, fecha_pago, monto_pagado))
         
         # Actualizar estado del préstamo si ya se pagó completamente
-        saldo_pendiente = calcular_saldo_pendiente(prestamo_id)
+        saldo_pendiente = calcular_saldo_pendiente(prestamo_id, conn=conn)
         if saldo_pendiente <= 0:
-            c.execute("UPDATE prestamos SET estado = 'Pagado' WHERE id = ?", (prestamo_id,))
-            conn.commit()
-        
+            conn.execute("UPDATE prestamos SET estado = 'Pagado' WHERE id = ?", (prestamo_id,))
+    
+    try:
+        ejecutar_escritura(registrar)
         exito = True
         mensaje = "Pago registrado exitosamente"
     except Exception as e:
         exito = False
         mensaje = f"Error al registrar el pago: {str(e)}"
-    conn.close()
     return exito, mensaje
 
-def obtener_pagos(prestamo_id):
-    conn = sqlite3.connect('prestamos.db')
-    query = """
-    SELECT id, prestamo_id, fecha_pago, monto_pagado
-    FROM pagos
-    WHERE prestamo_id = ?
-    ORDER BY fecha_pago DESC
-    """
-    pagos = pd.read_sql_query(query, conn, params=(prestamo_id,))
-    conn.close()
-    return pagos
+def obtener_pagos(prestamo_id, conn=None):
+    with usar_conexion(conn) as conn:
+        query = """
+        SELECT id, prestamo_id, fecha_pago, monto_pagado
+        FROM pagos
+        WHERE prestamo_id = ?
+        ORDER BY fecha_pago DESC
+        """
+        pagos = pd.read_sql_query(query, conn, params=(prestamo_id,))
+        return pagos
 
-def calcular_saldo_pendiente(prestamo_id):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
-    # Obtener monto total del préstamo
-    c.execute("SELECT monto, tasa_interes FROM prestamos WHERE id = ?", (prestamo_id,))
-    prestamo = c.fetchone()
-    if not prestamo:
-        conn.close()
-        return 0
-    
-    monto_prestamo = float(prestamo[0])
-    tasa_interes = float(prestamo[1] or 0)
-    
-    # Calcular monto total a pagar (incluyendo interés)
-    monto_total = monto_prestamo * (1 + tasa_interes / 100)
-    
-    # Obtener suma de pagos realizados
-    c.execute("SELECT SUM(monto_pagado) FROM pagos WHERE prestamo_id = ?", (prestamo_id,))
-    total_pagado = float(c.fetchone()[0] or 0)
-    
-    # Calcular saldo pendiente
-    saldo_pendiente = monto_total - total_pagado
-    
-    conn.close()
-    return max(0, round(saldo_pendiente, 2))  # No permitir saldos negativos y redondear a 2 decimales
+def calcular_saldo_pendiente(prestamo_id, conn=None):
+    """Saldo pendiente de un préstamo: lectura por clave primaria de la columna mantenida por triggers"""
+    with usar_conexion(conn) as conn:
+        fila = conn.execute("SELECT saldo_pendiente FROM prestamos WHERE id = ?", (int(prestamo_id),)).fetchone()
+    return fila[0] if fila else 0
+
+def calcular_saldos_pendientes(ids=None, conn=None):
+    """Devuelve el saldo pendiente de varios préstamos (o de todos), mantenido por triggers en prestamos"""
+    query = "SELECT id, saldo_pendiente FROM prestamos"
+    params = ()
+    if ids is not None:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        query += " WHERE id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(ids),)
+    
+    with usar_conexion(conn) as conn:
+        return dict(conn.execute(query, params).fetchall())
 
 def eliminar_pago(pago_id):
-    conn = sqlite3.connect('prestamos.db')
-    c = conn.cursor()
-    
-    # Obtener el préstamo_id antes de eliminar el pago
-    c.execute("SELECT prestamo_id FROM pagos WHERE id = ?", (pago_id,))
-    resultado = c.fetchone()
-    if not resultado:
-        conn.close()
-        return False, "Pago no encontrado"
-    
-    prestamo_id = resultado[0]
-    
-    try:
+    def eliminar(conn):
+        c = conn.cursor()
+        
+        # Obtener el préstamo_id antes de eliminar el pago
+        c.execute("SELECT prestamo_id FROM pagos WHERE id = ?", (pago_id,))
+        resultado = c.fetchone()
+        if not resultado:
+            return None
+        
+        prestamo_id = resultado[0]
         c.execute("DELETE FROM pagos WHERE id = ?", (pago_id,))
-        conn.commit()
         
         # Actualizar estado del préstamo después de eliminar el pago
-        saldo_pendiente = calcular_saldo_pendiente(prestamo_id)
+        saldo_pendiente = calcular_saldo_pendiente(prestamo_id, conn=conn)
         if saldo_pendiente > 0:
             # Verificar si la fecha de vencimiento ha pasado
             fecha_actual = datetime.now().strftime('%Y-%m-%d')
@@ -948,7 +1054,13 @@ def eliminar_pago(pago_id):
                 nuevo_estado = "Pendiente"
                 
             c.execute("UPDATE prestamos SET estado = ? WHERE id = ?",(nuevo_estado, prestamo_id))
-            conn.commit()
+        
+        return prestamo_id
+    
+    try:
+        prestamo_id = ejecutar_escritura(eliminar)
+        if prestamo_id is None:
+            return False, "Pago no encontrado"
         
         exito = True
         mensaje = "Pago eliminado correctamente"
@@ -958,144 +1070,106 @@ def eliminar_pago(pago_id):
     except Exception as e:
         exito = False
         mensaje = f"Error al eliminar el pago: {str(e)}"
-    finally:
-        conn.close()
         
     return exito, mensaje
 
 # Funciones de exportación avanzada
 def exportar_a_excel(df, filename):
-    """Exporta un DataFrame a un archivo Excel con formato mejorado"""
-    output = io.BytesIO()
-    workbook = Workbook(output, {'in_memory': True})
-    worksheet = workbook.add_worksheet('Datos')
-    
-    # Agregar formatos
-    header_format = workbook.add_format({
-        'bold': True,
-        'bg_color': '#0066cc',
-        'font_color': 'white',
-        'border': 1
-    })
-    
-    cell_format = workbook.add_format({
-        'border': 1
-    })
-    
-    money_format = workbook.add_format({
-        'border': 1,
-        'num_format': '$#,##0.00'
-    })
-    
-    date_format = workbook.add_format({
-        'border': 1,
-        'num_format': 'dd/mm/yyyy'
-    })
-    
-    # Escribir encabezados
-    for col_num, column in enumerate(df.columns):
-        worksheet.write(0, col_num, column, header_format)
-    
-    # Escribir datos
-    for row_num, row in enumerate(df.values):
-        for col_num, cell_value in enumerate(row):
-            # Detectar si es un valor monetario (si contiene $)
-            if isinstance(cell_value, str) and '$' in cell_value:
-                # Extraer el valor numérico
-                try:
-                    numeric_value = float(cell_value.replace('$', '').replace(',', ''))
-                    worksheet.write(row_num + 1, col_num, numeric_value, money_format)
-                except ValueError:
-                    worksheet.write(row_num + 1, col_num, cell_value, cell_format)
-            # Detectar si es una fecha
-            elif isinstance(cell_value, str) and len(cell_value.split('/')) == 3:
-                try:
-                    # Intentar convertir a fecha
-                    parts = cell_value.split('/')
-                    if len(parts[2]) == 4:  # Formato dd/mm/yyyy
-                        worksheet.write(row_num + 1, col_num, cell_value, date_format)
-                    else:
-                        worksheet.write(row_num + 1, col_num, cell_value, cell_format)
-                except:
-                    worksheet.write(row_num + 1, col_num, cell_value, cell_format)
-            else:
-                worksheet.write(row_num + 1, col_num, cell_value, cell_format)
-    
-    # Ajustar ancho de columnas
-    for col_num, column in enumerate(df.columns):
-        max_length = max(df[column].astype(str).apply(len).max(), len(column))
-        worksheet.set_column(col_num, col_num, max_length + 2)
-    
-    # Agregar filtros
-    worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
-    
-    # Agregar información del sistema
-    info_sheet = workbook.add_worksheet('Información')
-    info_sheet.write(0, 0, 'Reporte generado desde Sistema de Préstamos')
-    info_sheet.write(1, 0, f'Fecha de generación: {datetime.now().strftime("%d/%m/%Y %H:%M:%S")}')
-    if 'usuario' in st.session_state:
-        info_sheet.write(2, 0, f'Usuario: {st.session_state.usuario}')
-    
-    workbook.close()
-    output.seek(0)
-    
-    return output.getvalue()
+    """Exporta un DataFrame a un archivo Excel con columnas tipadas (ver exportaciones.escribir_excel)"""
+    return excel_dataframe(df, st.session_state.get('usuario'))
 
-def exportar_a_pdf(df, titulo):
-    """Exporta un DataFrame a un archivo PDF con formato mejorado"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(letter))
-    elements = []
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = styles['Heading1']
-    normal_style = styles['Normal']
-    
-    # Título
-    elements.append(Paragraph(titulo, title_style))
-    elements.append(Spacer(1, 12))
-    
-    # Información del reporte
-    elements.append(Paragraph(f"Reporte generado el {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", normal_style))
-    if 'usuario' in st.session_state:
-        elements.append(Paragraph(f"Usuario: {st.session_state.usuario}", normal_style))
-    elements.append(Spacer(1, 12))
-    
-    # Convertir DataFrame a lista para la tabla
-    data = [df.columns.tolist()] + df.values.tolist()
-    
-    # Crear tabla
-    table = Table(data)
-    
-    # Estilo de tabla
-    table_style = TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.blue),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ])
-    
-    # Aplicar estilo a filas alternas para mejor legibilidad
-    for i in range(1, len(data)):
-        if i % 2 == 0:
-            table_style.add('BACKGROUND', (0, i), (-1, i), colors.lightgrey)
-    
-    table.setStyle(table_style)
-    elements.append(table)
-    
-    # Construir PDF
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return buffer.getvalue()
+def exportar_a_pdf(df, titulo, columnas_total=None):
+    """Exporta un DataFrame a un archivo PDF paginado con totales por página (ver exportaciones.escribir_pdf)"""
+    return pdf_dataframe(df, titulo, st.session_state.get('usuario'), columnas_total)
+
+def controles_paginacion(clave, total_registros, opciones_orden, orden_defecto, descendente_defecto=False):
+    """Muestra los controles de orden y página de un listado y devuelve (tamano_pagina, pagina, orden, descendente)"""
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+    with col1:
+        orden = st.selectbox("Ordenar por:", opciones_orden, index=opciones_orden.index(orden_defecto), key=f"{clave}_orden")
+    with col2:
+        descendente = st.checkbox("Descendente", value=descendente_defecto, key=f"{clave}_descendente")
+    with col3:
+        tamano_pagina = st.selectbox("Por página:", [25, 50, 100, 250], index=1, key=f"{clave}_tamano")
+    total_paginas = max(1, -(-total_registros // tamano_pagina))
+    with col4:
+        # La clave incluye el total de páginas para volver a la primera cuando cambia
+        pagina = st.number_input(f"Página (de {total_paginas}):", min_value=1, max_value=total_paginas, value=1, step=1,
+                                 key=f"{clave}_pagina_{total_paginas}")
+    return tamano_pagina, int(pagina), orden, descendente
+
+def formatear_prestamos(prestamos):
+    """Da formato de presentación a un listado de préstamos"""
+    prestamos_display = prestamos.copy()
+    prestamos_display['fecha_prestamo'] = pd.to_datetime(prestamos_display['fecha_prestamo']).dt.strftime('%d/%m/%Y')
+    prestamos_display['fecha_vencimiento'] = pd.to_datetime(prestamos_display['fecha_vencimiento']).dt.strftime('%d/%m/%Y')
+    
+    # Formatear montos y tasas
+    prestamos_display['monto'] = prestamos_display['monto'].apply(lambda x: f"${x:,.2f}")
+    prestamos_display['tasa_interes'] = prestamos_display['tasa_interes'].apply(lambda x: f"{x}%" if pd.notnull(x) else "N/A")
+    
+    # Renombrar columnas para mejor visualización (excluir cliente_id)
+    prestamos_display = prestamos_display.rename(columns={
+        'id': 'ID', 
+        'nombre': 'Cliente',
+        'monto': 'Monto',
+        'fecha_prestamo': 'Fecha Préstamo',
+        'fecha_vencimiento': 'Fecha Vencimiento',
+        'tasa_interes': 'Tasa Interés',
+        'estado': 'Estado'
+    })
+    return prestamos_display.drop(columns=['cliente_id'], errors='ignore')
 
-def mostrar_opciones_exportacion(df, nombre_reporte):
-    """Muestra un expander con opciones para exportar datos en diferentes formatos"""
+# Formatos de exportación: (etiqueta del botón, extensión, tipo MIME)
+FORMATOS_EXPORTACION = {
+    'CSV': ("📄 Exportar a CSV", "csv", "text/csv"),
+    'Excel': ("📊 Exportar a Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    'PDF': ("📑 Exportar a PDF", "pdf", "application/pdf"),
+}
+
+def boton_exportacion(formato, clave, generar, nombre_archivo, ayuda):
+    """Botón de descarga que solo genera el archivo cuando se pide. El resultado queda en la
+    caché de exportaciones bajo clave, así que las re-ejecuciones siguientes no lo regeneran."""
+    etiqueta, extension, mime = FORMATOS_EXPORTACION[formato]
+    archivo = f"{nombre_archivo}.{extension}"
+    cache = obtener_cache_exportaciones()
+    datos = cache.obtener(clave)
+    if datos is None:
+        if not st.button(f"Preparar {formato}", key=f"preparar_{archivo}", help=ayuda):
+            return
+        with st.spinner(f"Generando {formato}..."):
+            datos = cache.generar(clave, generar)
+    st.download_button(label=etiqueta, data=datos, file_name=archivo, mime=mime, help=ayuda, key=f"descargar_{archivo}")
+
+def archivo_exportado(escribir, formato):
+    """Contenido del archivo que escribir(archivo, formato) genera por lotes en un archivo temporal"""
+    with tempfile.TemporaryFile() as archivo:
+        escribir(archivo, formato)
+        archivo.seek(0)
+        return archivo.read()
+
+def mostrar_opciones_exportacion(datos, nombre_reporte, tablas=(), parametros=(), escribir=None):
+    """Muestra un expander con opciones para exportar datos en diferentes formatos.
+    datos puede ser un DataFrame o una función que lo devuelva; en ese caso solo se llama
+    al exportar y la versión de los datos es la generación de tablas (más parametros).
+    Con escribir(archivo, formato) los archivos se escriben por lotes desde la base de datos
+    en lugar de armar un DataFrame con todas las filas (datos puede ser None)."""
+    # El usuario forma parte de la clave porque Excel y PDF lo incluyen en el archivo
+    usuario = st.session_state.get('usuario')
+    if escribir is not None:
+        version = ('lotes', obtener_generaciones(tablas), parametros)
+    elif callable(datos):
+        version = ('consulta', obtener_generaciones(tablas), parametros)
+        cargados = []
+        def cargar():
+            if not cargados:
+                cargados.append(datos())
+            return cargados[0]
+    else:
+        version = ('datos', hash_dataframe(datos))
+        cargar = lambda: datos
+    clave = (nombre_reporte, usuario) + version
+    
     with st.expander("Opciones de Exportación"):
         st.write("Exportar datos en diferentes formatos:")
         
@@ -1103,39 +1177,196 @@ def mostrar_opciones_exportacion(df, nombre_reporte):
         
         # Exportar a CSV
         with col1:
-            csv = df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📄 Exportar a CSV",
-                data=csv,
-                file_name=f"{nombre_reporte}.csv",
-                mime="text/csv",
-                help="Exportar datos en formato CSV para usar en Excel u otras aplicaciones"
+            boton_exportacion(
+                'CSV', clave + ('CSV',),
+                (lambda: archivo_exportado(escribir, 'csv')) if escribir else
+                (lambda: cargar().to_csv(index=False).encode('utf-8')), nombre_reporte,
+                "Exportar datos en formato CSV para usar en Excel u otras aplicaciones"
             )
         
         # Exportar a Excel
         with col2:
-            excel_data = exportar_a_excel(df, nombre_reporte)
-            st.download_button(
-                label="📊 Exportar a Excel",
-                data=excel_data,
-                file_name=f"{nombre_reporte}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                help="Exportar datos en formato Excel con formato mejorado"
+            boton_exportacion(
+                'Excel', clave + ('Excel',),
+                (lambda: archivo_exportado(escribir, 'xlsx')) if escribir else
+                (lambda: exportar_a_excel(cargar(), nombre_reporte)), nombre_reporte,
+                "Exportar datos en formato Excel con formato mejorado"
             )
         
         # Exportar a PDF
         with col3:
-            pdf_data = exportar_a_pdf(df, f"Reporte: {nombre_reporte}")
-            st.download_button(
-                label="📑 Exportar a PDF",
-                data=pdf_data,
-                file_name=f"{nombre_reporte}.pdf",
-                mime="application/pdf",
-                help="Exportar datos en formato PDF para imprimir o compartir"
+            boton_exportacion(
+                'PDF', clave + ('PDF',),
+                (lambda: archivo_exportado(escribir, 'pdf')) if escribir else
+                (lambda: exportar_a_pdf(cargar(), f"Reporte: {nombre_reporte}")), nombre_reporte,
+                "Exportar datos en formato PDF para imprimir o compartir"
             )
 
+ESTADOS_TRABAJO = {
+    'pendiente': "⏳ En cola",
+    'en_proceso': "⚙️ Generando",
+    'terminado': "✅ Listo",
+    'error': "❌ Error",
+    'vencido': "🗑️ Vencido",
+}
+
+def mostrar_trabajos_exportacion():
+    """Exportaciones completas en segundo plano: se piden aquí y se descargan cuando terminan,
+    aunque el usuario cambie de pantalla o cierre la sesión mientras tanto"""
+    usuario = st.session_state.get('usuario')
+    nivel_acceso = st.session_state.get('nivel_acceso')
+    reportes = {clave: definicion['titulo'] for clave, definicion in REPORTES.items()
+                if reporte_permitido(clave, nivel_acceso)}
+
+    with st.form(key="trabajo_exportacion_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            reporte = st.selectbox("Reporte", options=list(reportes), format_func=lambda clave: reportes[clave])
+        with col2:
+            formatos = [formato for formato in FORMATOS_TRABAJO if formato != 'parquet' or parquet_disponible()]
+            formato = st.selectbox("Formato", options=formatos,
+                                   format_func=lambda clave: FORMATOS_TRABAJO[clave][0])
+        iniciar = st.form_submit_button("Iniciar exportación")
+
+    if iniciar:
+        trabajo_id = crear_trabajo(reporte, formato, usuario, nivel_acceso)
+        registrar_actividad(usuario, "Exportación solicitada", {"trabajo": trabajo_id, "reporte": reporte, "formato": formato})
+        st.success(f"Exportación #{trabajo_id} en cola. Puede seguir usando el sistema mientras se genera.")
+
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.subheader("Mis Exportaciones")
+    with col2:
+        st.button("🔄 Actualizar", key="actualizar_trabajos")
+
+    trabajos = obtener_trabajos(usuario)
+    if trabajos.empty:
+        st.info("No ha solicitado exportaciones")
+        return
+
+    for trabajo in trabajos.itertuples():
+        titulo = REPORTES.get(trabajo.reporte, {}).get('titulo', trabajo.reporte)
+        etiqueta_formato, mime = FORMATOS_TRABAJO.get(trabajo.formato, (trabajo.formato, None))
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.write(f"**#{trabajo.id} {titulo}** ({etiqueta_formato}) · {ESTADOS_TRABAJO.get(trabajo.estado, trabajo.estado)}")
+            st.caption(f"Solicitado: {trabajo.creado_en}"
+                       + (f" · Disponible hasta: {trabajo.expira_en}" if trabajo.estado == 'terminado' else ""))
+        with col2:
+            if trabajo.estado in ('pendiente', 'en_proceso'):
+                total = f" de {int(trabajo.total_filas):,}" if pd.notnull(trabajo.total_filas) else ""
+                st.progress(float(trabajo.progreso), text=f"{trabajo.filas:,}{total} filas")
+            elif trabajo.estado == 'terminado' and trabajo.archivo and os.path.exists(trabajo.archivo):
+                nombre_archivo = f"{trabajo.reporte}_{trabajo.id}.{trabajo.formato}"
+                if st.session_state.get('trabajo_descarga') == trabajo.id:
+                    # Solo se lee el archivo del trabajo que el usuario eligió descargar
+                    with open(trabajo.archivo, 'rb') as archivo:
+                        st.download_button(f"Descargar ({trabajo.filas:,} filas)", data=archivo.read(),
+                                           file_name=nombre_archivo, mime=mime, key=f"descargar_trabajo_{trabajo.id}")
+                elif st.button("Preparar descarga", key=f"preparar_trabajo_{trabajo.id}"):
+                    st.session_state.trabajo_descarga = trabajo.id
+                    st.rerun()
+            elif trabajo.estado == 'error':
+                st.error(trabajo.error or "Error desconocido")
+
+# Matriz de sensibilidad de la calculadora
+METRICAS_SENSIBILIDAD = {
+    'Cuota Mensual': 'cuota',
+    'Total Intereses': 'interes_total',
+    'Total a Pagar': 'total_pagado',
+}
+LIMITE_CELDAS_SENSIBILIDAD = 250000
+
+def mostrar_matriz_sensibilidad():
+    """Calcula y muestra la rejilla de escenarios (monto x tasa x plazo) de la calculadora"""
+    with st.form(key="sensibilidad_form"):
+        st.subheader("Rangos de los Escenarios")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            monto_min = st.number_input("Monto mínimo ($)", min_value=100.0, value=5000.0, step=100.0)
+            monto_max = st.number_input("Monto máximo ($)", min_value=100.0, value=20000.0, step=100.0)
+            cantidad_montos = st.number_input("Cantidad de montos", min_value=1, max_value=50, value=4, step=1)
+        with col2:
+            tasa_min = st.number_input("Tasa mínima (%)", min_value=0.0, max_value=100.0, value=6.0, step=0.5)
+            tasa_max = st.number_input("Tasa máxima (%)", min_value=0.0, max_value=100.0, value=36.0, step=0.5)
+            paso_tasa = st.number_input("Paso de la tasa (%)", min_value=0.05, max_value=10.0, value=1.0, step=0.05)
+        with col3:
+            plazo_min = st.number_input("Plazo mínimo (meses)", min_value=1, max_value=120, value=6, step=1)
+            plazo_max = st.number_input("Plazo máximo (meses)", min_value=1, max_value=120, value=60, step=1)
+            paso_plazo = st.number_input("Paso del plazo (meses)", min_value=1, max_value=60, value=6, step=1)
+        
+        if st.form_submit_button("Calcular Matriz", use_container_width=True):
+            if monto_min > monto_max or tasa_min > tasa_max or plazo_min > plazo_max:
+                st.error("El valor mínimo de cada rango no puede ser mayor que el máximo")
+            else:
+                st.session_state.rangos_sensibilidad = {
+                    'montos': np.linspace(monto_min, monto_max, int(cantidad_montos)).round(2),
+                    'tasas': np.arange(tasa_min, tasa_max + paso_tasa / 2, paso_tasa).round(4),
+                    'plazos': np.arange(plazo_min, plazo_max + 1, paso_plazo),
+                }
+    
+    if 'rangos_sensibilidad' not in st.session_state:
+        return
+    rangos = st.session_state.rangos_sensibilidad
+    celdas = len(rangos['montos']) * len(rangos['tasas']) * len(rangos['plazos'])
+    if celdas > LIMITE_CELDAS_SENSIBILIDAD:
+        st.error(f"La matriz tendría {celdas:,} escenarios; el máximo es {LIMITE_CELDAS_SENSIBILIDAD:,}. Reduzca los rangos o aumente los pasos.")
+        return
+    
+    # Toda la rejilla se calcula en una pasada; cambiar la vista no vuelve a enviar el formulario
+    matriz = matriz_sensibilidad(rangos['montos'], rangos['tasas'], rangos['plazos'])
+    st.caption(f"{celdas:,} escenarios calculados")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        metrica = st.selectbox("Métrica:", list(METRICAS_SENSIBILIDAD))
+    with col2:
+        monto_vista = st.selectbox(
+            "Monto ($):", rangos['montos'].tolist(), format_func=lambda x: f"${x:,.2f}"
+        )
+    columna = METRICAS_SENSIBILIDAD[metrica]
+    
+    # Tabla dinámica tasa x plazo para el monto elegido
+    tabla = matriz[matriz['monto'] == monto_vista].pivot(index='tasa_interes', columns='plazo_meses', values=columna)
+    
+    tab_mapa, tab_tabla = st.tabs(["🌡️ Mapa de Calor", "📋 Tabla Dinámica"])
+    with tab_mapa:
+        fig = px.imshow(
+            tabla,
+            labels={'x': 'Plazo (meses)', 'y': 'Tasa de Interés Anual (%)', 'color': metrica},
+            title=f"{metrica} para un monto de ${monto_vista:,.2f}",
+            color_continuous_scale='RdYlGn_r',
+            aspect='auto',
+            origin='lower',
+        )
+        fig.update_traces(hovertemplate="Plazo: %{x} meses<br>Tasa: %{y}%<br>" + metrica + ": $%{z:,.2f}<extra></extra>")
+        st.plotly_chart(fig, use_container_width=True)
+    with tab_tabla:
+        tabla_display = tabla.round(2)
+        tabla_display.index = [f"{t:g}%" for t in tabla_display.index]
+        tabla_display.columns = [f"{p} meses" for p in tabla_display.columns]
+        st.dataframe(tabla_display, use_container_width=True)
+    
+    st.download_button(
+        label="📄 Exportar matriz completa a CSV",
+        data=matriz.round(2).rename(columns={
+            'monto': 'Monto',
+            'tasa_interes': 'Tasa Interés',
+            'plazo_meses': 'Plazo (meses)',
+            'cuota': 'Cuota Mensual',
+            'interes_total': 'Total Intereses',
+            'total_pagado': 'Total a Pagar'
+        }).to_csv(index=False).encode('utf-8'),
+        file_name="matriz_sensibilidad.csv",
+        mime="text/csv"
+    )
+
 # Interfaz de usuario
 def main():
+    # Preparar base de datos y tareas de fondo (solo la primera vez en el proceso)
+    ejecutar_una_vez("inicializar_sistema", inicializar_sistema)
+    
     # Inicializar variables de sesión si no existen
     if 'autenticado' not in st.session_state:
         st.session_state.autenticado = False
@@ -1146,9 +1377,6 @@ def main():
     if 'menu' not in st.session_state:
         st.session_state.menu = "Dashboard"
     
-    # Actualizar estados de préstamos
-    actualizar_estados_prestamos()
-    
     # Mostrar título
     st.title("Sistema de Préstamos")
     
@@ -1288,28 +1516,27 @@ def main():
             with col1:
                 st.metric(
                     label="Total Préstamos", 
-                    value=f"{stats['total_prestamos']}",
+                    value=f"{stats.total_prestamos}",
                     help="Número total de préstamos en el sistema"
                 )
             with col2:
                 st.metric(
                     label="Monto Total Prestado", 
-                    value=f"${stats['monto_total']:,.2f}",
+                    value=f"${stats.monto_total:,.2f}",
                     help="Suma de todos los montos prestados"
                 )
             with col3:
                 st.metric(
                     label="Monto Pendiente", 
-                    value=f"${stats['monto_pendiente']:,.2f}",
-                    delta=f"-${stats['monto_total'] - stats['monto_pendiente']:,.2f}",
+                    value=f"${stats.monto_pendiente:,.2f}",
+                    delta=f"-${stats.monto_total - stats.monto_pendiente:,.2f}",
                     help="Monto total aún por cobrar"
                 )
             with col4:
-                indice_morosidad = (stats['total_morosos'] / stats['total_prestamos'] * 100) if stats['total_prestamos'] > 0 else 0
                 st.metric(
                     label="Índice de Morosidad", 
-                    value=f"{indice_morosidad:.1f}%",
-                    delta=f"{stats['total_morosos']} préstamos",
+                    value=f"{stats.indice_morosidad:.1f}%",
+                    delta=f"{stats.total_morosos} préstamos",
                     delta_color="inverse",
                     help="Porcentaje de préstamos en estado moroso"
                 )
@@ -1318,11 +1545,20 @@ def main():
             st.markdown("---")
             
             # Tendencias de los últimos meses
-            st.subheader("Tendencias de los últimos 6 meses")
+            col_titulo, col_periodo = st.columns([3, 1])
+            with col_periodo:
+                meses_tendencias = st.selectbox(
+                    "Período",
+                    [6, 12, 24, 60, 120],
+                    format_func=lambda m: f"Últimos {m} meses",
+                    key="meses_tendencias"
+                )
+            with col_titulo:
+                st.subheader(f"Tendencias de los últimos {meses_tendencias} meses")
             
             try:
                 # Obtener datos de tendencias
-                datos_tendencias = obtener_datos_tendencias()
+                datos_tendencias = obtener_datos_tendencias(meses_tendencias)
                 
                 if not datos_tendencias.empty:
                     # Crear pestañas para diferentes gráficos
@@ -1479,248 +1715,139 @@ def main():
             st.header("📈 Calculadora de Préstamos")
             st.write("Simula diferentes escenarios de préstamos y visualiza el plan de pagos proyectado.")
             
-            # Formulario para la simulación
-            with st.form(key="calculadora_form"):
-                st.subheader("Parámetros del Préstamo")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    monto = st.number_input("Monto del Préstamo ($)", min_value=100.0, value=5000.0, step=100.0)
-                    tasa_interes = st.number_input("Tasa de Interés Anual (%)", min_value=0.0, max_value=100.0, value=12.0, step=0.5)
-                
-                with col2:
-                    plazo_meses = st.number_input("Plazo (meses)", min_value=1, max_value=120, value=12, step=1)
-                    fecha_inicio = st.date_input("Fecha de Inicio", value=datetime.now())
-                
-                submitted = st.form_submit_button("Calcular", use_container_width=True)
+            modo = st.radio("Modo:", ["Escenario único", "Matriz de sensibilidad"], horizontal=True)
             
-            if submitted or 'plan_pagos' in st.session_state:
-                # Si es la primera vez, calcular el plan de pagos
-                if submitted or 'plan_pagos' not in st.session_state:
-                    plan_pagos = calcular_plan_pagos(monto, tasa_interes, plazo_meses, fecha_inicio)
-                    st.session_state.plan_pagos = plan_pagos
-                    st.session_state.parametros = {
-                        'monto': monto,
-                        'tasa_interes': tasa_interes,
-                        'plazo_meses': plazo_meses,
-                        'fecha_inicio': fecha_inicio
-                    }
-                else:
-                    plan_pagos = st.session_state.plan_pagos
-                    parametros = st.session_state.parametros
-                
-                # Mostrar resumen
-                st.subheader("Resumen del Préstamo")
-                col1, col2, col3 = st.columns(3)
-                
-                # Calcular totales
-                total_pagos = plan_pagos['cuota'].sum()
-                total_intereses = plan_pagos['interes'].sum()
-                cuota_mensual = plan_pagos['cuota'].iloc[0]
-                
-                with col1:
-                    st.metric("Monto Total a Pagar", f"${total_pagos:,.2f}")
-                
-                with col2:
-                    st.metric("Total Intereses", f"${total_intereses:,.2f}")
-                
-                with col3:
-                    st.metric("Cuota Mensual", f"${cuota_mensual:,.2f}")
-                
-                # Mostrar gráfico de distribución
-                st.subheader("Distribución del Préstamo")
-                
-                # Datos para el gráfico
-                datos_grafico = [
-                    {'categoria': 'Capital', 'valor': monto},
-                    {'categoria': 'Intereses', 'valor': total_intereses}
-                ]
-                df_grafico = pd.DataFrame(datos_grafico)
-                
-                # Crear gráfico
-                fig = px.pie(
-                    df_grafico, 
-                    values='valor', 
-                    names='categoria',
-                    title="Distribución Capital vs. Intereses",
-                    color='categoria',
-                    color_discrete_map={'Capital': '#3498db', 'Intereses': '#e74c3c'}
-                )
-                fig.update_traces(textposition='inside', textinfo='percent+label')
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # Mostrar plan de pagos con mejor experiencia de usuario
-                st.subheader("📋 Plan de Pagos Proyectado")
-                
-                # Crear pestañas para diferentes vistas del plan de pagos
-                tab_resumen, tab_detalle, tab_grafico = st.tabs(["✅ Resumen", "📊 Detalle de Pagos", "📈 Evolución de Pagos"])
-                
-                # Formatear la tabla
-                plan_pagos_display = plan_pagos.copy()
-                
-                # Calcular totales para el resumen
-                total_capital = plan_pagos['capital'].sum()
-                total_interes = plan_pagos['interes'].sum()
-                total_pagos = total_capital + total_interes
-                
-                # Pestaña de resumen
-                with tab_resumen:
-                    st.write("### Resumen del Plan de Pagos")
+            if modo == "Matriz de sensibilidad":
+                mostrar_matriz_sensibilidad()
+            else:
+                # Formulario para la simulación
+                with st.form(key="calculadora_form"):
+                    st.subheader("Parámetros del Préstamo")
                     
-                    # Información clave del préstamo
-                    st.info(f"💡 **Información del préstamo:** Monto de ${monto:,.2f} a {plazo_meses} meses con tasa de interés del {tasa_interes}% anual")
+                    col1, col2 = st.columns(2)
                     
-                    # Mostrar métricas clave
-                    col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("Primera cuota", plan_pagos_display['cuota'].iloc[0])
-                        st.metric("Fecha primera cuota", pd.to_datetime(plan_pagos['fecha_pago'].iloc[0]).strftime('%d/%m/%Y'))
+                        monto = st.number_input("Monto del Préstamo ($)", min_value=100.0, value=5000.0, step=100.0)
+                        tasa_interes = st.number_input("Tasa de Interés Anual (%)", min_value=0.0, max_value=100.0, value=12.0, step=0.5)
+                    
                     with col2:
-                        st.metric("Última cuota", plan_pagos_display['cuota'].iloc[-1])
-                        st.metric("Fecha última cuota", pd.to_datetime(plan_pagos['fecha_pago'].iloc[-1]).strftime('%d/%m/%Y'))
-                    with col3:
-                        st.metric("Total a pagar", f"${total_pagos:,.2f}")
-                        st.metric("Total intereses", f"${total_interes:,.2f}", delta=f"{total_interes/monto*100:.1f}%")
-                    
-                    # Mostrar progresión de pagos en un gráfico simplificado
-                    st.write("### Progresión de Pagos")
-                    
-                    # Crear datos para gráfico de barras apiladas
-                    hitos = [0, int(plazo_meses/4), int(plazo_meses/2), int(3*plazo_meses/4), plazo_meses-1]
-                    hitos = [i for i in hitos if i < len(plan_pagos)]
-                    if hitos[-1] != len(plan_pagos)-1:
-                        hitos.append(len(plan_pagos)-1)
-                    
-                    hitos_df = plan_pagos.iloc[hitos].copy()
-                    hitos_df['num_pago'] = hitos_df['num_pago'].astype(str)
-                    
-                    # Gráfico de barras apiladas para mostrar la evolución
-                    fig = px.bar(hitos_df, x='num_pago', y=['capital', 'interes'], 
-                                 title="Composición de las cuotas a lo largo del préstamo",
-                                 labels={'value': 'Monto ($)', 'num_pago': 'Número de cuota', 'variable': 'Componente'},
-                                 color_discrete_map={'capital': '#3498db', 'interes': '#e74c3c'})
-                    fig.update_layout(legend_title_text='')
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                # Pestaña de detalle
-                with tab_detalle:
-                    # Formatear para visualización
-                    plan_pagos_display['cuota'] = plan_pagos_display['cuota'].map('${:,.2f}'.format)
-                    plan_pagos_display['capital'] = plan_pagos_display['capital'].map('${:,.2f}'.format)
-                    plan_pagos_display['interes'] = plan_pagos_display['interes'].map('${:,.2f}'.format)
-                    plan_pagos_display['saldo'] = plan_pagos_display['saldo'].map('${:,.2f}'.format)
+                        plazo_meses = st.number_input("Plazo (meses)", min_value=1, max_value=120, value=12, step=1)
+                        fecha_inicio = st.date_input("Fecha de Inicio", value=datetime.now())
                     
-                    # Formatear fechas
-                    plan_pagos_display['fecha_pago'] = pd.to_datetime(plan_pagos_display['fecha_pago']).dt.strftime('%d/%m/%Y')
+                    submitted = st.form_submit_button("Calcular", use_container_width=True)
+                
+                if submitted or 'clave_plan' in st.session_state:
+                    # La sesión solo guarda la clave; el plan vive en la caché compartida del proceso
+                    if submitted or 'clave_plan' not in st.session_state:
+                        st.session_state.clave_plan = clave_plan(monto, tasa_interes, plazo_meses, fecha_inicio)
+                    plan_pagos = plan_pagos_cacheado(st.session_state.clave_plan)
+                    
+                    # Mostrar resumen
+                    st.subheader("Resumen del Préstamo")
+                    col1, col2, col3 = st.columns(3)
                     
-                    # Renombrar columnas para mejor visualización
-                    plan_pagos_display = plan_pagos_display.rename(columns={
-                        'num_pago': 'Nro.',
-                        'fecha_pago': 'Fecha de Pago',
-                        'cuota': 'Cuota',
-                        'capital': 'Capital',
-                        'interes': 'Interés',
-                        'saldo': 'Saldo'
-                    })
+                    # Calcular totales
+                    total_pagos = plan_pagos['cuota'].sum()
+                    total_intereses = plan_pagos['interes'].sum()
+                    cuota_mensual = plan_pagos['cuota'].iloc[0]
                     
-                    # Filtros para la tabla
-                    col1, col2 = st.columns([1, 2])
                     with col1:
-                        # Opciones de visualización
-                        mostrar_filas = st.radio(
-                            "Mostrar:",
-                            ["Todas las cuotas", "Primeras cuotas", "Últimas cuotas", "Cuotas específicas"]
-                        )
+                        st.metric("Monto Total a Pagar", f"${total_pagos:,.2f}")
                     
                     with col2:
-                        if mostrar_filas == "Primeras cuotas":
-                            num_filas = st.slider("Número de cuotas a mostrar", 1, min(12, len(plan_pagos_display)), 6)
-                            filas_a_mostrar = plan_pagos_display.head(num_filas)
-                        elif mostrar_filas == "Últimas cuotas":
-                            num_filas = st.slider("Número de cuotas a mostrar", 1, min(12, len(plan_pagos_display)), 6)
-                            filas_a_mostrar = plan_pagos_display.tail(num_filas)
-                        elif mostrar_filas == "Cuotas específicas":
-                            rango = st.slider("Rango de cuotas", 1, len(plan_pagos_display), (1, min(12, len(plan_pagos_display))))
-                            filas_a_mostrar = plan_pagos_display.iloc[rango[0]-1:rango[1]]
-                        else:  # Todas las cuotas
-                            if len(plan_pagos_display) > 12:
-                                pagina = st.selectbox(
-                                    "Página", 
-                                    options=range(1, (len(plan_pagos_display) // 12) + 2),
-                                    format_func=lambda x: f"Página {x} de {(len(plan_pagos_display) // 12) + 1}"
-                                )
-                                inicio = (pagina - 1) * 12
-                                fin = min(inicio + 12, len(plan_pagos_display))
-                                filas_a_mostrar = plan_pagos_display.iloc[inicio:fin]
-                            else:
-                                filas_a_mostrar = plan_pagos_display
+                        st.metric("Total Intereses", f"${total_intereses:,.2f}")
                     
-                    # Mostrar tabla con mejor formato
-                    st.write("### Detalle de cuotas")
-                    st.dataframe(
-                        filas_a_mostrar,
-                        use_container_width=True,
-                        hide_index=True,
-                        column_config={
-                            "Nro.": st.column_config.NumberColumn("#", format="%d"),
-                            "Fecha de Pago": st.column_config.DateColumn("Fecha"),
-                            "Cuota": st.column_config.TextColumn("Cuota"),
-                            "Capital": st.column_config.TextColumn("Capital"),
-                            "Interés": st.column_config.TextColumn("Interés"),
-                            "Saldo": st.column_config.TextColumn("Saldo Restante")
-                        }
+                    with col3:
+                        st.metric("Cuota Mensual", f"${cuota_mensual:,.2f}")
+                    
+                    # Mostrar gráfico de distribución
+                    st.subheader("Distribución del Préstamo")
+                    
+                    # Datos para el gráfico
+                    datos_grafico = [
+                        {'categoria': 'Capital', 'valor': monto},
+                        {'categoria': 'Intereses', 'valor': total_intereses}
+                    ]
+                    df_grafico = pd.DataFrame(datos_grafico)
+                    
+                    # Crear gráfico
+                    fig = px.pie(
+                        df_grafico, 
+                        values='valor', 
+                        names='categoria',
+                        title="Distribución Capital vs. Intereses",
+                        color='categoria',
+                        color_discrete_map={'Capital': '#3498db', 'Intereses': '#e74c3c'}
                     )
-                
-                # Pestaña de evolución gráfica
-                with tab_grafico:
-                    st.write("### Evolución del Préstamo")
+                    fig.update_traces(textposition='inside', textinfo='percent+label')
+                    st.plotly_chart(fig, use_container_width=True)
                     
-                    # Gráfico de evolución del saldo
-                    fig1 = px.line(
-                        plan_pagos, x='num_pago', y='saldo',
-                        title="Evolución del Saldo Pendiente",
-                        labels={'num_pago': 'Número de Cuota', 'saldo': 'Saldo Pendiente ($)'},
-                        markers=True
-                    )
-                    fig1.update_traces(line=dict(color='#3498db', width=3))
-                    st.plotly_chart(fig1, use_container_width=True)
-                    
-                    # Gráfico de composición de cuotas
-                    st.write("### Composición de las Cuotas")
-                    
-                    # Preparar datos para el gráfico de área
-                    fig2 = px.area(
-                        plan_pagos, x='num_pago', y=['capital', 'interes'],
-                        title="Composición de Cuotas (Capital vs Interés)",
-                        labels={'num_pago': 'Número de Cuota', 'value': 'Monto ($)', 'variable': 'Componente'},
-                        color_discrete_map={'capital': '#2ecc71', 'interes': '#e74c3c'}
-                    )
-                    fig2.update_layout(legend_title_text='')
-                    st.plotly_chart(fig2, use_container_width=True)
-                
-                # Opciones para descargar el plan de pagos en diferentes formatos
-                with st.expander("Opciones de Exportación del Plan de Pagos"):
-                    st.write("Exportar plan de pagos en diferentes formatos:")
+                    # Mostrar plan de pagos con mejor experiencia de usuario
+                    st.subheader("📋 Plan de Pagos Proyectado")
                     
-                    col1, col2, col3 = st.columns(3)
+                    # Crear pestañas para diferentes vistas del plan de pagos
+                    tab_resumen, tab_detalle, tab_grafico = st.tabs(["✅ Resumen", "📊 Detalle de Pagos", "📈 Evolución de Pagos"])
                     
-                    # Exportar a CSV
-                    with col1:
-                        csv = plan_pagos_display.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label="📄 Exportar a CSV",
-                            data=csv,
-                            file_name="plan_pagos.csv",
-                            mime="text/csv",
-                            help="Exportar plan de pagos en formato CSV para usar en Excel u otras aplicaciones"
-                        )
+                    # Formatear la tabla
+                    plan_pagos_display = plan_pagos.copy()
                     
-                    # Exportar a Excel
-                    with col2:
-                        # Convertir a DataFrame original para mejor formato en Excel
-                        plan_pagos_excel = plan_pagos.copy()
-                        plan_pagos_excel = plan_pagos_excel.rename(columns={
+                    # Calcular totales para el resumen
+                    total_capital = plan_pagos['capital'].sum()
+                    total_interes = plan_pagos['interes'].sum()
+                    total_pagos = total_capital + total_interes
+                    
+                    # Pestaña de resumen
+                    with tab_resumen:
+                        st.write("### Resumen del Plan de Pagos")
+                        
+                        # Información clave del préstamo
+                        st.info(f"💡 **Información del préstamo:** Monto de ${monto:,.2f} a {plazo_meses} meses con tasa de interés del {tasa_interes}% anual")
+                        
+                        # Mostrar métricas clave
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("Primera cuota", plan_pagos_display['cuota'].iloc[0])
+                            st.metric("Fecha primera cuota", pd.to_datetime(plan_pagos['fecha_pago'].iloc[0]).strftime('%d/%m/%Y'))
+                        with col2:
+                            st.metric("Última cuota", plan_pagos_display['cuota'].iloc[-1])
+                            st.metric("Fecha última cuota", pd.to_datetime(plan_pagos['fecha_pago'].iloc[-1]).strftime('%d/%m/%Y'))
+                        with col3:
+                            st.metric("Total a pagar", f"${total_pagos:,.2f}")
+                            st.metric("Total intereses", f"${total_interes:,.2f}", delta=f"{total_interes/monto*100:.1f}%")
+                        
+                        # Mostrar progresión de pagos en un gráfico simplificado
+                        st.write("### Progresión de Pagos")
+                        
+                        # Crear datos para gráfico de barras apiladas
+                        hitos = [0, int(plazo_meses/4), int(plazo_meses/2), int(3*plazo_meses/4), plazo_meses-1]
+                        hitos = [i for i in hitos if i < len(plan_pagos)]
+                        if hitos[-1] != len(plan_pagos)-1:
+                            hitos.append(len(plan_pagos)-1)
+                        
+                        hitos_df = plan_pagos.iloc[hitos].copy()
+                        hitos_df['num_pago'] = hitos_df['num_pago'].astype(str)
+                        
+                        # Gráfico de barras apiladas para mostrar la evolución
+                        fig = px.bar(hitos_df, x='num_pago', y=['capital', 'interes'], 
+                                     title="Composición de las cuotas a lo largo del préstamo",
+                                     labels={'value': 'Monto ($)', 'num_pago': 'Número de cuota', 'variable': 'Componente'},
+                                     color_discrete_map={'capital': '#3498db', 'interes': '#e74c3c'})
+                        fig.update_layout(legend_title_text='')
+                        st.plotly_chart(fig, use_container_width=True)
+                    
+                    # Pestaña de detalle
+                    with tab_detalle:
+                        # Formatear para visualización
+                        plan_pagos_display['cuota'] = plan_pagos_display['cuota'].map('${:,.2f}'.format)
+                        plan_pagos_display['capital'] = plan_pagos_display['capital'].map('${:,.2f}'.format)
+                        plan_pagos_display['interes'] = plan_pagos_display['interes'].map('${:,.2f}'.format)
+                        plan_pagos_display['saldo'] = plan_pagos_display['saldo'].map('${:,.2f}'.format)
+                        
+                        # Formatear fechas
+                        plan_pagos_display['fecha_pago'] = pd.to_datetime(plan_pagos_display['fecha_pago']).dt.strftime('%d/%m/%Y')
+                        
+                        # Renombrar columnas para mejor visualización
+                        plan_pagos_display = plan_pagos_display.rename(columns={
                             'num_pago': 'Nro.',
                             'fecha_pago': 'Fecha de Pago',
                             'cuota': 'Cuota',
@@ -1728,64 +1855,163 @@ def main():
                             'interes': 'Interés',
                             'saldo': 'Saldo'
                         })
-                        excel_data = exportar_a_excel(plan_pagos_excel, "plan_pagos")
-                        st.download_button(
-                            label="📊 Exportar a Excel",
-                            data=excel_data,
-                            file_name="plan_pagos.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            help="Exportar plan de pagos en formato Excel con formato mejorado"
+                        
+                        # Filtros para la tabla
+                        col1, col2 = st.columns([1, 2])
+                        with col1:
+                            # Opciones de visualización
+                            mostrar_filas = st.radio(
+                                "Mostrar:",
+                                ["Todas las cuotas", "Primeras cuotas", "Últimas cuotas", "Cuotas específicas"]
+                            )
+                        
+                        with col2:
+                            if mostrar_filas == "Primeras cuotas":
+                                num_filas = st.slider("Número de cuotas a mostrar", 1, min(12, len(plan_pagos_display)), 6)
+                                filas_a_mostrar = plan_pagos_display.head(num_filas)
+                            elif mostrar_filas == "Últimas cuotas":
+                                num_filas = st.slider("Número de cuotas a mostrar", 1, min(12, len(plan_pagos_display)), 6)
+                                filas_a_mostrar = plan_pagos_display.tail(num_filas)
+                            elif mostrar_filas == "Cuotas específicas":
+                                rango = st.slider("Rango de cuotas", 1, len(plan_pagos_display), (1, min(12, len(plan_pagos_display))))
+                                filas_a_mostrar = plan_pagos_display.iloc[rango[0]-1:rango[1]]
+                            else:  # Todas las cuotas
+                                if len(plan_pagos_display) > 12:
+                                    pagina = st.selectbox(
+                                        "Página", 
+                                        options=range(1, (len(plan_pagos_display) // 12) + 2),
+                                        format_func=lambda x: f"Página {x} de {(len(plan_pagos_display) // 12) + 1}"
+                                    )
+                                    inicio = (pagina - 1) * 12
+                                    fin = min(inicio + 12, len(plan_pagos_display))
+                                    filas_a_mostrar = plan_pagos_display.iloc[inicio:fin]
+                                else:
+                                    filas_a_mostrar = plan_pagos_display
+                        
+                        # Mostrar tabla con mejor formato
+                        st.write("### Detalle de cuotas")
+                        st.dataframe(
+                            filas_a_mostrar,
+                            use_container_width=True,
+                            hide_index=True,
+                            column_config={
+                                "Nro.": st.column_config.NumberColumn("#", format="%d"),
+                                "Fecha de Pago": st.column_config.DateColumn("Fecha"),
+                                "Cuota": st.column_config.TextColumn("Cuota"),
+                                "Capital": st.column_config.TextColumn("Capital"),
+                                "Interés": st.column_config.TextColumn("Interés"),
+                                "Saldo": st.column_config.TextColumn("Saldo Restante")
+                            }
                         )
                     
-                    # Exportar a PDF
-                    with col3:
-                        pdf_data = exportar_a_pdf(plan_pagos_display, "Plan de Pagos Proyectado")
-                        st.download_button(
-                            label="📑 Exportar a PDF",
-                            data=pdf_data,
-                            file_name="plan_pagos.pdf",
-                            mime="application/pdf",
-                            help="Exportar plan de pagos en formato PDF para imprimir o compartir"
+                    # Pestaña de evolución gráfica
+                    with tab_grafico:
+                        st.write("### Evolución del Préstamo")
+                        
+                        # Gráfico de evolución del saldo
+                        fig1 = px.line(
+                            plan_pagos, x='num_pago', y='saldo',
+                            title="Evolución del Saldo Pendiente",
+                            labels={'num_pago': 'Número de Cuota', 'saldo': 'Saldo Pendiente ($)'},
+                            markers=True
                         )
-                
-                # Gráfico de evolución del saldo
-                st.subheader("Evolución del Saldo")
-                
-                # Preparar datos para el gráfico
-                fig = px.line(
-                    plan_pagos,
-                    x='num_pago',
-                    y='saldo',
-                    title="Evolución del Saldo Pendiente",
-                    labels={'num_pago': 'Número de Pago', 'saldo': 'Saldo Pendiente ($)'},
-                    markers=True
-                )
-                
-                # Personalizar gráfico
-                fig.update_traces(line=dict(color='#3498db', width=3))
-                fig.update_layout(
-                    yaxis=dict(tickprefix='$'),
-                    hovermode='x unified'
-                )
-                
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # Opción para crear un nuevo préstamo con estos parámetros
-                st.markdown("---")
-                if st.button("💵 Crear Préstamo con estos Parámetros", use_container_width=True):
-                    # Guardar los parámetros para autocompletar el formulario
-                    st.session_state.autocompletar_prestamo = True
-                    st.session_state.nuevo_prestamo_params = {
-                        'monto': monto,
-                        'tasa_interes': tasa_interes,
-                        'plazo_meses': plazo_meses,
-                        'fecha_inicio': fecha_inicio.strftime('%Y-%m-%d')
-                    }
-                    # Cambiar a la pestaña de creación de préstamos
-                    st.session_state.menu = "Gestión de Préstamos"
-                    # Activar bandera para ir directamente a la pestaña de creación
-                    st.session_state.prestamo_tab = 0
-                    st.rerun()
+                        fig1.update_traces(line=dict(color='#3498db', width=3))
+                        st.plotly_chart(fig1, use_container_width=True)
+                        
+                        # Gráfico de composición de cuotas
+                        st.write("### Composición de las Cuotas")
+                        
+                        # Preparar datos para el gráfico de área
+                        fig2 = px.area(
+                            plan_pagos, x='num_pago', y=['capital', 'interes'],
+                            title="Composición de Cuotas (Capital vs Interés)",
+                            labels={'num_pago': 'Número de Cuota', 'value': 'Monto ($)', 'variable': 'Componente'},
+                            color_discrete_map={'capital': '#2ecc71', 'interes': '#e74c3c'}
+                        )
+                        fig2.update_layout(legend_title_text='')
+                        st.plotly_chart(fig2, use_container_width=True)
+                    
+                    # Opciones para descargar el plan de pagos en diferentes formatos
+                    with st.expander("Opciones de Exportación del Plan de Pagos"):
+                        st.write("Exportar plan de pagos en diferentes formatos:")
+                        
+                        col1, col2, col3 = st.columns(3)
+                        
+                        # Los archivos se generan al pedirlos; el plan queda identificado por su clave
+                        clave_exportacion = ('plan_pagos', st.session_state.get('usuario'), st.session_state.clave_plan)
+                        
+                        # Exportar a CSV
+                        with col1:
+                            boton_exportacion(
+                                'CSV', clave_exportacion + ('CSV',),
+                                lambda: plan_pagos_display.to_csv(index=False).encode('utf-8'), "plan_pagos",
+                                "Exportar plan de pagos en formato CSV para usar en Excel u otras aplicaciones"
+                            )
+                        
+                        # Exportar a Excel
+                        with col2:
+                            # Convertir a DataFrame original para mejor formato en Excel
+                            plan_pagos_excel = plan_pagos.rename(columns={
+                                'num_pago': 'Nro.',
+                                'fecha_pago': 'Fecha de Pago',
+                                'cuota': 'Cuota',
+                                'capital': 'Capital',
+                                'interes': 'Interés',
+                                'saldo': 'Saldo'
+                            })
+                            boton_exportacion(
+                                'Excel', clave_exportacion + ('Excel',),
+                                lambda: exportar_a_excel(plan_pagos_excel, "plan_pagos"), "plan_pagos",
+                                "Exportar plan de pagos en formato Excel con formato mejorado"
+                            )
+                        
+                        # Exportar a PDF
+                        with col3:
+                            boton_exportacion(
+                                'PDF', clave_exportacion + ('PDF',),
+                                lambda: exportar_a_pdf(plan_pagos_display, "Plan de Pagos Proyectado", ['Cuota', 'Capital', 'Interés']),
+                                "plan_pagos",
+                                "Exportar plan de pagos en formato PDF para imprimir o compartir"
+                            )
+                    
+                    # Gráfico de evolución del saldo
+                    st.subheader("Evolución del Saldo")
+                    
+                    # Preparar datos para el gráfico
+                    fig = px.line(
+                        plan_pagos,
+                        x='num_pago',
+                        y='saldo',
+                        title="Evolución del Saldo Pendiente",
+                        labels={'num_pago': 'Número de Pago', 'saldo': 'Saldo Pendiente ($)'},
+                        markers=True
+                    )
+                    
+                    # Personalizar gráfico
+                    fig.update_traces(line=dict(color='#3498db', width=3))
+                    fig.update_layout(
+                        yaxis=dict(tickprefix='$'),
+                        hovermode='x unified'
+                    )
+                    
+                    st.plotly_chart(fig, use_container_width=True)
+                    
+                    # Opción para crear un nuevo préstamo con estos parámetros
+                    st.markdown("---")
+                    if st.button("💵 Crear Préstamo con estos Parámetros", use_container_width=True):
+                        # Guardar los parámetros para autocompletar el formulario
+                        st.session_state.autocompletar_prestamo = True
+                        st.session_state.nuevo_prestamo_params = {
+                            'monto': monto,
+                            'tasa_interes': tasa_interes,
+                            'plazo_meses': plazo_meses,
+                            'fecha_inicio': fecha_inicio.strftime('%Y-%m-%d')
+                        }
+                        # Cambiar a la pestaña de creación de préstamos
+                        st.session_state.menu = "Gestión de Préstamos"
+                        # Activar bandera para ir directamente a la pestaña de creación
+                        st.session_state.prestamo_tab = 0
+                        st.rerun()
         
         # Gestión de Clientes
         elif current_menu == "Gestión de Clientes":
@@ -1833,51 +2059,60 @@ def main():
             # Pestaña para listar clientes
             with tab2:
                 st.subheader("Lista de Clientes")
-                clientes = obtener_clientes()
-                if not clientes.empty:
-                    # Formatear y renombrar columnas para mejor visualización
-                    clientes_display = clientes.copy()
-                    clientes_display = clientes_display.rename(columns={
+                total_clientes = contar_clientes()
+                if total_clientes > 0:
+                    columnas_clientes = {
                         'id': 'ID',
                         'nombre': 'Nombre Completo',
                         'cedula': 'Cédula',
                         'telefono': 'Teléfono'
-                    })
+                    }
                     
                     # Agregar campo de búsqueda
                     busqueda = st.text_input("🔍 Buscar cliente por nombre, cédula o teléfono", key="buscar_cliente")
                     
-                    # Filtrar clientes según la búsqueda
-                    if busqueda:
-                        # Convertir todo a minúsculas para búsqueda insensible a mayúsculas/minúsculas
-                        busqueda = busqueda.lower()
-                        clientes_filtrados = clientes_display[
-                            clientes_display['Nombre Completo'].str.lower().str.contains(busqueda) |
-                            clientes_display['Cédula'].str.lower().str.contains(busqueda) |
-                            clientes_display['Teléfono'].str.lower().str.contains(busqueda)
-                        ]
+                    # Filtrar clientes según la búsqueda (solo se trae la página de coincidencias)
+                    if busqueda.strip():
+                        clientes_filtrados, total_encontrados = buscar_clientes(busqueda.strip(), LIMITE_BUSQUEDA_CLIENTES)
+                        clientes_display = clientes_filtrados.rename(columns=columnas_clientes)
                         
                         # Mostrar resultados o mensaje de no encontrado
-                        if not clientes_filtrados.empty:
+                        if not clientes_display.empty:
                             st.dataframe(
-                                clientes_filtrados,
+                                clientes_display,
                                 use_container_width=True,
                                 hide_index=True
                             )
-                            st.caption(f"Resultados encontrados: {len(clientes_filtrados)} de {len(clientes_display)} clientes")
+                            if total_encontrados > len(clientes_display):
+                                st.caption(f"Mostrando los {len(clientes_display)} resultados más relevantes de {total_encontrados} encontrados ({total_clientes} clientes)")
+                            else:
+                                st.caption(f"Resultados encontrados: {total_encontrados} de {total_clientes} clientes")
                         else:
                             st.warning("No se encontraron resultados para la búsqueda.")
+                        
+                        # Opciones de exportación avanzada
+                        mostrar_opciones_exportacion(clientes_display, "lista_clientes")
                     else:
-                        # Si no hay búsqueda, mostrar todos los clientes
+                        # Si no hay búsqueda, mostrar una página de clientes
+                        tamano_pagina, pagina, orden, descendente = controles_paginacion(
+                            "lista_clientes", total_clientes, list(ORDEN_CLIENTES), 'Nombre'
+                        )
+                        clientes_pagina, _ = obtener_pagina_clientes(tamano_pagina, pagina, orden, descendente)
                         st.dataframe(
-                            clientes_display,
+                            clientes_pagina.rename(columns=columnas_clientes),
                             use_container_width=True,
                             hide_index=True
                         )
-                        st.caption(f"Total de clientes registrados: {len(clientes_display)}")
-                    
-                    # Opciones de exportación avanzada
-                    mostrar_opciones_exportacion(clientes_display, "lista_clientes")
+                        st.caption(f"Total de clientes registrados: {total_clientes}")
+                        
+                        # La lista completa se escribe por lotes desde la base de datos solo si se va a exportar
+                        mostrar_opciones_exportacion(
+                            None, "lista_clientes",
+                            tablas=('clientes',),
+                            parametros=(orden, descendente),
+                            escribir=lambda archivo, formato: exportar_clientes(archivo, formato, orden=orden,
+                                                                                descendente=descendente)
+                        )
                 else:
                     st.info("No hay clientes registrados")
             
@@ -1885,10 +2120,10 @@ def main():
             with tab3:
                 st.subheader("Editar o Eliminar Cliente")
                 
-                # Obtener lista de clientes
-                clientes = obtener_clientes()
+                # Índice de clientes para el selector
+                etiquetas_clientes = obtener_etiquetas_clientes()
                 
-                if not clientes.empty:
+                if etiquetas_clientes:
                     # Verificar permisos - solo administradores pueden editar/eliminar clientes
                     if not verificar_permiso("operador"):
                         st.warning("No tiene permisos suficientes para editar o eliminar clientes. Solo puede ver la información.")
@@ -1897,11 +2132,11 @@ def main():
                         solo_lectura = False
                     
                     # Selector de cliente con opción vacía por defecto
-                    opciones_clientes = [None] + clientes['id'].tolist()
+                    opciones_clientes = [None] + list(etiquetas_clientes)
                     cliente_seleccionado = st.selectbox(
                         "Seleccione un cliente:",
                         opciones_clientes,
-                        format_func=lambda x: "Seleccione un cliente" if x is None else f"{clientes[clientes['id'] == x]['nombre'].values[0]} - {clientes[clientes['id'] == x]['cedula'].values[0]}"
+                        format_func=lambda x: "Seleccione un cliente" if x is None else etiquetas_clientes[x]
                     )
                     
                     if cliente_seleccionado is not None:
@@ -1999,14 +2234,14 @@ def main():
             else:
                 solo_lectura = False
             
-            # Mostrar resumen de préstamos
-            prestamos = obtener_prestamos()
-            if not prestamos.empty:
-                # Contar préstamos por estado
-                total_prestamos = len(prestamos)
-                pendientes = len(prestamos[prestamos['estado'] == 'Pendiente'])
-                pagados = len(prestamos[prestamos['estado'] == 'Pagado'])
-                atrasados = len(prestamos[prestamos['estado'] == 'Atrasado'])
+            # Mostrar resumen de préstamos (conteo por estado en la base de datos)
+            distribucion_estados = obtener_distribucion_estados()
+            if not distribucion_estados.empty:
+                por_estado = {estado: int(cantidad) for estado, cantidad in zip(distribucion_estados['estado'], distribucion_estados['cantidad'])}
+                total_prestamos = int(distribucion_estados['cantidad'].sum())
+                pendientes = por_estado.get('Pendiente', 0)
+                pagados = por_estado.get('Pagado', 0)
+                atrasados = por_estado.get('Atrasado', 0)
                 
                 # Mostrar métricas de resumen
                 col1, col2, col3, col4 = st.columns(4)
@@ -2037,30 +2272,22 @@ def main():
                 if solo_lectura:
                     st.info("No tiene permisos para registrar nuevos préstamos. Solo puede ver la información.")
                 else:
-                    # Obtener lista de clientes para seleccionar
-                    clientes = obtener_clientes()
-                    if not clientes.empty:
+                    # Índice de clientes (ya ordenado por nombre) para seleccionar
+                    etiquetas_clientes = obtener_etiquetas_clientes(ETIQUETA_CLIENTE_CEDULA)
+                    if etiquetas_clientes:
                         with st.form(key="registro_prestamo"):
                             # Seleccionar cliente con búsqueda
                             st.write("### Información del Cliente")
-                        
-                            # Crear un formato más amigable para mostrar clientes
-                            clientes['display_name'] = clientes.apply(
-                                lambda x: f"{x['nombre']} - Cédula: {x['cedula']}", axis=1
-                            )
-                            
-                            # Ordenar clientes por nombre para fácil búsqueda
-                            clientes = clientes.sort_values('nombre')
                             
                             cliente_id = st.selectbox(
                                 "Seleccione un cliente:",
-                                clientes['id'].tolist(),
-                                format_func=lambda x: clientes[clientes['id'] == x]['display_name'].values[0]
+                                list(etiquetas_clientes),
+                                format_func=lambda x: etiquetas_clientes[x]
                             )
                             
                             # Mostrar información del cliente seleccionado
-                            cliente_seleccionado = clientes[clientes['id'] == cliente_id]
-                            st.info(f"Cliente seleccionado: **{cliente_seleccionado['nombre'].values[0]}** | Teléfono: **{cliente_seleccionado['telefono'].values[0]}**")
+                            cliente_seleccionado = obtener_cliente(cliente_id)
+                            st.info(f"Cliente seleccionado: **{cliente_seleccionado[1]}** | Teléfono: **{cliente_seleccionado[3]}**")
                             
                             st.write("### Información del Préstamo")
                             # Verificar si hay parámetros de la calculadora para autocompletar
@@ -2192,75 +2419,51 @@ def main():
                         ["Todos los préstamos", "Por cliente", "Por estado"]
                     )
                 
-                # Obtener préstamos según filtro
+                # Filtros que se aplican en la base de datos
+                cliente_filtro = None
+                estado_filtro = None
+                sin_clientes = False
                 if filtro_tipo == "Por cliente":
                     with col2:
-                        if not clientes.empty:
+                        etiquetas_clientes = obtener_etiquetas_clientes()
+                        if etiquetas_clientes:
                             cliente_filtro = st.selectbox(
                                 "Seleccione cliente:",
-                                clientes['id'].tolist(),
-                                format_func=lambda x: f"{clientes[clientes['id'] == x]['nombre'].values[0]} - {clientes[clientes['id'] == x]['cedula'].values[0]}"
+                                list(etiquetas_clientes),
+                                format_func=lambda x: etiquetas_clientes[x]
                             )
-                            prestamos = obtener_prestamos_cliente(cliente_filtro)
                         else:
                             st.info("No hay clientes registrados")
-                            prestamos = pd.DataFrame()
+                            sin_clientes = True
                 elif filtro_tipo == "Por estado":
                     with col2:
                         estado_filtro = st.selectbox(
                             "Seleccione estado:",
                             ["Pendiente", "Pagado", "Atrasado"]
                         )
-                        prestamos = obtener_prestamos()
-                        if not prestamos.empty:
-                            prestamos = prestamos[prestamos['estado'] == estado_filtro]
-                else:
-                    prestamos = obtener_prestamos()
                 
                 # Botón para actualizar la lista
                 with col3:
                     if st.button("Actualizar", type="primary"):
                         st.rerun()
                 
+                # Total de préstamos que cumplen el filtro (consulta de conteo, sin traer filas)
+                total_prestamos = 0
+                if not sin_clientes:
+                    total_prestamos = contar_prestamos(cliente_filtro, estado_filtro)
+                
                 # Mostrar préstamos
-                if not prestamos.empty:
-                    # Formatear fechas para mejor visualización
-                    prestamos_display = prestamos.copy()
-                    prestamos_display['fecha_prestamo'] = pd.to_datetime(prestamos_display['fecha_prestamo']).dt.strftime('%d/%m/%Y')
-                    prestamos_display['fecha_vencimiento'] = pd.to_datetime(prestamos_display['fecha_vencimiento']).dt.strftime('%d/%m/%Y')
-                    
-                    # Formatear montos y tasas
-                    prestamos_display['monto'] = prestamos_display['monto'].apply(lambda x: f"${x:,.2f}")
-                    prestamos_display['tasa_interes'] = prestamos_display['tasa_interes'].apply(lambda x: f"{x}%" if pd.notnull(x) else "N/A")
-                    
-                    # Aplicar colores a los estados
-                    def color_estado(val):
-                        if val == 'Pagado':
-                            return 'green'
-                        elif val == 'Atrasado':
-                            return 'red'
-                        else:
-                            return 'orange'
-                    
-                    # Renombrar columnas para mejor visualización
-                    prestamos_display = prestamos_display.rename(columns={
-                        'id': 'ID', 
-                        'nombre': 'Cliente',
-                        'monto': 'Monto',
-                        'fecha_prestamo': 'Fecha Préstamo',
-                        'fecha_vencimiento': 'Fecha Vencimiento',
-                        'tasa_interes': 'Tasa Interés',
-                        'estado': 'Estado'
-                    })
-                    
-                    # Columnas a mostrar (excluir cliente_id)
-                    columnas_mostrar = prestamos_display.columns.tolist()
-                    if 'cliente_id' in columnas_mostrar:
-                        columnas_mostrar.remove('cliente_id')
+                if total_prestamos > 0:
+                    tamano_pagina, pagina, orden, descendente = controles_paginacion(
+                        "lista_prestamos", total_prestamos, list(ORDEN_PRESTAMOS), 'ID', descendente_defecto=True
+                    )
+                    prestamos, _ = obtener_pagina_prestamos(tamano_pagina, pagina, orden, descendente,
+                                                            cliente_id=cliente_filtro, estado=estado_filtro)
+                    prestamos_display = formatear_prestamos(prestamos)
                     
                     # Mostrar tabla con mejor formato
                     st.dataframe(
-                        prestamos_display[columnas_mostrar],
+                        prestamos_display,
                         use_container_width=True,
                         hide_index=True,
                         column_config={
@@ -2278,10 +2481,18 @@ def main():
                     )
                     
                     # Mostrar total de préstamos filtrados
-                    st.caption(f"Total de préstamos mostrados: {len(prestamos_display)}")
-                    
-                    # Opciones de exportación avanzada
-                    mostrar_opciones_exportacion(prestamos_display[columnas_mostrar], "lista_prestamos")
+                    st.caption(f"Mostrando {len(prestamos_display)} de {total_prestamos} préstamos")
+                    
+                    # La lista completa se escribe por lotes desde la base de datos solo si se va a exportar
+                    filtros_exportacion = dict(orden=orden, descendente=descendente, cliente_id=cliente_filtro,
+                                               estado=estado_filtro)
+                    mostrar_opciones_exportacion(
+                        None,
+                        "lista_prestamos",
+                        tablas=('prestamos', 'clientes'),
+                        parametros=(orden, descendente, cliente_filtro, estado_filtro),
+                        escribir=lambda archivo, formato: exportar_prestamos(archivo, formato, **filtros_exportacion)
+                    )
                 else:
                     st.info("No hay préstamos que coincidan con los filtros seleccionados")
             
@@ -2289,21 +2500,15 @@ def main():
             with tab3:
                 st.subheader("Editar o Eliminar Préstamo")
                 
-                # Obtener todos los préstamos
-                prestamos = obtener_prestamos()
+                # Índice de todos los préstamos para el selector
+                etiquetas_prestamos = obtener_etiquetas_prestamos()
                 
-                if not prestamos.empty:
-                    # Crear un formato para mostrar en el selectbox
-                    prestamos['display'] = prestamos.apply(
-                        lambda x: f"ID: {x['id']} - Cliente: {x['nombre']} - Monto: ${x['monto']} - Vence: {x['fecha_vencimiento']}", 
-                        axis=1
-                    )
-                    
+                if etiquetas_prestamos:
                     # Seleccionar préstamo a editar/eliminar
                     prestamo_id = st.selectbox(
                         "Seleccione un préstamo:",
-                        prestamos['id'].tolist(),
-                        format_func=lambda x: prestamos[prestamos['id'] == x]['display'].values[0]
+                        list(etiquetas_prestamos),
+                        format_func=lambda x: etiquetas_prestamos[x]
                     )
                     
                     if prestamo_id:
@@ -2409,24 +2614,29 @@ def main():
             else:
                 solo_lectura = False
             
-            # Obtener todos los préstamos activos
-            prestamos = obtener_prestamos()
-            if not prestamos.empty:
-                # Filtrar préstamos que no estén pagados
-                prestamos_activos = prestamos[prestamos['estado'] != 'Pagado']
+            # Búsqueda de préstamos no pagados: solo se cargan las primeras coincidencias
+            if contar_prestamos():
+                hay_activos = not buscar_prestamos_activos("", 1).empty
+                busqueda_prestamo = ""
+                if hay_activos:
+                    busqueda_prestamo = st.text_input(
+                        "🔍 Buscar préstamo por ID, cliente o cédula",
+                        placeholder="Deje vacío para ver los próximos a vencer"
+                    ).strip()
+                prestamos_encontrados = buscar_prestamos_activos(busqueda_prestamo) if hay_activos else pd.DataFrame()
+                etiquetas_activos = etiquetas_por_id(
+                    prestamos_encontrados, 'id', lambda x: ETIQUETA_PRESTAMO_ESTADO.format(**x._asdict())
+                )
                 
-                if not prestamos_activos.empty:
-                    # Crear un formato para mostrar en el selectbox
-                    prestamos_activos['display'] = prestamos_activos.apply(
-                        lambda x: f"ID: {x['id']} - Cliente: {x['nombre']} - Monto: {x['monto']} - Estado: {x['estado']}", 
-                        axis=1
-                    )
+                if etiquetas_activos:
+                    if len(etiquetas_activos) >= LIMITE_BUSQUEDA_PRESTAMOS:
+                        st.caption(f"Mostrando los primeros {LIMITE_BUSQUEDA_PRESTAMOS} préstamos. Refine la búsqueda para ver otros.")
                     
                     # Seleccionar préstamo para registrar pago
                     prestamo_id = st.selectbox(
                         "Seleccione un préstamo para gestionar pagos:",
-                        prestamos_activos['id'].tolist(),
-                        format_func=lambda x: prestamos_activos[prestamos_activos['id'] == x]['display'].values[0]
+                        list(etiquetas_activos),
+                        format_func=lambda x: etiquetas_activos[x]
                     )
                     
                     if prestamo_id:
@@ -2564,10 +2774,14 @@ def main():
                                 # Opción para eliminar pagos
                                 with st.expander("Eliminar Pago"):
                                     st.warning("Tenga cuidado al eliminar pagos. Esta acción no se puede deshacer.")
+                                    etiquetas_pagos = etiquetas_por_id(
+                                        pagos, 'id',
+                                        lambda x: f"ID: {x.id} - Fecha: {pd.to_datetime(x.fecha_pago).strftime('%d/%m/%Y')} - Monto: ${float(x.monto_pagado):,.2f}"
+                                    )
                                     pago_a_eliminar = st.selectbox(
                                         "Seleccione un pago para eliminar:",
-                                        pagos['id'].tolist(),
-                                        format_func=lambda x: f"ID: {x} - Fecha: {pd.to_datetime(pagos[pagos['id'] == x]['fecha_pago'].values[0]).strftime('%d/%m/%Y')} - Monto: ${float(pagos[pagos['id'] == x]['monto_pagado'].values[0]):,.2f}"
+                                        list(etiquetas_pagos),
+                                        format_func=lambda x: etiquetas_pagos[x]
                                     )
                                     
                                     col1, col2 = st.columns([1, 3])
@@ -2581,6 +2795,8 @@ def main():
                                                 st.error(mensaje)
                             else:
                                 st.info("No hay pagos registrados para este préstamo")
+                elif busqueda_prestamo:
+                    st.info("No se encontraron préstamos pendientes o atrasados que coincidan con la búsqueda")
                 else:
                     st.info("No hay préstamos pendientes o atrasados")
                     if st.button("Ir a Gestión de Préstamos"):
@@ -2602,23 +2818,22 @@ def main():
             st.subheader("Dashboard General")
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total de Préstamos", f"{stats['total_prestamos']}")
-                st.metric("Monto Total Prestado", f"${stats['monto_total']:,.2f}")
+                st.metric("Total de Préstamos", f"{stats.total_prestamos}")
+                st.metric("Monto Total Prestado", f"${stats.monto_total:,.2f}")
             with col2:
-                st.metric("Préstamos Activos", f"{stats['total_activos']}")
-                st.metric("Monto Pendiente de Cobro", f"${stats['monto_pendiente']:,.2f}")
+                st.metric("Préstamos Activos", f"{stats.total_activos}")
+                st.metric("Monto Pendiente de Cobro", f"${stats.monto_pendiente:,.2f}")
             with col3:
-                st.metric("Préstamos Morosos", f"{stats['total_morosos']}", 
-                          delta=f"{stats['total_morosos']}", 
+                st.metric("Préstamos Morosos", f"{stats.total_morosos}", 
+                          delta=f"{stats.total_morosos}", 
                           delta_color="inverse")
-                porcentaje_morosidad = (stats['total_morosos'] / stats['total_prestamos'] * 100) if stats['total_prestamos'] > 0 else 0
-                st.metric("Índice de Morosidad", f"{porcentaje_morosidad:.1f}%")
+                st.metric("Índice de Morosidad", f"{stats.indice_morosidad:.1f}%")
             
             # Separador
             st.markdown("---")
             
             # Pestañas para diferentes tipos de reportes
-            tab1, tab2, tab3 = st.tabs(["Préstamos Activos", "Préstamos por Cliente", "Préstamos Morosos"])
+            tab1, tab2, tab3, tab4 = st.tabs(["Préstamos Activos", "Préstamos por Cliente", "Préstamos Morosos", "Exportaciones"])
             
             # Pestaña 1: Préstamos Activos
             with tab1:
@@ -2635,11 +2850,7 @@ def main():
                     prestamos_display['monto'] = prestamos_display['monto'].apply(lambda x: f"${x:,.2f}")
                     prestamos_display['tasa_interes'] = prestamos_display['tasa_interes'].apply(lambda x: f"{x}%" if pd.notnull(x) else "N/A")
                     
-                    # Calcular saldo pendiente para cada préstamo
-                    saldos = []
-                    for id_prestamo in prestamos_activos['id']:
-                        saldos.append(calcular_saldo_pendiente(id_prestamo))
-                    prestamos_display['saldo_pendiente'] = saldos
+                    # Formatear saldo pendiente
                     prestamos_display['saldo_pendiente'] = prestamos_display['saldo_pendiente'].apply(lambda x: f"${x:,.2f}")
                     
                     # Renombrar columnas para mejor visualización
@@ -2685,28 +2896,20 @@ def main():
             with tab2:
                 st.subheader("Préstamos por Cliente")
                 
-                # Obtener lista de clientes
-                clientes = obtener_clientes()
-                if not clientes.empty:
-                    # Crear un formato más amigable para mostrar clientes
-                    clientes['display_name'] = clientes.apply(
-                        lambda x: f"{x['nombre']} - Cédula: {x['cedula']}", axis=1
-                    )
-                    
-                    # Ordenar clientes por nombre para fácil búsqueda
-                    clientes = clientes.sort_values('nombre')
-                    
+                # Índice de clientes (ya ordenado por nombre)
+                etiquetas_clientes = obtener_etiquetas_clientes(ETIQUETA_CLIENTE_CEDULA)
+                if etiquetas_clientes:
                     # Selector de cliente
                     cliente_id = st.selectbox(
                         "Seleccione un cliente:",
-                        clientes['id'].tolist(),
-                        format_func=lambda x: clientes[clientes['id'] == x]['display_name'].values[0],
+                        list(etiquetas_clientes),
+                        format_func=lambda x: etiquetas_clientes[x],
                         key="reporte_cliente"
                     )
                     
                     # Mostrar información del cliente seleccionado
-                    cliente_seleccionado = clientes[clientes['id'] == cliente_id]
-                    st.info(f"Cliente seleccionado: **{cliente_seleccionado['nombre'].values[0]}** | Teléfono: **{cliente_seleccionado['telefono'].values[0]}**")
+                    cliente_seleccionado = obtener_cliente(cliente_id)
+                    st.info(f"Cliente seleccionado: **{cliente_seleccionado[1]}** | Teléfono: **{cliente_seleccionado[3]}**")
                     
                     # Obtener préstamos del cliente
                     prestamos_cliente = obtener_prestamos_cliente(cliente_id)
@@ -2722,10 +2925,8 @@ def main():
                         prestamos_display['tasa_interes'] = prestamos_display['tasa_interes'].apply(lambda x: f"{x}%" if pd.notnull(x) else "N/A")
                         
                         # Calcular saldo pendiente para cada préstamo
-                        saldos = []
-                        for id_prestamo in prestamos_cliente['id']:
-                            saldos.append(calcular_saldo_pendiente(id_prestamo))
-                        prestamos_display['saldo_pendiente'] = saldos
+                        saldos = calcular_saldos_pendientes(prestamos_cliente['id'])
+                        prestamos_display['saldo_pendiente'] = prestamos_cliente['id'].map(saldos).fillna(0)
                         prestamos_display['saldo_pendiente'] = prestamos_display['saldo_pendiente'].apply(lambda x: f"${x:,.2f}")
                         
                         # Renombrar columnas para mejor visualización
@@ -2753,7 +2954,7 @@ def main():
                         # Calcular estadísticas del cliente
                         total_prestamos = len(prestamos_cliente)
                         total_monto = prestamos_cliente['monto'].sum()
-                        total_pendiente = sum(saldos)
+                        total_pendiente = sum(saldos.values())
                         
                         # Mostrar estadísticas del cliente
                         col1, col2, col3 = st.columns(3)
@@ -2767,10 +2968,10 @@ def main():
                         # Opciones de exportación avanzada
                         mostrar_opciones_exportacion(
                             prestamos_display[columnas_mostrar], 
-                            f"prestamos_{cliente_seleccionado['nombre'].values[0].replace(' ', '_')}"
+                            f"prestamos_{cliente_seleccionado[1].replace(' ', '_')}"
                         )
                     else:
-                        st.info(f"No hay préstamos registrados para {cliente_seleccionado['nombre'].values[0]}")
+                        st.info(f"No hay préstamos registrados para {cliente_seleccionado[1]}")
                 else:
                     st.warning("No hay clientes registrados en el sistema")
             
@@ -2789,16 +2990,10 @@ def main():
                     prestamos_display['monto'] = prestamos_display['monto'].apply(lambda x: f"${x:,.2f}")
                     prestamos_display['tasa_interes'] = prestamos_display['tasa_interes'].apply(lambda x: f"{x}%" if pd.notnull(x) else "N/A")
                     
-                    # Calcular saldo pendiente y días de atraso para cada préstamo
-                    saldos = []
-                    dias_atraso = []
-                    fecha_actual = datetime.now().date()
-                    for idx, row in prestamos_morosos.iterrows():
-                        saldos.append(calcular_saldo_pendiente(row['id']))
-                        fecha_venc = pd.to_datetime(row['fecha_vencimiento']).date()
-                        dias_atraso.append((fecha_actual - fecha_venc).days)
+                    # Calcular días de atraso para cada préstamo
+                    fecha_actual = pd.Timestamp(datetime.now().date())
+                    dias_atraso = (fecha_actual - pd.to_datetime(prestamos_morosos['fecha_vencimiento'])).dt.days
                     
-                    prestamos_display['saldo_pendiente'] = saldos
                     prestamos_display['saldo_pendiente'] = prestamos_display['saldo_pendiente'].apply(lambda x: f"${x:,.2f}")
                     prestamos_display['dias_atraso'] = dias_atraso
                     
@@ -2829,7 +3024,7 @@ def main():
                     
                     # Mostrar total de préstamos morosos y monto total pendiente
                     total_morosos = len(prestamos_morosos)
-                    total_pendiente = sum(saldos)
+                    total_pendiente = prestamos_morosos['saldo_pendiente'].sum()
                     
                     col1, col2 = st.columns(2)
                     with col1:
@@ -2842,6 +3037,10 @@ def main():
                 else:
                     st.success("No hay préstamos morosos en el sistema")
                     st.balloons()
+            
+            # Pestaña 4: Exportaciones completas en segundo plano
+            with tab4:
+                mostrar_trabajos_exportacion()
         
         elif current_menu == "Seguridad":
             st.header("🔐 Seguridad del Sistema")
@@ -2852,7 +3051,7 @@ def main():
                 st.button("Volver al Dashboard", on_click=lambda: setattr(st.session_state, 'menu', 'Dashboard'))
             else:
                 # Pestañas para diferentes opciones de seguridad
-                tab1, tab2, tab3 = st.tabs(["Gestión de Usuarios", "Registro de Actividad", "Cambiar Contraseña"])
+                tab1, tab2, tab3, tab4 = st.tabs(["Gestión de Usuarios", "Registro de Actividad", "Cambiar Contraseña", "Mantenimiento"])
                 
                 # Pestaña 1: Gestión de Usuarios
                 with tab1:
@@ -2923,10 +3122,11 @@ def main():
                         col1, col2 = st.columns(2)
                         
                         with col1:
+                            etiquetas_usuarios = etiquetas_por_id(usuarios, 'id', lambda x: f"{x.usuario} ({x.nivel_acceso})")
                             usuario_id = st.selectbox(
                                 "Seleccione un usuario:",
-                                usuarios['id'].tolist(),
-                                format_func=lambda x: f"{usuarios[usuarios['id'] == x]['usuario'].values[0]} ({usuarios[usuarios['id'] == x]['nivel_acceso'].values[0]})"
+                                list(etiquetas_usuarios),
+                                format_func=lambda x: etiquetas_usuarios[x]
                             )
                         
                         with col2:
@@ -2961,15 +3161,58 @@ def main():
                         )
                     
                     with col2:
-                        filtro_accion = st.text_input("Filtrar por acción (contiene):", "")
+                        filtro_accion = st.text_input("Filtrar por acción:", "")
+                    
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        filtro_texto = st.text_input("Buscar en acción, usuario o detalles:", "")
+                    with col2:
+                        filtrar_fechas = st.checkbox("Filtrar por rango de fechas")
+                        fecha_desde = fecha_hasta = None
+                        if filtrar_fechas:
+                            rango_fechas = st.date_input(
+                                "Rango de fechas:",
+                                (datetime.now().date() - timedelta(days=30), datetime.now().date())
+                            )
+                            if len(rango_fechas) == 2:
+                                fecha_desde, fecha_hasta = rango_fechas
                     
-                    limite = st.slider("Número de registros a mostrar:", 10, 500, 100)
+                    tamano_pagina = st.selectbox("Registros por página:", [25, 50, 100, 250, 500], index=2)
                     
                     # Obtener log de auditoría con filtros
                     usuario_filtro = None if filtro_usuario == "Todos" else filtro_usuario
                     accion_filtro = filtro_accion if filtro_accion else None
+                    filtros = {
+                        'filtro_usuario': usuario_filtro,
+                        'filtro_accion': accion_filtro,
+                        'texto': filtro_texto or None,
+                        'fecha_desde': fecha_desde,
+                        'fecha_hasta': fecha_hasta,
+                    }
+                    
+                    # Volver a la primera página cuando cambian los filtros
+                    firma_filtros = (tuple(filtros.items()), tamano_pagina)
+                    if st.session_state.get('log_firma_filtros') != firma_filtros:
+                        st.session_state.log_firma_filtros = firma_filtros
+                        st.session_state.log_cursor = None
+                        st.session_state.log_direccion = 'siguiente'
+                    
+                    log, cursor_anterior, cursor_siguiente = obtener_pagina_log_auditoria(
+                        tamano_pagina, st.session_state.log_cursor, st.session_state.log_direccion, **filtros
+                    )
                     
-                    log = obtener_log_auditoria(limite, usuario_filtro, accion_filtro)
+                    # Navegación entre páginas
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if st.button("◀ Más recientes", disabled=cursor_anterior is None, key="log_anterior"):
+                            st.session_state.log_cursor = cursor_anterior
+                            st.session_state.log_direccion = 'anterior'
+                            st.rerun()
+                    with col2:
+                        if st.button("Más antiguos ▶", disabled=cursor_siguiente is None, key="log_siguiente"):
+                            st.session_state.log_cursor = cursor_siguiente
+                            st.session_state.log_direccion = 'siguiente'
+                            st.rerun()
                     
                     if not log.empty:
                         # Formatear datos para mejor visualización
@@ -3004,15 +3247,32 @@ def main():
                             hide_index=True
                         )
                         
-                        # Opción para exportar a CSV
-                        if st.button("Exportar a CSV", key="export_log"):
-                            csv = log_display.to_csv(index=False)
-                            st.download_button(
-                                label="Descargar CSV",
-                                data=csv,
-                                file_name="registro_actividad.csv",
-                                mime="text/csv",
+                        # Exportar todo el historial filtrado (no solo la página actual)
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            formato_exportacion = st.radio(
+                                "Formato de exportación:",
+                                ["csv", "ndjson.gz", "xlsx"],
+                                format_func=lambda f: {"csv": "CSV", "ndjson.gz": "NDJSON comprimido", "xlsx": "Excel"}[f],
+                                horizontal=True,
+                                key="formato_export_log"
                             )
+                        with col2:
+                            if st.button("Exportar historial completo", key="export_log"):
+                                with st.spinner("Exportando registro de actividad..."):
+                                    archivo = tempfile.TemporaryFile()
+                                    total = exportar_log_auditoria(archivo, formato_exportacion, **filtros)
+                                    archivo.seek(0)
+                                st.download_button(
+                                    label=f"Descargar {total} registros",
+                                    data=archivo,
+                                    file_name=f"registro_actividad.{formato_exportacion}",
+                                    mime={
+                                        "csv": "text/csv",
+                                        "ndjson.gz": "application/gzip",
+                                        "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                    }[formato_exportacion],
+                                )
                     else:
                         st.info("No hay registros de actividad que coincidan con los filtros")
                 
@@ -3022,11 +3282,10 @@ def main():
                     
                     with st.form("cambiar_contrasena"):
                         # Obtener ID del usuario actual
-                        conn = sqlite3.connect('prestamos.db')
-                        c = conn.cursor()
-                        c.execute("SELECT id FROM usuarios WHERE usuario = ?", (st.session_state.usuario,))
-                        usuario_id = c.fetchone()[0]
-                        conn.close()
+                        with usar_conexion() as conn:
+                            c = conn.cursor()
+                            c.execute("SELECT id FROM usuarios WHERE usuario = ?", (st.session_state.usuario,))
+                            usuario_id = c.fetchone()[0]
                         
                         contrasena_actual = st.text_input("Contraseña Actual", type="password")
                         nueva_contrasena = st.text_input("Nueva Contraseña", type="password")
@@ -3045,6 +3304,112 @@ def main():
                                     st.success(mensaje)
                                 else:
                                     st.error(mensaje)
+                
+                # Pestaña 4: Mantenimiento
+                with tab4:
+                    st.subheader("Mantenimiento de la Base de Datos")
+                    
+                    st.write("Los saldos de los préstamos se actualizan automáticamente con cada pago. "
+                             "Si se modificaron datos fuera del sistema, puede recalcularlos desde los pagos registrados.")
+                    if st.button("Reconstruir Saldos"):
+                        actualizados = reconstruir_saldos()
+                        registrar_actividad(st.session_state.usuario, "reconstruccion_saldos", {"prestamos": actualizados})
+                        st.success(f"Saldos recalculados para {actualizados} préstamos")
+                    
+                    # Estadísticas de la caché de lecturas compartida entre sesiones
+                    st.subheader("Caché de Consultas")
+                    estadisticas_cache = obtener_cache_lecturas().estadisticas
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("Entradas", estadisticas_cache["entradas"])
+                    with col2:
+                        st.metric("Aciertos", estadisticas_cache["aciertos"])
+                    with col3:
+                        st.metric("Fallos", estadisticas_cache["fallos"])
+                    with col4:
+                        st.metric("Tasa de Aciertos", f"{estadisticas_cache['tasa_aciertos']:.1%}")
+                    st.caption(f"Entradas invalidadas por cambios en los datos: {estadisticas_cache['invalidaciones']}")
+                    if st.button("Vaciar Caché"):
+                        obtener_cache_lecturas().limpiar()
+                        obtener_cache_planes().limpiar()
+                        obtener_cache_exportaciones().limpiar()
+                        st.rerun()
+                    
+                    # Planes de pago de la calculadora compartidos entre sesiones
+                    estadisticas_planes = obtener_cache_planes().estadisticas
+                    st.caption(
+                        f"Planes de pago en caché: {estadisticas_planes['entradas']} "
+                        f"({estadisticas_planes['bytes'] / 1024 / 1024:.1f} MB) | "
+                        f"Tasa de aciertos: {estadisticas_planes['tasa_aciertos']:.1%} | "
+                        f"Expulsados: {estadisticas_planes['expulsiones']}"
+                    )
+                    estadisticas_exportaciones = obtener_cache_exportaciones().estadisticas
+                    st.caption(
+                        f"Exportaciones en caché: {estadisticas_exportaciones['entradas']} "
+                        f"({estadisticas_exportaciones['bytes'] / 1024 / 1024:.1f} MB) | "
+                        f"Generadas: {estadisticas_exportaciones['generadas']}"
+                    )
+                    
+                    # Estado de la cola de auditoría (los eventos se escriben por lotes)
+                    st.subheader("Registro de Auditoría")
+                    estadisticas_auditoria = obtener_auditoria().estadisticas
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("Eventos Escritos", estadisticas_auditoria["escritos"])
+                    with col2:
+                        st.metric("Lotes", estadisticas_auditoria["lotes"])
+                    with col3:
+                        st.metric("Pendientes", estadisticas_auditoria["pendientes"])
+                    with col4:
+                        st.metric("Descartados", estadisticas_auditoria["descartados"])
+                    if estadisticas_auditoria["errores"]:
+                        st.warning(f"Lotes con error de escritura (se reintentan): {estadisticas_auditoria['errores']}")
+                    
+                    # Archivo de eventos antiguos
+                    st.subheader("Archivo de Auditoría")
+                    if DIAS_RETENCION > 0:
+                        st.write(f"Los eventos con más de {DIAS_RETENCION} días se mueven diariamente a archivos mensuales.")
+                    else:
+                        st.info("La retención automática está desactivada. Para activarla, defina "
+                                "PRESTAMOS_AUDITORIA_RETENCION_DIAS con los días que se conservan en la base de datos.")
+                    if DIAS_RETENCION > 0 and st.button("Archivar Ahora"):
+                        with st.spinner("Archivando eventos antiguos..."):
+                            resumen = archivar_auditoria()
+                        if resumen['omitido']:
+                            st.warning("No se archivó: hay eventos de auditoría pendientes que no se pudieron escribir. Intente más tarde.")
+                        else:
+                            total_archivados = sum(resumen['archivados'].values())
+                            st.success(f"Eventos archivados: {total_archivados} | Páginas liberadas: {resumen['paginas_liberadas']}")
+                    
+                    inventario = inventario_archivo_auditoria()
+                    if inventario.empty:
+                        st.info("No hay eventos archivados")
+                    else:
+                        st.dataframe(
+                            inventario.rename(columns={
+                                'mes': 'Mes', 'archivo': 'Archivo', 'formato': 'Formato', 'registros': 'Eventos',
+                                'desde': 'Desde', 'hasta': 'Hasta', 'tamano_kb': 'Tamaño (KB)'
+                            }),
+                            use_container_width=True,
+                            hide_index=True
+                        )
+                        
+                        # Consulta bajo demanda de un rango archivado
+                        with st.form("consultar_archivo_auditoria"):
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                rango_archivo = st.date_input(
+                                    "Rango de fechas archivado:",
+                                    (pd.Timestamp(inventario['desde'].min()).date(), pd.Timestamp(inventario['hasta'].max()).date())
+                                )
+                            with col2:
+                                texto_archivo = st.text_input("Buscar texto:", "")
+                            consultar = st.form_submit_button("Consultar Archivo")
+                        
+                        if consultar and len(rango_archivo) == 2:
+                            eventos_archivados = consultar_archivo_auditoria(rango_archivo[0], rango_archivo[1], texto=texto_archivo or None)
+                            st.write(f"Eventos encontrados: {len(eventos_archivados)}")
+                            st.dataframe(eventos_archivados, use_container_width=True, hide_index=True)
 
 # Ejecutar la aplicación
 if __name__ == "__main__":
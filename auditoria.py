@@ -0,0 +1,430 @@
+import atexit
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from base_datos import DB_PATH, abrir_conexion, ejecutar_escritura, obtener_escritor, usar_conexion
+
+# Capacidad de la cola en memoria, tamaño máximo de cada lote y tiempo máximo
+# que un evento puede esperar antes de escribirse (en segundos)
+TAMANO_COLA = int(os.environ.get('PRESTAMOS_AUDITORIA_COLA', '10000'))
+TAMANO_LOTE = int(os.environ.get('PRESTAMOS_AUDITORIA_LOTE', '200'))
+INTERVALO_ESCRITURA = float(os.environ.get('PRESTAMOS_AUDITORIA_INTERVALO', '1.0'))
+
+# Qué hacer cuando la cola está llena: 'bloquear' espera a que haya espacio y, si no lo
+# hay a tiempo, escribe el evento directamente; 'descartar' lo descarta y lo cuenta
+POLITICA_COLA_LLENA = os.environ.get('PRESTAMOS_AUDITORIA_POLITICA', 'bloquear').lower()
+ESPERA_COLA_LLENA = 5.0
+
+# Eventos que el hilo de fondo retiene mientras las escrituras fallan; los que excedan
+# este límite se descartan (y se cuentan) en lugar de acumularse sin fin en memoria
+MAXIMO_PENDIENTES = int(os.environ.get('PRESTAMOS_AUDITORIA_MAXIMO_PENDIENTES', str(TAMANO_COLA)))
+
+# Retención: los eventos con más de DIAS_RETENCION días se mueven a archivos mensuales
+# ('ndjson.gz' o 'sqlite') en DIRECTORIO_ARCHIVO y se eliminan de la base de datos.
+# Desactivada por defecto (0): borrar historial de auditoría debe activarse a propósito
+DIAS_RETENCION = int(os.environ.get('PRESTAMOS_AUDITORIA_RETENCION_DIAS', '0'))
+FORMATO_ARCHIVO = os.environ.get('PRESTAMOS_AUDITORIA_FORMATO_ARCHIVO', 'ndjson.gz').lower()
+DIRECTORIO_ARCHIVO = os.environ.get(
+    'PRESTAMOS_AUDITORIA_ARCHIVO',
+    os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'archivo_auditoria')
+)
+LOTE_ARCHIVO = 5000
+# Páginas que se devuelven al sistema de archivos por transacción y pausa entre una y otra,
+# para que las escrituras de los usuarios no queden esperando detrás de la compactación
+PAGINAS_VACUUM_POR_LOTE = 200
+PAUSA_VACUUM = 0.05
+
+COLUMNAS_EVENTO = ['id', 'timestamp', 'usuario', 'accion', 'detalles', 'ip_address']
+
+SQL_INSERTAR_EVENTO = "INSERT INTO log_auditoria (timestamp, usuario, accion, detalles, ip_address) VALUES (?, ?, ?, ?, ?)"
+
+_auditoria = None
+_lock_auditoria = threading.Lock()
+
+class _Vaciar:
+    """Marca en la cola para pedir que se escriba todo lo pendiente. exito indica si
+    realmente se escribió antes del plazo (limite, en time.monotonic; None = sin plazo)."""
+
+    def __init__(self, detener=False, timeout=None):
+        self.listo = threading.Event()
+        self.exito = False
+        self.detener = detener
+        self.limite = None if timeout is None else time.monotonic() + timeout
+
+class AuditoriaAsincrona:
+    """Encola eventos de auditoría y los escribe por lotes desde un hilo de fondo"""
+
+    def __init__(self, tamano_cola=TAMANO_COLA, tamano_lote=TAMANO_LOTE,
+                 intervalo=INTERVALO_ESCRITURA, politica=POLITICA_COLA_LLENA, maximo_pendientes=MAXIMO_PENDIENTES):
+        self.tamano_lote = tamano_lote
+        self.maximo_pendientes = max(maximo_pendientes, tamano_lote)
+        self.intervalo = intervalo
+        self.politica = politica
+        self._cola = queue.Queue(maxsize=tamano_cola)
+        self._lock_estadisticas = threading.Lock()
+        self._estadisticas = {"encolados": 0, "escritos": 0, "lotes": 0, "descartados": 0, "directos": 0, "errores": 0}
+        self._hilo = threading.Thread(target=self._ejecutar, name="auditoria", daemon=True)
+        self._hilo.start()
+
+    def _contar(self, clave, cantidad=1):
+        with self._lock_estadisticas:
+            self._estadisticas[clave] += cantidad
+
+    def registrar(self, evento):
+        """Encola un evento (timestamp, usuario, accion, detalles, ip_address) sin esperar a la escritura"""
+        try:
+            self._cola.put_nowait(evento)
+        except queue.Full:
+            if self.politica == 'descartar':
+                self._contar("descartados")
+                return
+            try:
+                self._cola.put(evento, timeout=ESPERA_COLA_LLENA)
+            except queue.Full:
+                # El hilo de fondo no da abasto: escribir directamente antes que perder el evento
+                ejecutar_escritura(lambda conn: conn.execute(SQL_INSERTAR_EVENTO, evento))
+                self._contar("directos")
+                return
+        self._contar("encolados")
+
+    def _esperar_marca(self, marca, timeout):
+        try:
+            self._cola.put(marca, timeout=timeout)
+        except queue.Full:
+            return False
+        return marca.listo.wait(timeout) and marca.exito
+
+    def vaciar(self, timeout=None):
+        """Espera a que todos los eventos encolados hasta ahora estén escritos.
+        Devuelve False si no se pudieron escribir dentro del plazo."""
+        return self._esperar_marca(_Vaciar(timeout=timeout), timeout)
+
+    def detener(self, timeout=10):
+        """Escribe lo pendiente y detiene el hilo de fondo. Devuelve False si quedaron
+        eventos sin escribir (se cuentan en 'descartados')."""
+        if not self._hilo.is_alive():
+            return True
+        return self._esperar_marca(_Vaciar(detener=True, timeout=timeout), timeout)
+
+    def _escribir(self, lote):
+        try:
+            ejecutar_escritura(lambda conn: conn.executemany(SQL_INSERTAR_EVENTO, lote))
+        except Exception:
+            self._contar("errores")
+            return False
+        self._contar("escritos", len(lote))
+        self._contar("lotes")
+        return True
+
+    def _escribir_directo(self, lote):
+        """Escribe el lote con una conexión propia, sin pasar por el escritor compartido"""
+        try:
+            conn = abrir_conexion()
+            try:
+                with conn:
+                    conn.executemany(SQL_INSERTAR_EVENTO, lote)
+            finally:
+                conn.close()
+        except Exception:
+            self._contar("errores")
+            return False
+        self._contar("escritos", len(lote))
+        self._contar("directos", len(lote))
+        return True
+
+    def _vaciar_lote(self, lote, marca):
+        """Escribe el lote pedido por una marca: por el escritor, si falla directamente, y si
+        también falla reintenta hasta el plazo de la marca. Devuelve True si quedó escrito."""
+        while True:
+            if self._escribir(lote) or self._escribir_directo(lote):
+                return True
+            if marca.limite is not None and time.monotonic() + self.intervalo > marca.limite:
+                return False
+            time.sleep(self.intervalo)
+
+    def _ejecutar(self):
+        lote = []
+        limite = None
+        reintentando = False
+        while True:
+            espera = None if limite is None else max(0.0, limite - time.monotonic())
+            try:
+                elemento = self._cola.get(timeout=espera)
+            except queue.Empty:
+                elemento = None
+
+            marca = None
+            if isinstance(elemento, _Vaciar):
+                marca = elemento
+            elif elemento is not None:
+                if not lote:
+                    limite = time.monotonic() + self.intervalo
+                if len(lote) < self.maximo_pendientes:
+                    lote.append(elemento)
+                else:
+                    # Las escrituras vienen fallando: no retener más eventos en memoria
+                    self._contar("descartados")
+
+            if marca:
+                # Solo se confirma el vaciado si el lote quedó escrito de verdad
+                marca.exito = not lote or self._vaciar_lote(lote, marca)
+                if marca.exito:
+                    lote = []
+                    limite = None
+                    reintentando = False
+                elif marca.detener:
+                    self._contar("descartados", len(lote))
+                marca.listo.set()
+                if marca.detener:
+                    return
+            # Escribir al llenar el lote o al vencer el intervalo (tras un fallo, solo al vencer)
+            elif lote and ((len(lote) >= self.tamano_lote and not reintentando) or time.monotonic() >= limite):
+                if self._escribir(lote):
+                    lote = []
+                    limite = None
+                    reintentando = False
+                else:
+                    # Reintentar el mismo lote en el siguiente intervalo
+                    limite = time.monotonic() + self.intervalo
+                    reintentando = True
+
+    @property
+    def estadisticas(self):
+        with self._lock_estadisticas:
+            estadisticas = dict(self._estadisticas)
+        estadisticas["pendientes"] = self._cola.qsize()
+        return estadisticas
+
+def obtener_auditoria():
+    """Devuelve el registro de auditoría asíncrono compartido del proceso"""
+    global _auditoria
+    if _auditoria is None:
+        with _lock_auditoria:
+            if _auditoria is None:
+                # Crear antes el escritor para que al salir (atexit en orden inverso)
+                # la auditoría se vacíe mientras el escritor sigue activo
+                obtener_escritor()
+                _auditoria = AuditoriaAsincrona()
+                atexit.register(_auditoria.detener)
+    return _auditoria
+
+def registrar_evento(timestamp, usuario, accion, detalles_json, ip_address):
+    """Encola un evento de auditoría"""
+    obtener_auditoria().registrar((timestamp, usuario, accion, detalles_json, ip_address))
+
+def vaciar_auditoria(timeout=10):
+    """Escribe los eventos pendientes (antes de consultar el registro de auditoría).
+    Devuelve False si no se pudieron escribir dentro del plazo."""
+    if _auditoria is None:
+        return True
+    return _auditoria.vaciar(timeout)
+
+# Retención y archivo del log de auditoría
+def _ruta_archivo(mes, formato, directorio=None):
+    extension = 'db' if formato == 'sqlite' else 'ndjson.gz'
+    return os.path.join(directorio or DIRECTORIO_ARCHIVO, f"log_auditoria_{mes}.{extension}")
+
+def _ruta_manifiesto(directorio=None):
+    return os.path.join(directorio or DIRECTORIO_ARCHIVO, 'manifiesto.json')
+
+def _leer_manifiesto(directorio=None):
+    ruta = _ruta_manifiesto(directorio)
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+def _guardar_manifiesto(manifiesto, directorio=None):
+    ruta = _ruta_manifiesto(directorio)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, indent=2, sort_keys=True)
+    os.replace(temporal, ruta)
+
+def _anexar_a_archivo(ruta, formato, filas):
+    """Agrega filas al archivo mensual y las deja en disco antes de borrarlas de la base de datos"""
+    if formato == 'sqlite':
+        destino = sqlite3.connect(ruta)
+        try:
+            destino.execute("""
+                CREATE TABLE IF NOT EXISTS log_auditoria (
+                    id INTEGER NOT NULL, timestamp TEXT NOT NULL, usuario TEXT NOT NULL,
+                    accion TEXT NOT NULL, detalles TEXT, ip_address TEXT,
+                    PRIMARY KEY (id, timestamp)
+                )
+            """)
+            destino.execute("CREATE INDEX IF NOT EXISTS idx_log_auditoria_timestamp ON log_auditoria (timestamp)")
+            # Un lote repetido tras una interrupción se ignora
+            destino.executemany("INSERT OR IGNORE INTO log_auditoria VALUES (?, ?, ?, ?, ?, ?)", filas)
+            destino.commit()
+        finally:
+            destino.close()
+    else:
+        # Cada lote se agrega como un miembro gzip independiente; gzip los lee como un solo flujo
+        with open(ruta, 'ab') as crudo:
+            with gzip.GzipFile(fileobj=crudo, mode='wb') as comprimido:
+                for fila in filas:
+                    comprimido.write((json.dumps(dict(zip(COLUMNAS_EVENTO, fila)), ensure_ascii=False) + "\n").encode('utf-8'))
+            crudo.flush()
+            os.fsync(crudo.fileno())
+
+def _borrar_eventos(ids):
+    def borrar(conn):
+        return conn.execute(
+            "DELETE FROM log_auditoria WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
+        ).rowcount
+    return ejecutar_escritura(borrar)
+
+def compactar_incremental(paginas=None, paginas_por_lote=PAGINAS_VACUUM_POR_LOTE, pausa=PAUSA_VACUUM):
+    """Devuelve al sistema de archivos las páginas libres (todas o hasta `paginas`) en transacciones
+    cortas sobre una conexión propia, fuera del escritor compartido (requiere auto_vacuum=INCREMENTAL)"""
+    conn = abrir_conexion()
+    conn.isolation_level = None
+    liberadas = 0
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        while paginas is None or liberadas < paginas:
+            lote = min(paginas_por_lote, conn.execute("PRAGMA freelist_count").fetchone()[0])
+            if paginas is not None:
+                lote = min(lote, paginas - liberadas)
+            if lote <= 0:
+                break
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # El módulo sqlite3 avanza la sentencia un solo paso, y cada paso libera una página
+                for _ in range(lote):
+                    conn.execute("PRAGMA incremental_vacuum(1)")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            liberadas += lote
+            time.sleep(pausa)
+    finally:
+        conn.close()
+    return liberadas
+
+def archivar_auditoria(dias=None, formato=None, directorio=None, tamano_lote=LOTE_ARCHIVO):
+    """Mueve los eventos con más de `dias` días a archivos mensuales y los borra por lotes.
+    Devuelve un resumen con los eventos archivados por mes y las páginas liberadas; 'omitido'
+    indica que no se archivó porque los eventos pendientes no se pudieron escribir."""
+    dias = DIAS_RETENCION if dias is None else dias
+    formato = formato or FORMATO_ARCHIVO
+    directorio = directorio or DIRECTORIO_ARCHIVO
+    resumen = {'archivados': {}, 'paginas_liberadas': 0, 'omitido': False}
+    if dias <= 0:
+        return resumen
+
+    # Con eventos aún en cola el archivo quedaría incompleto: mejor reintentar en otro momento
+    if not vaciar_auditoria():
+        resumen['omitido'] = True
+        return resumen
+
+    os.makedirs(directorio, exist_ok=True)
+    corte = (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d')
+    manifiesto = _leer_manifiesto(directorio)
+
+    while True:
+        # Lote más antiguo primero; cada lote se archiva antes de borrarse, así una
+        # interrupción deja como mucho un lote repetido en el archivo (se descarta al leerlo)
+        with usar_conexion() as conn:
+            filas = [tuple(fila) for fila in conn.execute(
+                "SELECT id, timestamp, usuario, accion, detalles, ip_address FROM log_auditoria "
+                "WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                (corte, tamano_lote)
+            ).fetchall()]
+        if not filas:
+            break
+
+        por_mes = {}
+        for fila in filas:
+            por_mes.setdefault(fila[1][:7], []).append(fila)
+
+        for mes, filas_mes in por_mes.items():
+            _anexar_a_archivo(_ruta_archivo(mes, formato, directorio), formato, filas_mes)
+
+        # El manifiesto se actualiza solo después de borrar el lote: si el borrado falla, el
+        # lote se vuelve a archivar en la próxima ejecución y no se cuenta dos veces
+        _borrar_eventos([fila[0] for fila in filas])
+
+        for mes, filas_mes in por_mes.items():
+            ruta = _ruta_archivo(mes, formato, directorio)
+            entrada = manifiesto.setdefault(os.path.basename(ruta), {'mes': mes, 'formato': formato, 'registros': 0,
+                                                                     'desde': filas_mes[0][1], 'hasta': filas_mes[-1][1]})
+            entrada['registros'] += len(filas_mes)
+            entrada['desde'] = min(entrada['desde'], filas_mes[0][1])
+            entrada['hasta'] = max(entrada['hasta'], filas_mes[-1][1])
+            entrada['actualizado'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            resumen['archivados'][mes] = resumen['archivados'].get(mes, 0) + len(filas_mes)
+        _guardar_manifiesto(manifiesto, directorio)
+
+    # Una sola compactación al final, por lotes cortos y fuera del escritor compartido
+    if resumen['archivados']:
+        resumen['paginas_liberadas'] = compactar_incremental()
+    return resumen
+
+def inventario_archivo_auditoria(directorio=None):
+    """Archivos mensuales con su formato, cantidad de eventos, rango de fechas y tamaño"""
+    directorio = directorio or DIRECTORIO_ARCHIVO
+    filas = []
+    manifiesto = _leer_manifiesto(directorio)
+    for nombre, entrada in sorted(manifiesto.items(), key=lambda item: item[1]['mes'], reverse=True):
+        ruta = os.path.join(directorio, nombre)
+        filas.append({
+            'mes': entrada['mes'],
+            'archivo': nombre,
+            'formato': entrada['formato'],
+            'registros': entrada['registros'],
+            'desde': entrada['desde'],
+            'hasta': entrada['hasta'],
+            'tamano_kb': round(os.path.getsize(ruta) / 1024, 1) if os.path.exists(ruta) else None,
+        })
+    return pd.DataFrame(filas, columns=['mes', 'archivo', 'formato', 'registros', 'desde', 'hasta', 'tamano_kb'])
+
+def _leer_archivo_mes(ruta, formato, desde, hasta):
+    if formato == 'sqlite':
+        origen = sqlite3.connect(ruta)
+        try:
+            return pd.read_sql_query(
+                "SELECT * FROM log_auditoria WHERE timestamp >= ? AND timestamp < ?", origen, params=(desde, hasta)
+            )
+        finally:
+            origen.close()
+    with gzip.open(ruta, 'rt', encoding='utf-8') as archivo:
+        registros = [json.loads(linea) for linea in archivo]
+    df = pd.DataFrame(registros, columns=COLUMNAS_EVENTO)
+    return df[(df['timestamp'] >= desde) & (df['timestamp'] < hasta)]
+
+def consultar_archivo_auditoria(fecha_desde, fecha_hasta, filtro_usuario=None, texto=None, directorio=None):
+    """Consulta eventos archivados entre dos fechas (inclusivas), leyendo solo los meses necesarios"""
+    directorio = directorio or DIRECTORIO_ARCHIVO
+    desde = str(fecha_desde)
+    hasta = (pd.Timestamp(fecha_hasta) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    partes = []
+    for nombre, entrada in _leer_manifiesto(directorio).items():
+        if entrada['hasta'] < desde or entrada['desde'] >= hasta:
+            continue
+        ruta = os.path.join(directorio, nombre)
+        if os.path.exists(ruta):
+            partes.append(_leer_archivo_mes(ruta, entrada['formato'], desde, hasta))
+
+    if not partes:
+        return pd.DataFrame(columns=COLUMNAS_EVENTO)
+    # SQLite reutiliza los id de las filas borradas, así que un evento se identifica por (id, timestamp)
+    eventos = pd.concat(partes, ignore_index=True).drop_duplicates(['id', 'timestamp'])
+    if filtro_usuario:
+        eventos = eventos[eventos['usuario'] == filtro_usuario]
+    if texto:
+        contenido = (eventos['accion'] + ' ' + eventos['usuario'] + ' ' + eventos['detalles'].fillna('')).str.lower()
+        for termino in texto.lower().split():
+            eventos = eventos[contenido.loc[eventos.index].str.contains(termino, regex=False)]
+    return eventos.sort_values(['timestamp', 'id'], ascending=False).reset_index(drop=True)
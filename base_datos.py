@@ -0,0 +1,757 @@
+import atexit
+from collections import OrderedDict
+import copy
+from datetime import datetime
+import functools
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Ruta de la base de datos (puede cambiarse con la variable de entorno PRESTAMOS_DB)
+DB_PATH = os.environ.get('PRESTAMOS_DB', 'prestamos.db')
+
+# Modo de almacenamiento: 'wal' (lectores concurrentes y un único hilo escritor)
+# o 'clasico' (journal de rollback, cada sesión escribe directamente)
+MODO_ALMACENAMIENTO = os.environ.get('PRESTAMOS_MODO_DB', 'wal').lower()
+
+# Tiempo máximo de espera cuando la base de datos está bloqueada por otro proceso
+BUSY_TIMEOUT_MS = int(os.environ.get('PRESTAMOS_BUSY_TIMEOUT_MS', '5000'))
+
+# Este módulo se importa una sola vez por proceso, por lo que su estado se comparte
+# entre todas las sesiones y re-ejecuciones de Streamlit.
+_pool = None
+_escritor = None
+_lock_pool = threading.Lock()
+_local_escritura = threading.local()
+_lock_inicializacion = threading.RLock()
+_inicializaciones = {}
+_tareas = {}
+_cache_lecturas = None
+
+def abrir_conexion(ruta_db=None):
+    """Abre una conexión con los pragmas del modo de almacenamiento configurado"""
+    conn = sqlite3.connect(ruta_db or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # Solo tiene efecto al crear la base de datos; en una existente requiere VACUUM
+    # (ver `python mantenimiento.py compactar`)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -16000")
+    if MODO_ALMACENAMIENTO == 'wal':
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    else:
+        conn.execute("PRAGMA journal_mode = DELETE")
+    return conn
+
+class PoolConexiones:
+    """Mantiene un conjunto de conexiones SQLite reutilizables entre sesiones"""
+
+    def __init__(self, ruta_db, tamano_maximo=8):
+        self.ruta_db = ruta_db
+        self.tamano_maximo = tamano_maximo
+        self._libres = queue.LifoQueue(maxsize=tamano_maximo)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.estadisticas = {'conexiones_abiertas': 0, 'prestamos': 0, 'reutilizadas': 0}
+
+    def _abrir(self):
+        """Abre una conexión nueva y la configura una sola vez"""
+        conn = abrir_conexion(self.ruta_db)
+        with self._lock:
+            self.estadisticas['conexiones_abiertas'] += 1
+        return conn
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión del pool; las llamadas anidadas del mismo hilo comparten la misma"""
+        actual = getattr(self._local, 'conexion', None)
+        if actual is not None:
+            yield actual
+            return
+
+        try:
+            conn = self._libres.get_nowait()
+            reutilizada = True
+        except queue.Empty:
+            conn = self._abrir()
+            reutilizada = False
+
+        with self._lock:
+            self.estadisticas['prestamos'] += 1
+            if reutilizada:
+                self.estadisticas['reutilizadas'] += 1
+
+        self._local.conexion = conn
+        try:
+            yield conn
+        finally:
+            self._local.conexion = None
+            # Descartar cualquier transacción que el llamador no haya confirmado
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._libres.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def cerrar(self):
+        """Cierra todas las conexiones libres del pool"""
+        while True:
+            try:
+                self._libres.get_nowait().close()
+            except queue.Empty:
+                break
+
+def obtener_pool():
+    """Devuelve el pool de conexiones compartido por todo el proceso"""
+    global _pool
+    if _pool is None:
+        with _lock_pool:
+            if _pool is None:
+                _pool = PoolConexiones(DB_PATH)
+    return _pool
+
+@contextmanager
+def usar_conexion(conn=None):
+    """Usa la conexión recibida o toma una prestada del pool"""
+    if conn is not None:
+        yield conn
+    else:
+        with obtener_pool().conexion() as conn_pool:
+            yield conn_pool
+
+class EscritorSerializado:
+    """Hilo único que ejecuta todas las escrituras en orden y las agrupa en transacciones"""
+
+    def __init__(self, ruta_db, lote_maximo=64):
+        self.ruta_db = ruta_db
+        self.lote_maximo = lote_maximo
+        self._cola = queue.Queue()
+        self.estadisticas = {'tareas': 0, 'transacciones': 0, 'errores': 0}
+        self._hilo = threading.Thread(target=self._ejecutar, name="escritor-prestamos", daemon=True)
+        self._hilo.start()
+
+    def enviar(self, funcion, *args, **kwargs):
+        """Encola funcion(conn, *args) y devuelve un Future con su resultado"""
+        futuro = Future()
+        self._cola.put((futuro, funcion, args, kwargs))
+        return futuro
+
+    def ejecutar(self, funcion, *args, **kwargs):
+        """Encola una escritura y espera a que quede confirmada"""
+        return self.enviar(funcion, *args, **kwargs).result()
+
+    def detener(self):
+        """Procesa las escrituras pendientes y termina el hilo"""
+        if self._hilo.is_alive():
+            self._cola.put(None)
+            self._hilo.join()
+
+    def _ejecutar(self):
+        conn = abrir_conexion(self.ruta_db)
+        # Las transacciones se controlan explícitamente con BEGIN/SAVEPOINT/COMMIT
+        conn.isolation_level = None
+        _local_escritura.conexion = conn
+
+        detener = False
+        while not detener:
+            tarea = self._cola.get()
+            if tarea is None:
+                break
+
+            # Agrupar las escrituras que ya están esperando en una sola transacción
+            lote = [tarea]
+            while len(lote) < self.lote_maximo:
+                try:
+                    siguiente = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if siguiente is None:
+                    detener = True
+                    break
+                lote.append(siguiente)
+
+            self._procesar_lote(conn, lote)
+
+        conn.close()
+
+    def _procesar_lote(self, conn, lote):
+        resultados = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for futuro, funcion, args, kwargs in lote:
+                if not futuro.set_running_or_notify_cancel():
+                    continue
+                # Cada tarea usa su propio savepoint para que un error no afecte al resto del lote
+                conn.execute("SAVEPOINT tarea")
+                try:
+                    resultado = funcion(conn, *args, **kwargs)
+                    conn.execute("RELEASE tarea")
+                    resultados.append((futuro, resultado, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO tarea")
+                    conn.execute("RELEASE tarea")
+                    resultados.append((futuro, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.estadisticas['errores'] += len(lote)
+            for futuro, _, _, _ in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+
+        self.estadisticas['transacciones'] += 1
+        self.estadisticas['tareas'] += len(resultados)
+        for futuro, resultado, error in resultados:
+            if error is not None:
+                self.estadisticas['errores'] += 1
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
+
+def obtener_escritor():
+    """Devuelve el hilo escritor del proceso, o None en modo clásico"""
+    global _escritor
+    if MODO_ALMACENAMIENTO != 'wal':
+        return None
+    if _escritor is None:
+        with _lock_pool:
+            if _escritor is None:
+                _escritor = EscritorSerializado(DB_PATH)
+                atexit.register(_escritor.detener)
+    return _escritor
+
+def ejecutar_escritura(funcion, *args, **kwargs):
+    """
+    Ejecuta funcion(conn, *args, **kwargs) como una transacción de escritura.
+    
+    La función no debe confirmar (commit) por sí misma: en modo WAL se ejecuta en el
+    hilo escritor dentro de una transacción agrupada, y en modo clásico se confirma
+    al terminar. Las escrituras anidadas reutilizan la transacción en curso.
+    """
+    conn_actual = getattr(_local_escritura, 'conexion', None)
+    if conn_actual is not None:
+        return funcion(conn_actual, *args, **kwargs)
+
+    escritor = obtener_escritor()
+    if escritor is not None:
+        return escritor.ejecutar(funcion, *args, **kwargs)
+
+    with usar_conexion() as conn:
+        _local_escritura.conexion = conn
+        # Transacción explícita, como en el hilo escritor: con el isolation_level por defecto
+        # el módulo sqlite3 confirma cada sentencia DDL por separado
+        nivel_aislamiento = conn.isolation_level
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            resultado = funcion(conn, *args, **kwargs)
+            conn.execute("COMMIT")
+            return resultado
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.isolation_level = nivel_aislamiento
+            _local_escritura.conexion = None
+
+def ejecutar_sql_escritura(sql, parametros=()):
+    """Ejecuta una sola sentencia de escritura y devuelve las filas afectadas"""
+    return ejecutar_escritura(lambda conn: conn.execute(sql, parametros).rowcount)
+
+# Recalcula total_pagado desde pagos; el trigger de prestamos actualiza saldo_pendiente
+SQL_RECONSTRUIR_SALDOS = """
+UPDATE prestamos
+SET total_pagado = COALESCE((SELECT SUM(monto_pagado) FROM pagos WHERE pagos.prestamo_id = prestamos.id), 0)
+"""
+
+# Tablas cuya generación se incrementa con cada cambio (usada por la caché de lecturas)
+TABLAS_VERSIONADAS = ['usuarios', 'clientes', 'prestamos', 'pagos']
+
+def _triggers_generacion():
+    """Sentencias que crean los triggers que incrementan la generación de cada tabla"""
+    sentencias = []
+    for tabla in TABLAS_VERSIONADAS:
+        sentencias.append(f"INSERT OR IGNORE INTO generaciones (tabla, generacion) VALUES ('{tabla}', 0)")
+        for operacion in ('INSERT', 'UPDATE', 'DELETE'):
+            sentencias.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{tabla}_generacion_{operacion.lower()}
+            AFTER {operacion} ON {tabla}
+            BEGIN
+                UPDATE generaciones SET generacion = generacion + 1 WHERE tabla = '{tabla}';
+            END
+            """)
+    return sentencias
+
+# Migraciones del esquema en orden de versión. Cada paso es una sentencia SQL o una
+# función que recibe la conexión. Una migración aplicada queda registrada en
+# schema_version y no vuelve a ejecutarse.
+MIGRACIONES = [
+    (1, "Esquema inicial", [
+        """
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY,
+            usuario TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            nivel_acceso TEXT NOT NULL,
+            nombre_completo TEXT,
+            email TEXT,
+            ultimo_acceso TEXT,
+            activo INTEGER DEFAULT 1
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS log_auditoria (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            usuario TEXT NOT NULL,
+            accion TEXT NOT NULL,
+            detalles TEXT,
+            ip_address TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            cedula TEXT UNIQUE NOT NULL,
+            telefono TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS prestamos (
+            id INTEGER PRIMARY KEY,
+            cliente_id INTEGER NOT NULL,
+            monto REAL NOT NULL,
+            fecha_prestamo DATE NOT NULL,
+            fecha_vencimiento DATE NOT NULL,
+            tasa_interes REAL,
+            estado TEXT DEFAULT 'Pendiente',
+            FOREIGN KEY (cliente_id) REFERENCES clientes(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pagos (
+            id INTEGER PRIMARY KEY,
+            prestamo_id INTEGER NOT NULL,
+            fecha_pago DATE NOT NULL,
+            monto_pagado REAL NOT NULL,
+            FOREIGN KEY (prestamo_id) REFERENCES prestamos(id)
+        )
+        """,
+    ]),
+    (2, "Índices de préstamos por cliente y por estado/vencimiento", [
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_cliente ON prestamos (cliente_id)",
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_estado_vencimiento ON prestamos (estado, fecha_vencimiento)",
+    ]),
+    (3, "Índice de pagos por préstamo y fecha", [
+        "CREATE INDEX IF NOT EXISTS idx_pagos_prestamo_fecha ON pagos (prestamo_id, fecha_pago)",
+    ]),
+    (4, "Índices del log de auditoría por fecha y por usuario", [
+        "CREATE INDEX IF NOT EXISTS idx_log_auditoria_timestamp ON log_auditoria (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_log_auditoria_usuario_timestamp ON log_auditoria (usuario, timestamp)",
+        "ANALYZE",
+    ]),
+    (5, "Tabla de marcas de agua para tareas de mantenimiento", [
+        """
+        CREATE TABLE IF NOT EXISTS mantenimiento (
+            clave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL,
+            actualizado_en TEXT NOT NULL
+        )
+        """,
+    ]),
+    (6, "Saldo acumulado en prestamos mantenido por triggers", [
+        "ALTER TABLE prestamos ADD COLUMN total_pagado REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE prestamos ADD COLUMN saldo_pendiente REAL NOT NULL DEFAULT 0",
+        # El saldo es el monto con interés menos lo pagado, sin negativos y a 2 decimales
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_prestamos_saldo_insert
+        AFTER INSERT ON prestamos
+        BEGIN
+            UPDATE prestamos
+            SET saldo_pendiente = MAX(0, ROUND(monto * (1 + COALESCE(tasa_interes, 0) / 100.0) - total_pagado, 2))
+            WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_prestamos_saldo_update
+        AFTER UPDATE OF monto, tasa_interes, total_pagado ON prestamos
+        BEGIN
+            UPDATE prestamos
+            SET saldo_pendiente = MAX(0, ROUND(monto * (1 + COALESCE(tasa_interes, 0) / 100.0) - total_pagado, 2))
+            WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_pagos_saldo_insert
+        AFTER INSERT ON pagos
+        BEGIN
+            UPDATE prestamos SET total_pagado = total_pagado + NEW.monto_pagado WHERE id = NEW.prestamo_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_pagos_saldo_delete
+        AFTER DELETE ON pagos
+        BEGIN
+            UPDATE prestamos SET total_pagado = total_pagado - OLD.monto_pagado WHERE id = OLD.prestamo_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_pagos_saldo_update
+        AFTER UPDATE OF monto_pagado, prestamo_id ON pagos
+        BEGIN
+            UPDATE prestamos SET total_pagado = total_pagado - OLD.monto_pagado WHERE id = OLD.prestamo_id;
+            UPDATE prestamos SET total_pagado = total_pagado + NEW.monto_pagado WHERE id = NEW.prestamo_id;
+        END
+        """,
+        SQL_RECONSTRUIR_SALDOS,
+    ]),
+    (7, "Índices por fecha de préstamo y de pago para las tendencias mensuales", [
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_fecha_prestamo ON prestamos (fecha_prestamo, monto)",
+        "CREATE INDEX IF NOT EXISTS idx_pagos_fecha_pago ON pagos (fecha_pago, monto_pagado)",
+        "ANALYZE",
+    ]),
+    (8, "Contador de generación por tabla para invalidar la caché de lecturas", [
+        """
+        CREATE TABLE IF NOT EXISTS generaciones (
+            tabla TEXT PRIMARY KEY,
+            generacion INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        *_triggers_generacion(),
+    ]),
+    (9, "Búsqueda de texto completo en el log de auditoría", [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS log_auditoria_fts USING fts5(
+            accion, usuario, detalles,
+            content='log_auditoria', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_log_auditoria_fts_insert
+        AFTER INSERT ON log_auditoria
+        BEGIN
+            INSERT INTO log_auditoria_fts (rowid, accion, usuario, detalles)
+            VALUES (NEW.id, NEW.accion, NEW.usuario, NEW.detalles);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_log_auditoria_fts_delete
+        AFTER DELETE ON log_auditoria
+        BEGIN
+            INSERT INTO log_auditoria_fts (log_auditoria_fts, rowid, accion, usuario, detalles)
+            VALUES ('delete', OLD.id, OLD.accion, OLD.usuario, OLD.detalles);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_log_auditoria_fts_update
+        AFTER UPDATE ON log_auditoria
+        BEGIN
+            INSERT INTO log_auditoria_fts (log_auditoria_fts, rowid, accion, usuario, detalles)
+            VALUES ('delete', OLD.id, OLD.accion, OLD.usuario, OLD.detalles);
+            INSERT INTO log_auditoria_fts (rowid, accion, usuario, detalles)
+            VALUES (NEW.id, NEW.accion, NEW.usuario, NEW.detalles);
+        END
+        """,
+        "INSERT INTO log_auditoria_fts (log_auditoria_fts) VALUES ('rebuild')",
+    ]),
+    (10, "Búsqueda de clientes por subcadena (FTS5 trigram)", [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS clientes_fts USING fts5(
+            nombre, cedula, telefono,
+            content='clientes', content_rowid='id',
+            tokenize='trigram'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_clientes_fts_insert
+        AFTER INSERT ON clientes
+        BEGIN
+            INSERT INTO clientes_fts (rowid, nombre, cedula, telefono)
+            VALUES (NEW.id, NEW.nombre, NEW.cedula, NEW.telefono);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_clientes_fts_delete
+        AFTER DELETE ON clientes
+        BEGIN
+            INSERT INTO clientes_fts (clientes_fts, rowid, nombre, cedula, telefono)
+            VALUES ('delete', OLD.id, OLD.nombre, OLD.cedula, OLD.telefono);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_clientes_fts_update
+        AFTER UPDATE ON clientes
+        BEGIN
+            INSERT INTO clientes_fts (clientes_fts, rowid, nombre, cedula, telefono)
+            VALUES ('delete', OLD.id, OLD.nombre, OLD.cedula, OLD.telefono);
+            INSERT INTO clientes_fts (rowid, nombre, cedula, telefono)
+            VALUES (NEW.id, NEW.nombre, NEW.cedula, NEW.telefono);
+        END
+        """,
+        "INSERT INTO clientes_fts (clientes_fts) VALUES ('rebuild')",
+    ]),
+    (11, "Índice para ordenar clientes por nombre", [
+        "CREATE INDEX IF NOT EXISTS idx_clientes_nombre ON clientes (nombre)",
+    ]),
+    (12, "Índice parcial de préstamos activos por vencimiento", [
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_activos_vencimiento ON prestamos (fecha_vencimiento) WHERE estado != 'Pagado'",
+    ]),
+    (13, "Trabajos de exportación en segundo plano", [
+        """
+        CREATE TABLE IF NOT EXISTS trabajos_exportacion (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reporte TEXT NOT NULL,
+            formato TEXT NOT NULL,
+            usuario TEXT,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            progreso REAL NOT NULL DEFAULT 0,
+            filas INTEGER NOT NULL DEFAULT 0,
+            total_filas INTEGER,
+            archivo TEXT,
+            error TEXT,
+            creado_en TEXT NOT NULL,
+            iniciado_en TEXT,
+            terminado_en TEXT,
+            expira_en TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_trabajos_exportacion_usuario ON trabajos_exportacion (usuario, id)",
+        "CREATE INDEX IF NOT EXISTS idx_trabajos_exportacion_estado ON trabajos_exportacion (estado, expira_en)",
+    ]),
+]
+
+def version_esquema(conn):
+    """Devuelve la versión de esquema aplicada (0 si la base de datos no tiene migraciones).
+    Solo lee: se puede usar dentro de una transacción de lectura."""
+    existe = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if existe is None:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def aplicar_migraciones(conn):
+    """Aplica en orden las migraciones pendientes y devuelve las versiones aplicadas"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            aplicada_en TEXT NOT NULL
+        )
+    """)
+    actual = version_esquema(conn)
+    aplicadas = []
+    for version, descripcion, pasos in MIGRACIONES:
+        if version <= actual:
+            continue
+        for paso in pasos:
+            if callable(paso):
+                paso(conn)
+            else:
+                conn.execute(paso)
+        conn.execute(
+            "INSERT INTO schema_version (version, descripcion, aplicada_en) VALUES (?, ?, ?)",
+            (version, descripcion, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        aplicadas.append(version)
+    return aplicadas
+
+def migrar():
+    """Actualiza la base de datos a la última versión del esquema en una sola transacción"""
+    return ejecutar_escritura(aplicar_migraciones)
+
+def leer_marca(conn, clave):
+    """Lee la marca de agua de una tarea de mantenimiento (None si nunca se ejecutó)"""
+    fila = conn.execute("SELECT valor FROM mantenimiento WHERE clave = ?", (clave,)).fetchone()
+    return fila[0] if fila else None
+
+def guardar_marca(conn, clave, valor):
+    """Guarda la marca de agua de una tarea de mantenimiento"""
+    conn.execute(
+        "INSERT INTO mantenimiento (clave, valor, actualizado_en) VALUES (?, ?, ?) "
+        "ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor, actualizado_en = excluded.actualizado_en",
+        (clave, valor, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+
+def reconstruir_saldos():
+    """Recalcula total_pagado y saldo_pendiente de todos los préstamos y devuelve cuántos se actualizaron"""
+    return ejecutar_sql_escritura(SQL_RECONSTRUIR_SALDOS)
+
+# Inicialización y tareas de fondo del proceso
+def ejecutar_una_vez(clave, funcion):
+    """Ejecuta funcion() solo la primera vez que se solicita en este proceso"""
+    if clave in _inicializaciones:
+        return _inicializaciones[clave]
+    with _lock_inicializacion:
+        if clave not in _inicializaciones:
+            _inicializaciones[clave] = funcion()
+    return _inicializaciones[clave]
+
+class TareaPeriodica:
+    """Ejecuta una función en un hilo de fondo al iniciar y luego cada cierto intervalo"""
+
+    def __init__(self, nombre, funcion, intervalo_segundos):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.intervalo_segundos = intervalo_segundos
+        self.ultima_ejecucion = None
+        self.ultimo_resultado = None
+        self.ultimo_error = None
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._ejecutar, name=f"tarea-{nombre}", daemon=True)
+        self._hilo.start()
+
+    def _ejecutar(self):
+        while True:
+            try:
+                self.ultimo_resultado = self.funcion()
+                self.ultimo_error = None
+            except Exception as e:
+                self.ultimo_error = str(e)
+            self.ultima_ejecucion = datetime.now()
+            if self._detener.wait(self.intervalo_segundos):
+                break
+
+    def detener(self):
+        self._detener.set()
+
+def programar_tarea(nombre, funcion, intervalo_segundos):
+    """Registra una tarea periódica del proceso (solo se crea una por nombre)"""
+    with _lock_inicializacion:
+        if nombre not in _tareas:
+            _tareas[nombre] = TareaPeriodica(nombre, funcion, intervalo_segundos)
+            atexit.register(_tareas[nombre].detener)
+    return _tareas[nombre]
+
+def obtener_tareas():
+    """Devuelve las tareas periódicas registradas en el proceso"""
+    return dict(_tareas)
+
+def consulta_fts(texto, columna=None):
+    """Convierte texto libre en una consulta FTS5 segura: cada palabra como prefijo y todas requeridas"""
+    terminos = ['"' + termino.replace('"', '""') + '"*' for termino in texto.split()]
+    if not terminos:
+        return None
+    consulta = " AND ".join(terminos)
+    return f"{columna} : ({consulta})" if columna else consulta
+
+# Caché de lecturas invalidada por generación de tabla
+def obtener_generaciones(tablas, conn=None):
+    """Devuelve la generación actual de cada tabla indicada"""
+    with usar_conexion(conn) as conn:
+        filas = conn.execute(
+            f"SELECT tabla, generacion FROM generaciones WHERE tabla IN ({', '.join('?' * len(tablas))})",
+            tuple(tablas)
+        ).fetchall()
+    generaciones = dict(filas)
+    return tuple(generaciones.get(tabla, 0) for tabla in tablas)
+
+class CacheLecturas:
+    """Caché LRU compartida por todas las sesiones; cada entrada recuerda las generaciones
+    de las tablas con que se calculó y deja de ser válida cuando alguna cambia"""
+
+    def __init__(self, maximo_entradas=256):
+        self.maximo_entradas = maximo_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave, generaciones):
+        """Devuelve (True, valor) si hay una entrada vigente para la clave"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == generaciones:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return True, entrada[1]
+            if entrada is not None:
+                del self._entradas[clave]
+                self.invalidaciones += 1
+            self.fallos += 1
+            return False, None
+
+    def guardar(self, clave, generaciones, valor):
+        with self._lock:
+            self._entradas[clave] = (generaciones, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.maximo_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    @property
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "invalidaciones": self.invalidaciones,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            }
+
+def obtener_cache_lecturas():
+    """Devuelve la caché de lecturas compartida del proceso"""
+    global _cache_lecturas
+    if _cache_lecturas is None:
+        with _lock_pool:
+            if _cache_lecturas is None:
+                _cache_lecturas = CacheLecturas()
+    return _cache_lecturas
+
+def _copiar_resultado(valor):
+    """Copia de un resultado cacheado: los DataFrames y Series se copian sin duplicar los datos
+    (quien llama reemplaza columnas pero no las modifica en el lugar); los contenedores de
+    Python, que sí se modifican, con una copia profunda"""
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return valor.copy(deep=False)
+    if isinstance(valor, (int, float, str, bytes, type(None))):
+        return valor
+    return copy.deepcopy(valor)
+
+def cachear_lectura(*tablas, copiar=True):
+    """Decorador para funciones de lectura: reutiliza el resultado mientras no cambien las tablas.
+    Las llamadas con una conexión explícita (p. ej. dentro de una escritura) no usan la caché.
+    Con copiar=False se entrega el mismo objeto a todas las sesiones; solo para valores inmutables."""
+    def decorador(funcion):
+        # La clave usa el nombre y no el objeto función porque Streamlit redefine
+        # las funciones de app.py en cada re-ejecución
+        nombre = f"{funcion.__module__}.{funcion.__qualname__}"
+
+        @functools.wraps(funcion)
+        def envoltura(*args, conn=None, **kwargs):
+            if conn is not None:
+                return funcion(*args, conn=conn, **kwargs)
+
+            cache = obtener_cache_lecturas()
+            clave = (nombre, args, tuple(sorted(kwargs.items())))
+            # Leer las generaciones antes de consultar: si hay una escritura en medio,
+            # el resultado queda guardado con una generación vieja y no se reutiliza
+            generaciones = obtener_generaciones(tablas)
+            encontrado, valor = cache.obtener(clave, generaciones)
+            if not encontrado:
+                valor = funcion(*args, **kwargs)
+                cache.guardar(clave, generaciones, _copiar_resultado(valor) if copiar else valor)
+                return valor
+            # Entregar una copia para que quien llama pueda reemplazar columnas del DataFrame
+            return _copiar_resultado(valor) if copiar else valor
+        return envoltura
+    return decorador
@@ -0,0 +1,81 @@
+"""
+Compara el costo de abrir una conexión SQLite por llamada contra el pool compartido.
+Ambos lados ejecutan las mismas consultas; solo cambia cómo se obtiene la conexión
+(el saldo mantenido por triggers se mide aparte en benchmarks/saldos.py).
+
+Uso:
+    python benchmarks/conexiones.py [num_prestamos]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Usar una base de datos temporal para no tocar prestamos.db
+DIRECTORIO = tempfile.mkdtemp(prefix="bench_prestamos_")
+os.environ['PRESTAMOS_DB'] = os.path.join(DIRECTORIO, 'bench.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from base_datos import DB_PATH, obtener_pool, usar_conexion  # noqa: E402
+
+def poblar(num_prestamos, pagos_por_prestamo=1):
+    """Crea clientes, préstamos y pagos de prueba"""
+    app.init_db()
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany(
+        "INSERT INTO clientes (nombre, cedula, telefono) VALUES (?, ?, ?)",
+        [(f"Cliente {i}", f"C{i:08d}", "809-000-0000") for i in range(num_prestamos)]
+    )
+    conn.executemany(
+        "INSERT INTO prestamos (cliente_id, monto, fecha_prestamo, fecha_vencimiento, tasa_interes) VALUES (?, ?, ?, ?, ?)",
+        [(i + 1, 1000 + i, '2024-01-01', '2024-12-31', 10.0) for i in range(num_prestamos)]
+    )
+    conn.executemany(
+        "INSERT INTO pagos (prestamo_id, fecha_pago, monto_pagado) VALUES (?, ?, ?)",
+        [(i + 1, '2024-02-01', 100.0 / pagos_por_prestamo) for i in range(num_prestamos) for _ in range(pagos_por_prestamo)]
+    )
+    conn.commit()
+    conn.close()
+
+def saldo_calculado(conn, prestamo_id):
+    """Cálculo original del saldo: préstamo y suma de sus pagos en dos consultas"""
+    c = conn.cursor()
+    c.execute("SELECT monto, tasa_interes FROM prestamos WHERE id = ?", (prestamo_id,))
+    monto, tasa = c.fetchone()
+    c.execute("SELECT SUM(monto_pagado) FROM pagos WHERE prestamo_id = ?", (prestamo_id,))
+    total_pagado = c.fetchone()[0] or 0
+    return max(0, round(monto * (1 + (tasa or 0) / 100) - total_pagado, 2))
+
+def saldo_con_conexion_nueva(prestamo_id):
+    """Réplica del acceso original: abre y cierra una conexión por llamada"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return saldo_calculado(conn, prestamo_id)
+    finally:
+        conn.close()
+
+def saldo_con_pool(prestamo_id):
+    """Las mismas consultas con una conexión del pool compartido"""
+    with usar_conexion() as conn:
+        return saldo_calculado(conn, prestamo_id)
+
+def medir(nombre, funcion, ids):
+    inicio = time.perf_counter()
+    for prestamo_id in ids:
+        funcion(prestamo_id)
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<28} {duracion * 1000:10.1f} ms  ({duracion / len(ids) * 1e6:8.1f} µs/llamada)")
+    return duracion
+
+if __name__ == "__main__":
+    num_prestamos = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    poblar(num_prestamos)
+    ids = list(range(1, num_prestamos + 1))
+
+    print(f"Saldos pendientes de {num_prestamos} préstamos")
+    base = medir("Conexión por llamada", saldo_con_conexion_nueva, ids)
+    pool = medir("Pool compartido", saldo_con_pool, ids)
+    print(f"Aceleración: {base / pool:.1f}x")
+    print(f"Estadísticas del pool: {obtener_pool().estadisticas}")
@@ -0,0 +1,60 @@
+"""
+Mide el rendimiento de escritura con varias sesiones concurrentes en cada modo de almacenamiento.
+
+Uso:
+    python benchmarks/escrituras.py [sesiones] [pagos_por_sesion]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def ejecutar_modo(sesiones, pagos_por_sesion):
+    """Simula varias sesiones registrando pagos al mismo tiempo (se ejecuta en un subproceso)"""
+    sys.path.insert(0, RAIZ)
+    import app
+    from base_datos import MODO_ALMACENAMIENTO
+
+    app.init_db()
+    app.agregar_cliente("Cliente Benchmark", "BENCH-001", "809-000-0000")
+    app.crear_prestamo(1, 10_000_000, '2024-01-01', '2099-12-31', 10.0)
+
+    errores = []
+
+    def sesion():
+        for _ in range(pagos_por_sesion):
+            exito, mensaje = app.registrar_pago(1, '2024-02-01', 1.0)
+            if not exito:
+                errores.append(mensaje)
+
+    hilos = [threading.Thread(target=sesion) for _ in range(sesiones)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    total = sesiones * pagos_por_sesion
+    print(f"{MODO_ALMACENAMIENTO:<8} {total} pagos en {duracion:6.2f} s "
+          f"({total / duracion:8.1f} pagos/s), errores: {len(errores)}")
+    if errores:
+        print(f"         primer error: {errores[0]}")
+
+if __name__ == "__main__":
+    sesiones = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    pagos_por_sesion = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+
+    if os.environ.get('BENCH_SUBPROCESO'):
+        ejecutar_modo(sesiones, pagos_por_sesion)
+    else:
+        print(f"{sesiones} sesiones concurrentes, {pagos_por_sesion} pagos cada una")
+        for modo in ('clasico', 'wal'):
+            entorno = dict(os.environ, BENCH_SUBPROCESO='1', PRESTAMOS_MODO_DB=modo,
+                           PRESTAMOS_DB=os.path.join(tempfile.mkdtemp(prefix="bench_prestamos_"), 'bench.db'))
+            subprocess.run([sys.executable, __file__, str(sesiones), str(pagos_por_sesion)],
+                           env=entorno, stderr=subprocess.DEVNULL)
@@ -0,0 +1,32 @@
+"""
+Compara el cálculo del saldo pendiente sumando los pagos en cada consulta contra la
+lectura de prestamos.saldo_pendiente, que mantienen los triggers. Ambos lados usan el
+pool compartido, así que la diferencia es solo la del cálculo.
+
+Uso:
+    python benchmarks/saldos.py [num_prestamos] [pagos_por_prestamo]
+"""
+import sys
+import time
+
+# conexiones prepara la base de datos temporal antes de importar app
+from conexiones import medir, poblar, saldo_con_pool
+
+import app  # noqa: E402
+from base_datos import obtener_pool  # noqa: E402
+
+if __name__ == "__main__":
+    num_prestamos = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    pagos_por_prestamo = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    poblar(num_prestamos, pagos_por_prestamo)
+    ids = list(range(1, num_prestamos + 1))
+
+    print(f"Saldos pendientes de {num_prestamos} préstamos con {pagos_por_prestamo} pagos cada uno (pool compartido)")
+    calculado = medir("Suma de pagos por consulta", saldo_con_pool, ids)
+    columna = medir("Columna saldo_pendiente", app.calcular_saldo_pendiente, ids)
+    print(f"Aceleración: {calculado / columna:.1f}x")
+
+    inicio = time.perf_counter()
+    todos = app.calcular_saldos_pendientes()
+    print(f"Todos los saldos en una consulta: {(time.perf_counter() - inicio) * 1000:.1f} ms ({len(todos)} préstamos)")
+    print(f"Estadísticas del pool: {obtener_pool().estadisticas}")
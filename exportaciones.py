@@ -0,0 +1,526 @@
+"""
+Exportación de reportes del sistema de préstamos.
+
+- Caché de exportaciones (CSV, Excel, PDF) compartida por todas las sesiones. Los archivos
+  se generan solo cuando alguien los pide y se guardan bajo una clave que identifica los
+  datos exportados: el contenido del DataFrame (hash) o, cuando los datos se cargan bajo
+  demanda, la generación de las tablas de origen.
+- Motor de Excel por columnas tipadas: cada columna se escribe con su método y formato
+  (número, fecha, texto) en modo constant_memory, fila por fila desde un DataFrame o un
+  cursor, así que la memoria no crece con la cantidad de filas.
+- Motor de PDF por páginas: las filas se agrupan en tablas del tamaño de una página con
+  el encabezado repetido y subtotales opcionales por página.
+- Motor de Parquet: columnas con tipo de Arrow (números, fechas date32, estados con
+  codificación de diccionario) escritas por grupos de filas desde un cursor. pyarrow se
+  importa solo al usarlo.
+"""
+from collections import OrderedDict
+from datetime import datetime
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from xlsxwriter import Workbook
+
+# Límites de la caché de exportaciones recientes
+MAXIMO_EXPORTACIONES = int(os.environ.get('PRESTAMOS_CACHE_EXPORTACIONES_ENTRADAS', '32'))
+MAXIMO_MB_EXPORTACIONES = float(os.environ.get('PRESTAMOS_CACHE_EXPORTACIONES_MB', '128'))
+
+_cache_exportaciones = None
+_lock_cache_exportaciones = threading.Lock()
+
+def hash_dataframe(df):
+    """Huella del contenido de un DataFrame (columnas y valores)"""
+    huella = hashlib.sha1()
+    huella.update(repr(tuple(df.columns)).encode('utf-8'))
+    huella.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return huella.hexdigest()
+
+class CacheExportaciones:
+    """Caché LRU de archivos exportados, limitada por cantidad de entradas y por bytes"""
+
+    def __init__(self, maximo_entradas=MAXIMO_EXPORTACIONES, maximo_bytes=int(MAXIMO_MB_EXPORTACIONES * 1024 * 1024)):
+        self.maximo_entradas = maximo_entradas
+        self.maximo_bytes = maximo_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.generadas = 0
+        self.reutilizadas = 0
+
+    def obtener(self, clave):
+        """Devuelve el archivo guardado para la clave o None"""
+        with self._lock:
+            datos = self._entradas.get(clave)
+            if datos is not None:
+                self._entradas.move_to_end(clave)
+                self.reutilizadas += 1
+            return datos
+
+    def generar(self, clave, funcion):
+        """Devuelve el archivo de la clave, generándolo con funcion() si no está guardado"""
+        datos = self.obtener(clave)
+        if datos is not None:
+            return datos
+        datos = funcion()
+        with self._lock:
+            self.generadas += 1
+            if clave not in self._entradas and len(datos) <= self.maximo_bytes:
+                self._entradas[clave] = datos
+                self._bytes += len(datos)
+                while len(self._entradas) > self.maximo_entradas or self._bytes > self.maximo_bytes:
+                    _, expulsado = self._entradas.popitem(last=False)
+                    self._bytes -= len(expulsado)
+        return datos
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    @property
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "generadas": self.generadas,
+                "reutilizadas": self.reutilizadas,
+            }
+
+def obtener_cache_exportaciones():
+    """Devuelve la caché de exportaciones compartida del proceso"""
+    global _cache_exportaciones
+    if _cache_exportaciones is None:
+        with _lock_cache_exportaciones:
+            if _cache_exportaciones is None:
+                _cache_exportaciones = CacheExportaciones()
+    return _cache_exportaciones
+
+# Motor de Excel
+# Formato de celda de cada tipo de columna (todas con borde, como el resto de los reportes)
+FORMATOS_EXCEL = {
+    'texto': {},
+    'entero': {'num_format': '0'},
+    'decimal': {'num_format': '#,##0.00'},
+    'moneda': {'num_format': '$#,##0.00'},
+    'porcentaje': {'num_format': '0.00"%"'},
+    'fecha': {'num_format': 'dd/mm/yyyy'},
+    'fecha_hora': {'num_format': 'dd/mm/yyyy hh:mm:ss'},
+    # Texto con pocos valores distintos (p. ej. el estado); en Parquet va como diccionario
+    'categoria': {},
+}
+ANCHO_FECHAS = {'fecha': 10, 'fecha_hora': 19}
+
+# Filas que se miran para calcular el ancho de las columnas
+FILAS_MUESTRA_ANCHO = 1000
+
+# Las fechas se escriben como número de serie de Excel (días desde 1899-12-30) con
+# formato de fecha; es lo mismo que hace write_datetime pero sin su conversión por celda
+EPOCA_EXCEL = datetime(1899, 12, 30)
+
+def _serie_excel(valor):
+    """Convierte 'AAAA-MM-DD[ HH:MM:SS]', date, datetime o Timestamp a número de serie de Excel"""
+    if isinstance(valor, float):
+        return valor
+    if isinstance(valor, str):
+        valor = datetime.fromisoformat(valor)
+    elif not isinstance(valor, datetime):
+        valor = datetime(valor.year, valor.month, valor.day)
+    return (valor.replace(tzinfo=None) - EPOCA_EXCEL).total_seconds() / 86400
+
+def _ancho(tipo, valor):
+    if tipo in ANCHO_FECHAS:
+        return ANCHO_FECHAS[tipo]
+    if tipo in ('decimal', 'moneda', 'porcentaje'):
+        return len(f"{valor:,.2f}") + 1
+    return len(str(valor))
+
+def escribir_excel(destino, columnas, lotes, tipos=None, usuario=None, nombre_hoja='Datos'):
+    """
+    Escribe un libro de Excel fila por fila en modo constant_memory.
+
+    Args:
+        destino: Ruta o archivo binario abierto
+        columnas: Encabezados
+        lotes: Iterable de lotes de filas (listas de tuplas), p. ej. cursor.fetchmany
+        tipos: Tipo de cada columna (claves de FORMATOS_EXCEL); por defecto 'texto'
+        usuario: Usuario que aparece en la hoja de información
+
+    Returns:
+        Cantidad de filas de datos escritas
+    """
+    tipos = list(tipos or ['texto'] * len(columnas))
+    libro = Workbook(destino, {'constant_memory': True})
+    hoja = libro.add_worksheet(nombre_hoja)
+    
+    formato_encabezado = libro.add_format({'bold': True, 'bg_color': '#0066cc', 'font_color': 'white', 'border': 1})
+    formatos = {tipo: libro.add_format({'border': 1, **propiedades}) for tipo, propiedades in FORMATOS_EXCEL.items()}
+    # Método de escritura, formato y conversión de cada columna, elegidos una sola vez
+    columnas_tipadas = []
+    for tipo in tipos:
+        if tipo == 'texto':
+            columnas_tipadas.append((hoja.write_string, formatos[tipo], str))
+        elif tipo in ANCHO_FECHAS:
+            columnas_tipadas.append((hoja.write_number, formatos[tipo], _serie_excel))
+        else:
+            columnas_tipadas.append((hoja.write_number, formatos[tipo], float))
+    anchos = [len(str(columna)) for columna in columnas]
+    
+    hoja.write_row(0, 0, columnas, formato_encabezado)
+    hoja.freeze_panes(1, 0)
+    
+    fila_actual = 0
+    for lote in lotes:
+        # El ancho de las columnas se estima con las primeras filas
+        if fila_actual < FILAS_MUESTRA_ANCHO:
+            for valores in lote[:FILAS_MUESTRA_ANCHO - fila_actual]:
+                for columna, valor in enumerate(valores):
+                    if valor is not None and valor == valor:
+                        anchos[columna] = max(anchos[columna], _ancho(tipos[columna], valor))
+        for valores in lote:
+            fila_actual += 1
+            for columna, valor in enumerate(valores):
+                # Celdas vacías (None, NaN, NaT) se omiten
+                if valor is None or valor != valor:
+                    continue
+                escribir, formato, convertir = columnas_tipadas[columna]
+                try:
+                    escribir(fila_actual, columna, convertir(valor), formato)
+                except (TypeError, ValueError):
+                    # Valores que no corresponden al tipo de la columna se conservan como texto
+                    hoja.write_string(fila_actual, columna, str(valor), formatos['texto'])
+    
+    # En constant_memory los anchos y el filtro se guardan al cerrar, así que pueden ir al final
+    for columna, ancho in enumerate(anchos):
+        hoja.set_column(columna, columna, min(ancho, 60) + 2)
+    hoja.autofilter(0, 0, fila_actual, len(columnas) - 1)
+    
+    info = libro.add_worksheet('Información')
+    info.write(0, 0, 'Reporte generado desde Sistema de Préstamos')
+    info.write(1, 0, f'Fecha de generación: {datetime.now().strftime("%d/%m/%Y %H:%M:%S")}')
+    info.write(2, 0, f'Registros: {fila_actual}')
+    if usuario:
+        info.write(3, 0, f'Usuario: {usuario}')
+    
+    libro.close()
+    return fila_actual
+
+def formatear_celda(tipo, valor):
+    """Texto de una celda para mostrar (PDF, CSV) según el tipo de la columna"""
+    if valor is None:
+        return ''
+    if tipo == 'moneda':
+        return f"${valor:,.2f}"
+    if tipo == 'porcentaje':
+        return f"{valor}%"
+    if tipo in ('fecha', 'fecha_hora') and isinstance(valor, str) and len(valor) >= 10:
+        return f"{valor[8:10]}/{valor[5:7]}/{valor[:4]}{valor[10:16]}"
+    return valor
+
+def formatear_lotes(lotes, tipos):
+    """Aplica formatear_celda a cada fila de un iterable de lotes"""
+    for lote in lotes:
+        yield [[formatear_celda(tipo, valor) for tipo, valor in zip(tipos, fila)] for fila in lote]
+
+def lotes_dataframe(df, tamano_lote=5000):
+    """Recorre un DataFrame en lotes de tuplas de valores nativos de Python para escribir_excel.
+    Las columnas de fecha se convierten a número de serie de Excel por lote, no por celda."""
+    for inicio in range(0, len(df), tamano_lote):
+        columnas = []
+        for _, serie in df.iloc[inicio:inicio + tamano_lote].items():
+            if pd.api.types.is_datetime64_any_dtype(serie):
+                serie = (serie - pd.Timestamp(EPOCA_EXCEL)) / pd.Timedelta(days=1)
+            columnas.append(serie.astype(object).where(serie.notna(), None).tolist())
+        yield list(zip(*columnas))
+
+def preparar_dataframe_excel(df):
+    """
+    Devuelve (df, tipos) con cada columna en un tipo nativo. Las columnas de texto que ya
+    vienen formateadas para mostrar ('$1,234.50', 'dd/mm/aaaa', '12.5%') se convierten de
+    una vez por columna a números y fechas.
+    """
+    datos = {}
+    tipos = []
+    for columna in df.columns:
+        serie = df[columna]
+        if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+            datos[columna], tipo = serie, 'entero'
+        elif pd.api.types.is_float_dtype(serie):
+            datos[columna], tipo = serie, 'decimal'
+        elif pd.api.types.is_datetime64_any_dtype(serie):
+            datos[columna], tipo = serie, 'fecha'
+        else:
+            datos[columna], tipo = _convertir_texto(serie)
+        tipos.append(tipo)
+    return pd.DataFrame(datos, index=df.index), tipos
+
+def _convertir_texto(serie):
+    """Detecta montos, porcentajes y fechas formateados en una columna de texto"""
+    valores = serie.dropna()
+    if valores.empty or not all(isinstance(valor, str) for valor in valores.iloc[:FILAS_MUESTRA_ANCHO]):
+        return serie, 'texto'
+    texto = serie.astype('string')
+    if texto.str.fullmatch(r'-?\$-?[\d,]+(\.\d+)?').fillna(True).all():
+        return pd.to_numeric(texto.str.replace(r'[$,]', '', regex=True), errors='coerce'), 'moneda'
+    if texto.str.fullmatch(r'-?[\d.]+%').fillna(True).all():
+        return pd.to_numeric(texto.str.rstrip('%'), errors='coerce'), 'porcentaje'
+    if texto.str.fullmatch(r'\d{2}/\d{2}/\d{4}').fillna(True).all():
+        return pd.to_datetime(texto, format='%d/%m/%Y', errors='coerce'), 'fecha'
+    return serie, 'texto'
+
+def excel_dataframe(df, usuario=None):
+    """Devuelve el contenido de un libro de Excel con los datos de un DataFrame"""
+    datos, tipos = preparar_dataframe_excel(df)
+    with tempfile.TemporaryFile() as archivo:
+        escribir_excel(archivo, [str(columna) for columna in datos.columns], lotes_dataframe(datos), tipos, usuario)
+        archivo.seek(0)
+        return archivo.read()
+
+# Motor de PDF
+# Filas de datos por página (carta horizontal, letra de 8 puntos; caben también en la
+# primera página, debajo del título) y márgenes
+FILAS_POR_PAGINA_PDF = 26
+MARGEN_PDF = 36
+TAMANO_LETRA_PDF = 8
+
+# Estilo común de todas las tablas: encabezado azul y filas alternas con un solo
+# ROWBACKGROUNDS en lugar de un comando por fila
+ESTILO_TABLA_PDF = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.blue),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), TAMANO_LETRA_PDF),
+    ('LEADING', (0, 0), (-1, -1), TAMANO_LETRA_PDF + 2),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+])
+ESTILO_TOTAL_PDF = [
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.lightblue),
+]
+ESTILO_TOTAL_GENERAL_PDF = TableStyle([
+    ('FONTSIZE', (0, 0), (-1, -1), TAMANO_LETRA_PDF),
+    ('LEADING', (0, 0), (-1, -1), TAMANO_LETRA_PDF + 2),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+] + ESTILO_TOTAL_PDF)
+
+@functools.lru_cache(maxsize=None)
+def obtener_estilos():
+    """Hoja de estilos de reportlab, creada una sola vez por proceso"""
+    return getSampleStyleSheet()
+
+def _numero(valor):
+    """Valor numérico de una celda (acepta montos formateados como '$1,234.50')"""
+    if isinstance(valor, (int, float)):
+        return 0.0 if valor != valor else float(valor)
+    try:
+        return float(str(valor).replace('$', '').replace(',', '').replace('%', ''))
+    except ValueError:
+        return 0.0
+
+def _anchos_pdf(columnas, muestra, ancho_disponible):
+    """Ancho de cada columna según el encabezado y las primeras filas, ajustado a la página"""
+    anchos = [
+        max([stringWidth(str(columna), 'Helvetica-Bold', TAMANO_LETRA_PDF)] +
+            [stringWidth(str(fila[i]), 'Helvetica', TAMANO_LETRA_PDF) for fila in muestra]) + 8
+        for i, columna in enumerate(columnas)
+    ]
+    escala = min(1.0, ancho_disponible / sum(anchos))
+    return [ancho * escala for ancho in anchos]
+
+def _recortar(valor, ancho):
+    """Texto de la celda recortado para que quepa en el ancho de la columna"""
+    texto = '' if valor is None else str(valor)
+    maximo = max(int((ancho - 8) / (TAMANO_LETRA_PDF * 0.5)), 3)
+    return texto if len(texto) <= maximo else texto[:maximo - 1] + '…'
+
+def escribir_pdf(destino, columnas, lotes, titulo, usuario=None, columnas_total=(),
+                 filas_por_pagina=FILAS_POR_PAGINA_PDF):
+    """
+    Escribe un reporte PDF con una tabla por página y el encabezado repetido en cada una.
+
+    Args:
+        destino: Ruta o archivo binario abierto
+        columnas: Encabezados
+        lotes: Iterable de lotes de filas ya formateadas para mostrar
+        titulo: Título del reporte
+        usuario: Usuario que aparece en el encabezado del reporte
+        columnas_total: Columnas que se suman en cada página (subtotal) y al final (total)
+
+    Returns:
+        Cantidad de filas escritas
+    """
+    estilos = obtener_estilos()
+    doc = SimpleDocTemplate(destino, pagesize=landscape(letter), leftMargin=MARGEN_PDF, rightMargin=MARGEN_PDF,
+                            topMargin=MARGEN_PDF, bottomMargin=MARGEN_PDF, title=titulo)
+    elementos = [
+        Paragraph(titulo, estilos['Heading1']),
+        Paragraph(f"Reporte generado el {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", estilos['Normal']),
+    ]
+    if usuario:
+        elementos.append(Paragraph(f"Usuario: {usuario}", estilos['Normal']))
+    elementos.append(Spacer(1, 12))
+    
+    indices_total = [columnas.index(columna) for columna in columnas_total]
+    total_general = [0.0] * len(indices_total)
+    
+    def fila_total(etiqueta, sumas):
+        fila = [''] * len(columnas)
+        fila[0] = etiqueta
+        for indice, suma in zip(indices_total, sumas):
+            fila[indice] = f"${suma:,.2f}"
+        return fila
+    
+    def agregar_pagina(filas):
+        datos = [list(columnas)] + [[_recortar(valor, ancho) for valor, ancho in zip(fila, anchos)] for fila in filas]
+        estilo = ESTILO_TABLA_PDF
+        if indices_total:
+            sumas = [sum(_numero(fila[indice]) for fila in filas) for indice in indices_total]
+            for posicion, suma in enumerate(sumas):
+                total_general[posicion] += suma
+            datos.append(fila_total("Total página", sumas))
+            estilo = TableStyle(ESTILO_TABLA_PDF.getCommands() + ESTILO_TOTAL_PDF)
+        if paginas:
+            elementos.append(PageBreak())
+        paginas.append(len(filas))
+        elementos.append(Table(datos, colWidths=anchos, repeatRows=1, style=estilo))
+    
+    # Las filas se agrupan en páginas; cada página es una tabla pequeña, así el costo de
+    # maquetación crece en forma lineal con la cantidad de filas
+    anchos = None
+    paginas = []
+    pendientes = []
+    total_filas = 0
+    for lote in lotes:
+        for fila in lote:
+            if anchos is None:
+                anchos = _anchos_pdf(columnas, list(lote[:200]), landscape(letter)[0] - 2 * MARGEN_PDF)
+            pendientes.append(fila)
+            total_filas += 1
+            if len(pendientes) == filas_por_pagina:
+                agregar_pagina(pendientes)
+                pendientes = []
+    if anchos is None:
+        anchos = _anchos_pdf(columnas, [], landscape(letter)[0] - 2 * MARGEN_PDF)
+    if pendientes or total_filas == 0:
+        agregar_pagina(pendientes)
+    if indices_total:
+        elementos.append(Spacer(1, 6))
+        elementos.append(Table([fila_total("Total general", total_general)], colWidths=anchos,
+                               style=ESTILO_TOTAL_GENERAL_PDF))
+    
+    doc.build(elementos)
+    return total_filas
+
+def pdf_dataframe(df, titulo, usuario=None, columnas_total=None):
+    """Devuelve el contenido de un PDF con los datos de un DataFrame. Se suman por página y
+    al final las columnas_total o, si no se indican, todas las de montos (p. ej. '$1,234.50')."""
+    columnas = [str(columna) for columna in df.columns]
+    if columnas_total is None:
+        _, tipos = preparar_dataframe_excel(df)
+        columnas_total = [columna for columna, tipo in zip(columnas, tipos) if tipo == 'moneda']
+    with tempfile.TemporaryFile() as archivo:
+        escribir_pdf(archivo, columnas, lotes_dataframe(df.astype(object).where(df.notna(), '')), titulo,
+                     usuario, columnas_total)
+        archivo.seek(0)
+        return archivo.read()
+
+# Motor de Parquet
+# Filas por grupo (row group) del archivo: las lecturas por columnas y los filtros de
+# los lectores trabajan grupo por grupo
+FILAS_POR_GRUPO_PARQUET = 65536
+
+def parquet_disponible():
+    """Indica si pyarrow está instalado"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _columna_arrow(tipo, valores):
+    """Arreglo de Arrow de una columna según su tipo (claves de FORMATOS_EXCEL)"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if tipo == 'entero':
+        return pa.array(valores, type=pa.int64())
+    if tipo in ('decimal', 'moneda', 'porcentaje'):
+        return pa.array(valores, type=pa.float64())
+    if tipo == 'categoria':
+        return pa.array(valores, type=pa.string()).dictionary_encode()
+    if tipo == 'fecha':
+        # SQLite guarda las fechas como texto 'AAAA-MM-DD' (a veces con hora)
+        return pc.utf8_slice_codeunits(pa.array(valores, type=pa.string()), 0, 10).cast(pa.date32())
+    if tipo == 'fecha_hora':
+        return pa.array(valores, type=pa.string()).cast(pa.timestamp('s'))
+    return pa.array(valores, type=pa.string())
+
+def esquema_parquet(campos, tipos):
+    """Esquema de Arrow de las columnas de un archivo Parquet"""
+    import pyarrow as pa
+
+    tipos_arrow = {
+        'entero': pa.int64(),
+        'decimal': pa.float64(),
+        'moneda': pa.float64(),
+        'porcentaje': pa.float64(),
+        'fecha': pa.date32(),
+        'fecha_hora': pa.timestamp('s'),
+        'categoria': pa.dictionary(pa.int32(), pa.string()),
+    }
+    return pa.schema([pa.field(campo, tipos_arrow.get(tipo, pa.string())) for campo, tipo in zip(campos, tipos)])
+
+def escribir_parquet(destino, campos, lotes, tipos=None, metadatos=None, filas_por_grupo=FILAS_POR_GRUPO_PARQUET):
+    """
+    Escribe un archivo Parquet con columnas tipadas, un grupo de filas a la vez.
+
+    Args:
+        destino: Ruta o archivo binario abierto
+        campos: Nombres de las columnas
+        lotes: Iterable de lotes de filas (listas de tuplas), p. ej. cursor.fetchmany
+        tipos: Tipo de cada columna (claves de FORMATOS_EXCEL); por defecto 'texto'
+        metadatos: Diccionario de textos que se guarda en el esquema del archivo
+        filas_por_grupo: Filas por grupo; los lotes se acumulan hasta completar uno
+
+    Returns:
+        Cantidad de filas escritas
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipos = list(tipos or ['texto'] * len(campos))
+    esquema = esquema_parquet(campos, tipos)
+    if metadatos:
+        esquema = esquema.with_metadata({clave: str(valor) for clave, valor in metadatos.items()})
+
+    total_filas = 0
+    pendientes = []
+    with pq.ParquetWriter(destino, esquema, compression='zstd') as escritor:
+        def escribir_grupo(filas):
+            columnas = list(zip(*filas))
+            escritor.write_table(pa.Table.from_arrays(
+                [_columna_arrow(tipo, valores) for tipo, valores in zip(tipos, columnas)], schema=esquema
+            ), row_group_size=len(filas))
+
+        for lote in lotes:
+            pendientes.extend(lote)
+            total_filas += len(lote)
+            while len(pendientes) >= filas_por_grupo:
+                escribir_grupo(pendientes[:filas_por_grupo])
+                del pendientes[:filas_por_grupo]
+        if pendientes:
+            escribir_grupo(pendientes)
+    return total_filas
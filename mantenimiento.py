@@ -0,0 +1,127 @@
+"""
+Tareas de mantenimiento de la base de datos del sistema de préstamos.
+
+Uso:
+    python mantenimiento.py migrar
+    python mantenimiento.py reconstruir-saldos
+    python mantenimiento.py archivar-auditoria [--dias N] [--formato ndjson.gz|sqlite]
+    python mantenimiento.py inventario-auditoria
+    python mantenimiento.py consultar-auditoria --desde AAAA-MM-DD --hasta AAAA-MM-DD [--usuario U] [--texto T]
+    python mantenimiento.py compactar
+    python mantenimiento.py exportar-parquet prestamos|pagos|clientes [--salida ARCHIVO]
+    python mantenimiento.py instantanea --directorio DIR
+"""
+import argparse
+
+from auditoria import (DIAS_RETENCION, FORMATO_ARCHIVO, archivar_auditoria, consultar_archivo_auditoria,
+                       inventario_archivo_auditoria)
+from base_datos import DB_PATH, abrir_conexion, migrar, reconstruir_saldos
+from trabajos import DATASETS_PARQUET, exportar_parquet, instantanea_parquet
+
+def comando_migrar(args):
+    """Aplica las migraciones pendientes del esquema"""
+    aplicadas = migrar()
+    if aplicadas:
+        print(f"Migraciones aplicadas: {', '.join(str(v) for v in aplicadas)}")
+    else:
+        print("El esquema ya está actualizado")
+
+def comando_reconstruir_saldos(args):
+    """Recalcula total_pagado y saldo_pendiente de todos los préstamos"""
+    migrar()
+    actualizados = reconstruir_saldos()
+    print(f"Saldos recalculados para {actualizados} préstamos")
+
+def comando_archivar_auditoria(args):
+    """Mueve los eventos de auditoría antiguos al archivo mensual"""
+    migrar()
+    resumen = archivar_auditoria(args.dias, args.formato)
+    if resumen['omitido']:
+        print("No se archivó: hay eventos de auditoría pendientes que no se pudieron escribir")
+        return
+    if not resumen['archivados']:
+        print("No hay eventos de auditoría para archivar")
+        return
+    for mes, cantidad in sorted(resumen['archivados'].items()):
+        print(f"{mes}: {cantidad} eventos archivados")
+    print(f"Páginas liberadas: {resumen['paginas_liberadas']}")
+
+def comando_inventario_auditoria(args):
+    """Muestra los meses archivados"""
+    inventario = inventario_archivo_auditoria()
+    if inventario.empty:
+        print("No hay eventos de auditoría archivados")
+    else:
+        print(inventario.to_string(index=False))
+
+def comando_consultar_auditoria(args):
+    """Consulta eventos archivados en un rango de fechas"""
+    eventos = consultar_archivo_auditoria(args.desde, args.hasta, args.usuario, args.texto)
+    print(eventos.to_csv(index=False), end="")
+
+def comando_compactar(args):
+    """Reconstruye el archivo de la base de datos y activa la compactación incremental"""
+    conn = abrir_conexion()
+    try:
+        conn.isolation_level = None
+        antes = conn.execute("PRAGMA page_count").fetchone()[0]
+        conn.execute("VACUUM")
+        despues = conn.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        conn.close()
+    print(f"Páginas: {antes} -> {despues}")
+
+def comando_exportar_parquet(args):
+    """Exporta una tabla de la cartera a Parquet"""
+    migrar()
+    salida = args.salida or f"{args.dataset}.parquet"
+    filas = exportar_parquet(args.dataset, salida)
+    print(f"{filas} filas exportadas a {salida}")
+
+def comando_instantanea(args):
+    """Guarda préstamos, pagos y clientes en Parquet con un manifiesto"""
+    migrar()
+    manifiesto = instantanea_parquet(args.directorio)
+    for dataset, datos in manifiesto['archivos'].items():
+        print(f"{dataset}: {datos['filas']} filas ({datos['archivo']})")
+    print(f"Instantánea guardada en {args.directorio}")
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Mantenimiento de la base de datos ({DB_PATH})")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    subparsers.add_parser("migrar", help="Aplicar migraciones pendientes").set_defaults(funcion=comando_migrar)
+    subparsers.add_parser("reconstruir-saldos", help="Recalcular los saldos de los préstamos desde los pagos").set_defaults(funcion=comando_reconstruir_saldos)
+
+    archivar = subparsers.add_parser("archivar-auditoria", help="Archivar y borrar eventos de auditoría antiguos")
+    # Sin PRESTAMOS_AUDITORIA_RETENCION_DIAS la retención está desactivada y hay que indicar los días
+    archivar.add_argument("--dias", type=int, default=DIAS_RETENCION or None, required=not DIAS_RETENCION,
+                          help="Días de retención en la base de datos")
+    archivar.add_argument("--formato", choices=["ndjson.gz", "sqlite"], default=FORMATO_ARCHIVO)
+    archivar.set_defaults(funcion=comando_archivar_auditoria)
+
+    subparsers.add_parser("inventario-auditoria", help="Listar los meses archivados").set_defaults(funcion=comando_inventario_auditoria)
+
+    consultar = subparsers.add_parser("consultar-auditoria", help="Consultar eventos archivados (salida CSV)")
+    consultar.add_argument("--desde", required=True)
+    consultar.add_argument("--hasta", required=True)
+    consultar.add_argument("--usuario")
+    consultar.add_argument("--texto")
+    consultar.set_defaults(funcion=comando_consultar_auditoria)
+
+    subparsers.add_parser("compactar", help="Ejecutar VACUUM y activar auto_vacuum incremental").set_defaults(funcion=comando_compactar)
+
+    exportar = subparsers.add_parser("exportar-parquet", help="Exportar una tabla de la cartera a Parquet")
+    exportar.add_argument("dataset", choices=list(DATASETS_PARQUET))
+    exportar.add_argument("--salida", help="Archivo de salida (por defecto, DATASET.parquet)")
+    exportar.set_defaults(funcion=comando_exportar_parquet)
+
+    instantanea = subparsers.add_parser("instantanea", help="Guardar préstamos, pagos y clientes en Parquet con un manifiesto")
+    instantanea.add_argument("--directorio", required=True)
+    instantanea.set_defaults(funcion=comando_instantanea)
+
+    args = parser.parse_args()
+    args.funcion(args)
+
+if __name__ == "__main__":
+    main()
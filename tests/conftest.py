@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del sistema están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_datos  # noqa: E402
+
+@pytest.fixture(params=['wal', 'clasico'])
+def bd(request, tmp_path, monkeypatch):
+    """Base de datos temporal con el esquema migrado, en modo WAL (hilo escritor) y clásico"""
+    monkeypatch.setattr(base_datos, 'DB_PATH', str(tmp_path / 'prestamos.db'))
+    monkeypatch.setattr(base_datos, 'MODO_ALMACENAMIENTO', request.param)
+    monkeypatch.setattr(base_datos, '_pool', None)
+    monkeypatch.setattr(base_datos, '_escritor', None)
+    monkeypatch.setattr(base_datos, '_cache_lecturas', None)
+    base_datos.migrar()
+    yield base_datos
+    if base_datos._escritor is not None:
+        base_datos._escritor.detener()
+    if base_datos._pool is not None:
+        base_datos._pool.cerrar()
+
+def tablas(conn):
+    return {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from amortizacion import COLUMNAS_PLAN, TIPOS_PLAN, plan_pagos, plan_pagos_lote
+
+def _plan_pagos_original(monto, tasa_interes, plazo_meses, fecha_inicio):
+    """Cálculo cuota a cuota que usaba calcular_plan_pagos antes del motor vectorizado"""
+    fecha_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d')
+    tasa_mensual = tasa_interes / 100 / 12
+    if tasa_mensual > 0:
+        cuota_mensual = monto * (tasa_mensual * (1 + tasa_mensual) ** plazo_meses) / ((1 + tasa_mensual) ** plazo_meses - 1)
+    else:
+        cuota_mensual = monto / plazo_meses
+
+    plan = []
+    saldo = monto
+    for mes in range(1, plazo_meses + 1):
+        fecha_pago = fecha_inicio + timedelta(days=30 * mes)
+        interes = saldo * tasa_mensual
+        amortizacion = cuota_mensual - interes
+        nuevo_saldo = saldo - amortizacion
+        if mes == plazo_meses:
+            amortizacion = saldo
+            cuota_mensual = amortizacion + interes
+            nuevo_saldo = 0
+        plan.append({
+            'num_pago': mes,
+            'fecha_pago': fecha_pago.strftime('%Y-%m-%d'),
+            'cuota': cuota_mensual,
+            'capital': amortizacion,
+            'interes': interes,
+            'saldo': nuevo_saldo
+        })
+        saldo = nuevo_saldo
+    return pd.DataFrame(plan)
+
+CASOS = [
+    (10000, 12, 12),
+    (2500.50, 18.5, 36),
+    (150000, 9.75, 240),
+    (5000, 0, 10),
+    (1200, 0, 1),
+    (8000, 24, 1),
+]
+
+@pytest.mark.parametrize("monto,tasa,plazo", CASOS)
+def test_plan_coincide_con_el_calculo_original(monto, tasa, plazo):
+    plan = plan_pagos(monto, tasa, plazo, '2024-01-31')
+    original = _plan_pagos_original(monto, tasa, plazo, '2024-01-31')
+
+    assert list(plan.columns) == COLUMNAS_PLAN
+    assert plan['fecha_pago'].tolist() == original['fecha_pago'].tolist()
+    # El original dejaba el saldo final como entero (y toda la columna con plazo=1);
+    # los montos se comparan redondeados al centavo, sin importar el tipo
+    pd.testing.assert_frame_equal(plan.drop(columns='fecha_pago').round(2),
+                                  original.drop(columns='fecha_pago').astype(float).round(2),
+                                  check_dtype=False)
+
+@pytest.mark.parametrize("monto,tasa,plazo", CASOS)
+def test_tipos_de_columna_no_dependen_del_plazo(monto, tasa, plazo):
+    plan = plan_pagos(monto, tasa, plazo, '2024-01-31')
+    assert plan.dtypes.astype(str).to_dict() == TIPOS_PLAN
+
+def test_plan_en_lote_coincide_con_planes_individuales():
+    montos, tasas, plazos = zip(*CASOS)
+    lote = plan_pagos_lote(montos, tasas, plazos, '2024-01-31')
+    for posicion, caso in enumerate(CASOS):
+        individual = lote[lote['prestamo'] == posicion].drop(columns='prestamo').reset_index(drop=True)
+        pd.testing.assert_frame_equal(individual, plan_pagos(*caso, '2024-01-31'))
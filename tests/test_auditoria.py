@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+import auditoria
+
+EVENTO = ('2024-01-01 10:00:00', 'admin', 'PRUEBA', '{}', '127.0.0.1')
+
+@pytest.fixture
+def escrituras(bd, monkeypatch):
+    """Permite simular que tanto el escritor compartido como la conexión directa fallan"""
+    estado = {'fallar': False}
+
+    def envolver(funcion):
+        def envuelta(*args, **kwargs):
+            if estado['fallar']:
+                raise sqlite3.OperationalError("database is locked")
+            return funcion(*args, **kwargs)
+        return envuelta
+
+    monkeypatch.setattr(auditoria, 'ejecutar_escritura', envolver(bd.ejecutar_escritura))
+    monkeypatch.setattr(auditoria, 'abrir_conexion', envolver(bd.abrir_conexion))
+    return estado
+
+@pytest.fixture
+def crear_auditoria():
+    creadas = []
+
+    def crear(**kwargs):
+        kwargs.setdefault('intervalo', 0.05)
+        registro = auditoria.AuditoriaAsincrona(**kwargs)
+        creadas.append(registro)
+        return registro
+
+    yield crear
+    for registro in creadas:
+        registro.detener(timeout=1)
+
+def _eventos_escritos(bd):
+    with bd.usar_conexion() as conn:
+        return conn.execute("SELECT COUNT(*) FROM log_auditoria WHERE accion = 'PRUEBA'").fetchone()[0]
+
+def test_vaciar_informa_si_los_eventos_quedaron_escritos(bd, escrituras, crear_auditoria):
+    registro = crear_auditoria()
+    escrituras['fallar'] = True
+    for _ in range(5):
+        registro.registrar(EVENTO)
+
+    assert registro.vaciar(timeout=0.3) is False
+    assert _eventos_escritos(bd) == 0
+
+    escrituras['fallar'] = False
+    assert registro.vaciar(timeout=5) is True
+    assert _eventos_escritos(bd) == 5
+    assert registro.estadisticas['descartados'] == 0
+
+def test_eventos_sobre_el_maximo_pendiente_se_descartan(bd, escrituras, crear_auditoria):
+    registro = crear_auditoria(tamano_lote=2, maximo_pendientes=3)
+    escrituras['fallar'] = True
+    for _ in range(10):
+        registro.registrar(EVENTO)
+    assert registro.vaciar(timeout=0.3) is False
+
+    escrituras['fallar'] = False
+    assert registro.vaciar(timeout=5) is True
+    estadisticas = registro.estadisticas
+    assert estadisticas['escritos'] == 3
+    assert estadisticas['descartados'] == 7
+    assert _eventos_escritos(bd) == 3
+
+def test_detener_escribe_los_eventos_en_cola(bd, escrituras, crear_auditoria):
+    # Intervalo y lote grandes: nada se escribe hasta que se detiene
+    registro = crear_auditoria(tamano_lote=1000, intervalo=60)
+    for _ in range(50):
+        registro.registrar(EVENTO)
+
+    assert registro.detener(timeout=5) is True
+    assert not registro._hilo.is_alive()
+    assert _eventos_escritos(bd) == 50
+
+def test_detener_cuenta_lo_que_no_pudo_escribir(bd, escrituras, crear_auditoria):
+    registro = crear_auditoria(tamano_lote=1000, intervalo=60)
+    escrituras['fallar'] = True
+    for _ in range(4):
+        registro.registrar(EVENTO)
+
+    assert registro.detener(timeout=0.3) is False
+    registro._hilo.join(5)
+    assert registro.estadisticas['descartados'] == 4
+    assert _eventos_escritos(bd) == 0
+
+def _insertar_eventos_antiguos(bd, cantidad):
+    eventos = [(f"2020-0{1 + i % 2}-1{i % 10} 10:00:00", 'admin', 'ANTIGUO', '{}', '127.0.0.1') for i in range(cantidad)]
+    bd.ejecutar_escritura(lambda conn: conn.executemany(auditoria.SQL_INSERTAR_EVENTO, eventos))
+
+@pytest.mark.parametrize("formato", ['ndjson.gz', 'sqlite'])
+def test_borrado_fallido_no_cuenta_dos_veces_en_el_manifiesto(bd, tmp_path, monkeypatch, formato):
+    _insertar_eventos_antiguos(bd, 30)
+    directorio = str(tmp_path / 'archivo')
+    borrar_eventos = auditoria._borrar_eventos
+
+    def fallar(ids):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(auditoria, '_borrar_eventos', fallar)
+    with pytest.raises(sqlite3.OperationalError):
+        auditoria.archivar_auditoria(dias=30, formato=formato, directorio=directorio, tamano_lote=10)
+    assert auditoria._leer_manifiesto(directorio) == {}
+
+    # La siguiente ejecución vuelve a archivar el lote y lo cuenta una sola vez
+    monkeypatch.setattr(auditoria, '_borrar_eventos', borrar_eventos)
+    resumen = auditoria.archivar_auditoria(dias=30, formato=formato, directorio=directorio, tamano_lote=10)
+    assert resumen['archivados'] == {'2020-01': 15, '2020-02': 15}
+    inventario = auditoria.inventario_archivo_auditoria(directorio)
+    assert inventario['registros'].sum() == 30
+    archivados = auditoria.consultar_archivo_auditoria('2020-01-01', '2020-12-31', directorio=directorio)
+    assert len(archivados) == 30
+    with bd.usar_conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM log_auditoria WHERE accion = 'ANTIGUO'").fetchone()[0] == 0
+
+def test_no_archiva_si_la_auditoria_no_se_pudo_vaciar(bd, tmp_path, monkeypatch):
+    _insertar_eventos_antiguos(bd, 5)
+    monkeypatch.setattr(auditoria, 'vaciar_auditoria', lambda timeout=10: False)
+
+    resumen = auditoria.archivar_auditoria(dias=30, directorio=str(tmp_path / 'archivo'))
+    assert resumen['omitido'] is True
+    assert resumen['archivados'] == {}
+    with bd.usar_conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM log_auditoria WHERE accion = 'ANTIGUO'").fetchone()[0] == 5
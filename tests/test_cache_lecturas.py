@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from base_datos import cachear_lectura, ejecutar_sql_escritura, usar_conexion
+
+@cachear_lectura('clientes')
+def _clientes(conn=None):
+    with usar_conexion(conn) as conn:
+        return pd.read_sql_query("SELECT id, nombre, cedula FROM clientes ORDER BY id", conn)
+
+@cachear_lectura('clientes')
+def _resumen_clientes(conn=None):
+    with usar_conexion(conn) as conn:
+        return {'cedulas': [fila[0] for fila in conn.execute("SELECT cedula FROM clientes ORDER BY id")]}
+
+def _insertar_cliente(cedula):
+    ejecutar_sql_escritura("INSERT INTO clientes (nombre, cedula, telefono) VALUES (?, ?, ?)",
+                           (f"Cliente {cedula}", cedula, "809-000-0000"))
+
+def test_dataframe_cacheado_se_copia_sin_duplicar_datos(bd):
+    _insertar_cliente("A-1")
+    _insertar_cliente("A-2")
+    primero = _clientes()
+    segundo = _clientes()
+
+    assert segundo is not primero
+    assert np.shares_memory(primero['id'].to_numpy(), segundo['id'].to_numpy())
+
+    # Reemplazar columnas en la copia no altera lo que reciben las demás sesiones
+    segundo['nombre'] = segundo['nombre'].str.upper()
+    segundo['extra'] = 1
+    tercero = _clientes()
+    assert tercero['nombre'].tolist() == ["Cliente A-1", "Cliente A-2"]
+    assert 'extra' not in tercero.columns
+
+def test_contenedores_cacheados_se_copian_completos(bd):
+    _insertar_cliente("A-1")
+    resumen = _resumen_clientes()
+    resumen['cedulas'].append("modificada")
+    assert _resumen_clientes() == {'cedulas': ["A-1"]}
+
+def test_escritura_invalida_el_resultado_cacheado(bd):
+    _insertar_cliente("A-1")
+    assert len(_clientes()) == 1
+    _insertar_cliente("A-2")
+    assert len(_clientes()) == 2
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+def _insertar_cliente(conn, cedula):
+    return conn.execute("INSERT INTO clientes (nombre, cedula, telefono) VALUES (?, ?, ?)",
+                        (f"Cliente {cedula}", cedula, "809-000-0000")).lastrowid
+
+def _insertar_y_fallar(conn, cedula):
+    _insertar_cliente(conn, cedula)
+    raise RuntimeError("tarea fallida")
+
+def _cedulas(bd):
+    with bd.usar_conexion() as conn:
+        return {fila[0] for fila in conn.execute("SELECT cedula FROM clientes")}
+
+def _escritor_bloqueado(bd):
+    """Ocupa el hilo escritor hasta que se libere el evento devuelto, para que las tareas
+    que se envíen mientras tanto queden en un mismo lote"""
+    escritor = bd.obtener_escritor()
+    if escritor is None:
+        pytest.skip("El modo clásico no usa hilo escritor")
+    empezo = threading.Event()
+    liberar = threading.Event()
+
+    def bloquear(conn):
+        empezo.set()
+        liberar.wait(5)
+
+    bloqueo = escritor.enviar(bloquear)
+    assert empezo.wait(5)
+    return escritor, liberar, bloqueo
+
+def test_escritura_devuelve_resultado_y_confirma(bd):
+    cliente_id = bd.ejecutar_escritura(_insertar_cliente, "A-1")
+    assert cliente_id > 0
+    assert _cedulas(bd) == {"A-1"}
+
+def test_escritura_fallida_no_deja_cambios(bd):
+    with pytest.raises(RuntimeError):
+        bd.ejecutar_escritura(_insertar_y_fallar, "F-1")
+    bd.ejecutar_escritura(_insertar_cliente, "A-1")
+    assert _cedulas(bd) == {"A-1"}
+
+def test_tarea_fallida_solo_revierte_su_savepoint(bd):
+    escritor, liberar, bloqueo = _escritor_bloqueado(bd)
+    transacciones = escritor.estadisticas['transacciones']
+
+    antes = escritor.enviar(_insertar_cliente, "A-1")
+    fallida = escritor.enviar(_insertar_y_fallar, "F-1")
+    despues = escritor.enviar(_insertar_cliente, "A-2")
+    liberar.set()
+
+    bloqueo.result(5)
+    assert antes.result(5) > 0
+    assert despues.result(5) > 0
+    with pytest.raises(RuntimeError):
+        fallida.result(5)
+    assert _cedulas(bd) == {"A-1", "A-2"}
+    # El bloqueo en su propia transacción y las tres tareas agrupadas en otra
+    assert escritor.estadisticas['transacciones'] == transacciones + 2
+
+def test_escritura_anidada_reutiliza_la_conexion(bd):
+    def externa(conn):
+        _insertar_cliente(conn, "A-1")
+        interna = bd.ejecutar_escritura(lambda conn_interna: (conn_interna, _insertar_cliente(conn_interna, "A-2")))
+        return conn, interna[0]
+
+    conn_externa, conn_interna = bd.ejecutar_escritura(externa)
+    assert conn_externa is conn_interna
+    assert _cedulas(bd) == {"A-1", "A-2"}
+
+def test_escritura_anidada_fallida_revierte_la_externa(bd):
+    def externa(conn):
+        _insertar_cliente(conn, "A-1")
+        bd.ejecutar_escritura(_insertar_y_fallar, "F-1")
+
+    with pytest.raises(RuntimeError):
+        bd.ejecutar_escritura(externa)
+    assert _cedulas(bd) == set()
+
+def test_detener_procesa_las_tareas_pendientes(bd):
+    escritor, liberar, bloqueo = _escritor_bloqueado(bd)
+    pendientes = [escritor.enviar(_insertar_cliente, f"P-{i}") for i in range(100)]
+
+    deteniendo = threading.Thread(target=escritor.detener)
+    deteniendo.start()
+    liberar.set()
+    deteniendo.join(10)
+
+    assert not deteniendo.is_alive()
+    assert all(futuro.done() and futuro.exception() is None for futuro in pendientes)
+    assert _cedulas(bd) == {f"P-{i}" for i in range(100)}
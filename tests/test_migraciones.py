@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+from base_datos import version_esquema
+from conftest import tablas
+
+def _fallar(conn):
+    raise RuntimeError("paso fallido")
+
+def test_migracion_fallida_no_deja_cambios(bd, monkeypatch):
+    version = bd.MIGRACIONES[-1][0] + 1
+    monkeypatch.setattr(bd, 'MIGRACIONES', bd.MIGRACIONES + [
+        (version, "Migración de prueba", [
+            "CREATE TABLE prueba_migracion (a)",
+            "ALTER TABLE clientes ADD COLUMN prueba TEXT",
+            _fallar,
+        ]),
+    ])
+
+    with pytest.raises(RuntimeError):
+        bd.migrar()
+
+    with bd.usar_conexion() as conn:
+        assert 'prueba_migracion' not in tablas(conn)
+        columnas = [fila[1] for fila in conn.execute("PRAGMA table_info(clientes)")]
+        assert 'prueba' not in columnas
+        assert bd.version_esquema(conn) == version - 1
+
+def test_migrar_es_idempotente(bd):
+    assert bd.migrar() == []
+    with bd.usar_conexion() as conn:
+        assert bd.version_esquema(conn) == bd.MIGRACIONES[-1][0]
+
+def test_version_esquema_sin_tabla_no_escribe(tmp_path):
+    conn = sqlite3.connect(tmp_path / "vacia.db")
+    assert version_esquema(conn) == 0
+    assert tablas(conn) == set()
@@ -0,0 +1,107 @@
+import random
+
+import pytest
+
+def _crear_prestamo(bd, monto, tasa):
+    def crear(conn):
+        cliente_id = conn.execute("INSERT INTO clientes (nombre, cedula, telefono) VALUES (?, ?, ?)",
+                                  ("Cliente", f"C-{random.random()}", "809-000-0000")).lastrowid
+        return conn.execute(
+            "INSERT INTO prestamos (cliente_id, monto, fecha_prestamo, fecha_vencimiento, tasa_interes) VALUES (?, ?, ?, ?, ?)",
+            (cliente_id, monto, '2024-01-01', '2024-12-31', tasa)
+        ).lastrowid
+    return bd.ejecutar_escritura(crear)
+
+def _pagar(bd, prestamo_id, monto):
+    return bd.ejecutar_escritura(lambda conn: conn.execute(
+        "INSERT INTO pagos (prestamo_id, fecha_pago, monto_pagado) VALUES (?, ?, ?)", (prestamo_id, '2024-02-01', monto)
+    ).lastrowid)
+
+def _saldos(bd):
+    """{prestamo_id: (total_pagado, saldo_pendiente)} guardados en prestamos"""
+    with bd.usar_conexion() as conn:
+        return {fila[0]: (fila[1], fila[2]) for fila in
+                conn.execute("SELECT id, total_pagado, saldo_pendiente FROM prestamos")}
+
+def _saldos_esperados(bd):
+    """Los mismos valores calculados desde pagos, como lo hacía el cálculo original"""
+    with bd.usar_conexion() as conn:
+        filas = conn.execute("""
+            SELECT p.id, p.monto, p.tasa_interes, COALESCE(SUM(pg.monto_pagado), 0)
+            FROM prestamos p LEFT JOIN pagos pg ON pg.prestamo_id = p.id
+            GROUP BY p.id
+        """).fetchall()
+    return {prestamo_id: (pagado, max(0, round(monto * (1 + (tasa or 0) / 100) - pagado, 2)))
+            for prestamo_id, monto, tasa, pagado in filas}
+
+def _comparar(bd):
+    # total_pagado se acumula pago a pago y no con un SUM, así que el redondeo puede diferir en un centavo
+    guardados = _saldos(bd)
+    esperados = _saldos_esperados(bd)
+    assert guardados.keys() == esperados.keys()
+    for prestamo_id, (pagado, saldo) in esperados.items():
+        assert guardados[prestamo_id][0] == pytest.approx(pagado)
+        assert guardados[prestamo_id][1] == pytest.approx(saldo, abs=0.011)
+
+def test_prestamo_nuevo_tiene_saldo_con_interes(bd):
+    prestamo_id = _crear_prestamo(bd, 1000, 10)
+    assert _saldos(bd)[prestamo_id] == (0, 1100)
+    sin_tasa = _crear_prestamo(bd, 500, None)
+    assert _saldos(bd)[sin_tasa] == (0, 500)
+
+def test_pagos_insertados_modificados_y_eliminados(bd):
+    prestamo_id = _crear_prestamo(bd, 1000, 10)
+    otro_id = _crear_prestamo(bd, 2000, 5)
+    pago_id = _pagar(bd, prestamo_id, 300)
+    _pagar(bd, prestamo_id, 200.55)
+    assert _saldos(bd)[prestamo_id] == (pytest.approx(500.55), pytest.approx(599.45))
+
+    bd.ejecutar_sql_escritura("UPDATE pagos SET monto_pagado = 100 WHERE id = ?", (pago_id,))
+    _comparar(bd)
+
+    # Mover un pago a otro préstamo ajusta los dos
+    bd.ejecutar_sql_escritura("UPDATE pagos SET prestamo_id = ? WHERE id = ?", (otro_id, pago_id))
+    _comparar(bd)
+    assert _saldos(bd)[otro_id][0] == pytest.approx(100)
+
+    bd.ejecutar_sql_escritura("DELETE FROM pagos WHERE id = ?", (pago_id,))
+    _comparar(bd)
+    assert _saldos(bd)[otro_id] == (pytest.approx(0), pytest.approx(2100))
+
+def test_cambio_de_monto_o_tasa_recalcula_el_saldo(bd):
+    prestamo_id = _crear_prestamo(bd, 1000, 10)
+    _pagar(bd, prestamo_id, 100)
+
+    bd.ejecutar_sql_escritura("UPDATE prestamos SET monto = 2000 WHERE id = ?", (prestamo_id,))
+    assert _saldos(bd)[prestamo_id] == (pytest.approx(100), pytest.approx(2100))
+    bd.ejecutar_sql_escritura("UPDATE prestamos SET tasa_interes = 0 WHERE id = ?", (prestamo_id,))
+    assert _saldos(bd)[prestamo_id] == (pytest.approx(100), pytest.approx(1900))
+    bd.ejecutar_sql_escritura("UPDATE prestamos SET tasa_interes = NULL WHERE id = ?", (prestamo_id,))
+    _comparar(bd)
+
+def test_sobrepago_deja_saldo_en_cero(bd):
+    prestamo_id = _crear_prestamo(bd, 1000, 10)
+    _pagar(bd, prestamo_id, 1500)
+    assert _saldos(bd)[prestamo_id] == (pytest.approx(1500), 0)
+
+def test_reconstruir_saldos_coincide_con_los_triggers(bd):
+    aleatorio = random.Random(42)
+    prestamos = [_crear_prestamo(bd, aleatorio.randint(100, 10000), aleatorio.choice([None, 0, 5, 12.5]))
+                 for _ in range(20)]
+    pagos = [_pagar(bd, aleatorio.choice(prestamos), round(aleatorio.uniform(1, 800), 2)) for _ in range(80)]
+    for pago_id in aleatorio.sample(pagos, 20):
+        bd.ejecutar_sql_escritura("UPDATE pagos SET monto_pagado = ? WHERE id = ?",
+                                  (round(aleatorio.uniform(1, 800), 2), pago_id))
+    for pago_id in aleatorio.sample(pagos, 15):
+        bd.ejecutar_sql_escritura("DELETE FROM pagos WHERE id = ?", (pago_id,))
+    _comparar(bd)
+    por_triggers = _saldos(bd)
+
+    # Descuadrar los saldos a propósito y reconstruirlos desde pagos
+    bd.ejecutar_sql_escritura("UPDATE prestamos SET total_pagado = 0")
+    assert bd.reconstruir_saldos() == len(prestamos)
+    reconstruidos = _saldos(bd)
+    assert reconstruidos.keys() == por_triggers.keys()
+    for prestamo_id, (pagado, saldo) in por_triggers.items():
+        assert reconstruidos[prestamo_id][0] == pytest.approx(pagado)
+        assert reconstruidos[prestamo_id][1] == pytest.approx(saldo, abs=0.011)
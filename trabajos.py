@@ -0,0 +1,354 @@
+"""
+Trabajos de exportación en segundo plano.
+
+Las exportaciones grandes (cartera completa, pagos, registro de actividad) se registran en
+la tabla trabajos_exportacion y las ejecuta un grupo de hilos del proceso, leyendo la base
+de datos por lotes. Cada trabajo informa su avance (filas escritas y porcentaje) y deja el
+archivo en DIRECTORIO_EXPORTACIONES, donde se conserva hasta que vence.
+
+También arma las exportaciones en Parquet de las tablas de la cartera (DATASETS_PARQUET) y
+las instantáneas con las tres tablas y un manifiesto que usa `python mantenimiento.py`.
+"""
+import atexit
+import csv
+from datetime import datetime, timedelta
+import json
+import os
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from auditoria import vaciar_auditoria
+from base_datos import (DB_PATH, ejecutar_escritura, ejecutar_sql_escritura, obtener_escritor, usar_conexion,
+                        version_esquema)
+from exportaciones import escribir_excel, escribir_parquet, escribir_pdf, formatear_lotes, parquet_disponible
+
+# Hilos que ejecutan exportaciones, carpeta de los archivos y horas que se conservan
+HILOS_EXPORTACION = int(os.environ.get('PRESTAMOS_EXPORTACION_HILOS', '2'))
+DIRECTORIO_EXPORTACIONES = os.environ.get(
+    'PRESTAMOS_EXPORTACIONES_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'exportaciones')
+)
+HORAS_EXPIRACION = float(os.environ.get('PRESTAMOS_EXPORTACIONES_HORAS', '24'))
+
+# Filas leídas por lote y segundos mínimos entre actualizaciones del progreso
+TAMANO_LOTE_EXPORTACION = 5000
+INTERVALO_PROGRESO = 1.0
+
+FORMATOS_TRABAJO = {
+    'csv': ('CSV', 'text/csv'),
+    'xlsx': ('Excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'pdf': ('PDF', 'application/pdf'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet'),
+}
+
+SQL_CARTERA = """
+SELECT p.id, c.nombre, c.cedula, p.monto, p.tasa_interes, p.fecha_prestamo, p.fecha_vencimiento,
+       p.estado, p.total_pagado, p.saldo_pendiente
+FROM prestamos p
+JOIN clientes c ON p.cliente_id = c.id
+"""
+COLUMNAS_CARTERA = ['ID', 'Cliente', 'Cédula', 'Monto', 'Tasa Interés', 'Fecha Préstamo', 'Fecha Vencimiento',
+                    'Estado', 'Total Pagado', 'Saldo Pendiente']
+TIPOS_CARTERA = ['entero', 'texto', 'texto', 'moneda', 'porcentaje', 'fecha', 'fecha', 'categoria', 'moneda', 'moneda']
+
+# Reportes disponibles: título, consulta, encabezados, tipo de cada columna (ver
+# exportaciones.FORMATOS_EXCEL) y si solo los administradores pueden pedirlo
+REPORTES = {
+    'cartera': {
+        'titulo': "Cartera Completa de Préstamos",
+        'sql': SQL_CARTERA + " ORDER BY p.id",
+        'columnas': COLUMNAS_CARTERA,
+        'tipos': TIPOS_CARTERA,
+    },
+    'morosos': {
+        'titulo': "Préstamos Morosos",
+        'sql': SQL_CARTERA + " WHERE p.estado = 'Atrasado' ORDER BY p.fecha_vencimiento, p.id",
+        'columnas': COLUMNAS_CARTERA,
+        'tipos': TIPOS_CARTERA,
+    },
+    'clientes': {
+        'titulo': "Clientes",
+        'sql': "SELECT id, nombre, cedula, telefono FROM clientes ORDER BY nombre, id",
+        'columnas': ['ID', 'Nombre', 'Cédula', 'Teléfono'],
+        'tipos': ['entero', 'texto', 'texto', 'texto'],
+    },
+    'pagos': {
+        'titulo': "Pagos Recibidos",
+        'sql': """
+        SELECT pg.id, pg.prestamo_id, c.nombre, c.cedula, pg.fecha_pago, pg.monto_pagado
+        FROM pagos pg
+        JOIN prestamos p ON pg.prestamo_id = p.id
+        JOIN clientes c ON p.cliente_id = c.id
+        ORDER BY pg.fecha_pago, pg.id
+        """,
+        'columnas': ['ID', 'Préstamo', 'Cliente', 'Cédula', 'Fecha de Pago', 'Monto Pagado'],
+        'tipos': ['entero', 'entero', 'texto', 'texto', 'fecha', 'moneda'],
+    },
+    'auditoria': {
+        'titulo': "Registro de Actividad",
+        'sql': "SELECT id, timestamp, usuario, accion, detalles, ip_address FROM log_auditoria ORDER BY timestamp DESC, id DESC",
+        'columnas': ['ID', 'Fecha y Hora', 'Usuario', 'Acción', 'Detalles', 'Dirección IP'],
+        'tipos': ['entero', 'fecha_hora', 'texto', 'categoria', 'texto', 'texto'],
+        'solo_administradores': True,
+    },
+}
+
+# Tablas de la cartera tal como están en la base de datos, para análisis: una columna por
+# campo con su tipo (montos como números, fechas como date32, estado como diccionario)
+DATASETS_PARQUET = {
+    'prestamos': {
+        'sql': """
+        SELECT id, cliente_id, monto, tasa_interes, fecha_prestamo, fecha_vencimiento, estado,
+               total_pagado, saldo_pendiente
+        FROM prestamos ORDER BY id
+        """,
+        'tipos': ['entero', 'entero', 'moneda', 'porcentaje', 'fecha', 'fecha', 'categoria', 'moneda', 'moneda'],
+    },
+    'pagos': {
+        'sql': "SELECT id, prestamo_id, fecha_pago, monto_pagado FROM pagos ORDER BY id",
+        'tipos': ['entero', 'entero', 'fecha', 'moneda'],
+    },
+    'clientes': {
+        'sql': "SELECT id, nombre, cedula, telefono FROM clientes ORDER BY id",
+        'tipos': ['entero', 'texto', 'texto', 'texto'],
+    },
+}
+MANIFIESTO_INSTANTANEA = "manifiesto.json"
+
+_pool = None
+_lock_pool = threading.Lock()
+
+def _ahora():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _actualizar_trabajo(trabajo_id, **campos):
+    """Actualiza columnas de un trabajo a través del escritor"""
+    asignaciones = ", ".join(f"{campo} = ?" for campo in campos)
+    ejecutar_sql_escritura(f"UPDATE trabajos_exportacion SET {asignaciones} WHERE id = ?",
+                           tuple(campos.values()) + (trabajo_id,))
+
+def _campos(cursor):
+    return [descripcion[0] for descripcion in cursor.description]
+
+def _lotes_con_progreso(trabajo_id, cursor, total):
+    """Entrega el resultado de la consulta por lotes y va registrando el avance del trabajo"""
+    filas = 0
+    ultimo_aviso = time.monotonic()
+    while True:
+        lote = cursor.fetchmany(TAMANO_LOTE_EXPORTACION)
+        if not lote:
+            break
+        yield lote
+        filas += len(lote)
+        if time.monotonic() - ultimo_aviso >= INTERVALO_PROGRESO:
+            _actualizar_trabajo(trabajo_id, filas=filas, progreso=min(filas / total, 0.99) if total else 0.0)
+            ultimo_aviso = time.monotonic()
+
+def ejecutar_trabajo(trabajo_id):
+    """Genera el archivo de un trabajo de exportación y registra el resultado"""
+    with usar_conexion() as conn:
+        fila = conn.execute("SELECT reporte, formato, usuario, estado FROM trabajos_exportacion WHERE id = ?",
+                            (trabajo_id,)).fetchone()
+    if fila is None or fila[3] not in ('pendiente', 'en_proceso'):
+        return
+    reporte, formato, usuario, _ = fila
+    definicion = REPORTES[reporte]
+    _actualizar_trabajo(trabajo_id, estado='en_proceso', iniciado_en=_ahora(), progreso=0.0, filas=0, error=None)
+
+    os.makedirs(DIRECTORIO_EXPORTACIONES, exist_ok=True)
+    ruta = os.path.join(DIRECTORIO_EXPORTACIONES, f"{trabajo_id}_{reporte}.{formato}")
+    # Se escribe con otro nombre y se renombra al terminar: nunca se ofrece un archivo a medias
+    ruta_parcial = ruta + ".parcial"
+    try:
+        if reporte == 'auditoria':
+            vaciar_auditoria()
+        with usar_conexion() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM ({definicion['sql']})").fetchone()[0]
+            _actualizar_trabajo(trabajo_id, total_filas=total)
+            cursor = conn.execute(definicion['sql'])
+            lotes = _lotes_con_progreso(trabajo_id, cursor, total)
+
+            if formato == 'csv':
+                with open(ruta_parcial, 'w', encoding='utf-8', newline='') as archivo:
+                    escritor = csv.writer(archivo)
+                    escritor.writerow(definicion['columnas'])
+                    filas = 0
+                    for lote in lotes:
+                        escritor.writerows(lote)
+                        filas += len(lote)
+            elif formato == 'xlsx':
+                filas = escribir_excel(ruta_parcial, definicion['columnas'], lotes, definicion['tipos'], usuario)
+            elif formato == 'parquet':
+                # Para análisis: nombres de campo de la consulta en lugar de los encabezados
+                filas = escribir_parquet(ruta_parcial, _campos(cursor), lotes, definicion['tipos'],
+                                         {'reporte': reporte, 'generado_por': usuario, 'generado_en': _ahora()})
+            else:
+                tipos = definicion['tipos']
+                lotes_pdf = formatear_lotes(lotes, tipos)
+                columnas_total = [columna for columna, tipo in zip(definicion['columnas'], tipos) if tipo == 'moneda']
+                filas = escribir_pdf(ruta_parcial, definicion['columnas'], lotes_pdf, definicion['titulo'],
+                                     usuario, columnas_total)
+
+        os.replace(ruta_parcial, ruta)
+        terminado = datetime.now()
+        _actualizar_trabajo(
+            trabajo_id, estado='terminado', progreso=1.0, filas=filas, archivo=ruta,
+            terminado_en=terminado.strftime('%Y-%m-%d %H:%M:%S'),
+            expira_en=(terminado + timedelta(hours=HORAS_EXPIRACION)).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+    except Exception as e:
+        if os.path.exists(ruta_parcial):
+            os.remove(ruta_parcial)
+        _actualizar_trabajo(trabajo_id, estado='error', error=str(e), terminado_en=_ahora())
+
+class PoolExportaciones:
+    """Hilos de fondo que toman trabajos de exportación de una cola y los ejecutan"""
+
+    def __init__(self, hilos=HILOS_EXPORTACION):
+        self._cola = queue.Queue()
+        self._hilos = [
+            threading.Thread(target=self._ejecutar, name=f"exportacion-{numero}", daemon=True)
+            for numero in range(max(1, hilos))
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def encolar(self, trabajo_id):
+        self._cola.put(trabajo_id)
+
+    def _ejecutar(self):
+        while True:
+            trabajo_id = self._cola.get()
+            if trabajo_id is None:
+                return
+            try:
+                ejecutar_trabajo(trabajo_id)
+            except Exception:
+                # El error ya quedó registrado en el trabajo si fue posible; el hilo sigue
+                pass
+
+    def detener(self, timeout=5):
+        """Detiene los hilos al terminar los trabajos en curso (los pendientes se retoman al reiniciar)"""
+        for _ in self._hilos:
+            self._cola.put(None)
+        for hilo in self._hilos:
+            hilo.join(timeout)
+
+    @property
+    def pendientes(self):
+        return self._cola.qsize()
+
+def obtener_pool_exportaciones():
+    """Devuelve el grupo de hilos de exportación del proceso. Al crearlo vuelve a encolar
+    los trabajos que quedaron pendientes o a medias en una ejecución anterior."""
+    global _pool
+    if _pool is None:
+        with _lock_pool:
+            if _pool is None:
+                # Crear antes el escritor para que al salir siga activo mientras terminan los hilos
+                obtener_escritor()
+                pool = PoolExportaciones()
+                with usar_conexion() as conn:
+                    interrumpidos = [fila[0] for fila in conn.execute(
+                        "SELECT id FROM trabajos_exportacion WHERE estado IN ('pendiente', 'en_proceso') ORDER BY id"
+                    )]
+                for trabajo_id in interrumpidos:
+                    pool.encolar(trabajo_id)
+                atexit.register(pool.detener)
+                _pool = pool
+    return _pool
+
+def reporte_permitido(reporte, nivel_acceso):
+    """Indica si un usuario con nivel_acceso puede pedir el reporte"""
+    return not REPORTES[reporte].get('solo_administradores') or nivel_acceso == "administrador"
+
+def crear_trabajo(reporte, formato, usuario, nivel_acceso):
+    """Registra un trabajo de exportación, lo encola y devuelve su id"""
+    if reporte not in REPORTES:
+        raise ValueError(f"Reporte desconocido: {reporte}")
+    if not reporte_permitido(reporte, nivel_acceso):
+        raise PermissionError(f"El reporte {reporte} solo está disponible para administradores")
+    if formato not in FORMATOS_TRABAJO or (formato == 'parquet' and not parquet_disponible()):
+        raise ValueError(f"Formato no soportado: {formato}")
+    # El grupo se crea antes de insertar: al crearse encola los pendientes y no debe incluir este
+    pool = obtener_pool_exportaciones()
+    trabajo_id = ejecutar_escritura(lambda conn: conn.execute(
+        "INSERT INTO trabajos_exportacion (reporte, formato, usuario, creado_en) VALUES (?, ?, ?, ?)",
+        (reporte, formato, usuario, _ahora())
+    ).lastrowid)
+    pool.encolar(trabajo_id)
+    return trabajo_id
+
+def obtener_trabajos(usuario=None, limite=20, conn=None):
+    """Últimos trabajos de exportación (de un usuario o de todos)"""
+    query = """
+    SELECT id, reporte, formato, usuario, estado, progreso, filas, total_filas, archivo, error,
+           creado_en, terminado_en, expira_en
+    FROM trabajos_exportacion
+    """
+    params = []
+    if usuario is not None:
+        query += " WHERE usuario = ?"
+        params.append(usuario)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limite)
+    with usar_conexion(conn) as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def limpiar_exportaciones_vencidas():
+    """Borra los archivos de exportación vencidos y marca sus trabajos; devuelve cuántos borró"""
+    with usar_conexion() as conn:
+        vencidos = conn.execute(
+            "SELECT id, archivo FROM trabajos_exportacion WHERE estado = 'terminado' AND expira_en <= ?",
+            (_ahora(),)
+        ).fetchall()
+    for trabajo_id, archivo in vencidos:
+        if archivo and os.path.exists(archivo):
+            os.remove(archivo)
+        _actualizar_trabajo(trabajo_id, estado='vencido', archivo=None)
+    return len(vencidos)
+
+def exportar_parquet(dataset, destino, conn=None, metadatos=None):
+    """Escribe una tabla de DATASETS_PARQUET en un archivo Parquet leyendo la base de datos
+    por lotes; devuelve la cantidad de filas"""
+    definicion = DATASETS_PARQUET[dataset]
+    with usar_conexion(conn) as conn:
+        cursor = conn.execute(definicion['sql'])
+        lotes = iter(lambda: cursor.fetchmany(TAMANO_LOTE_EXPORTACION), [])
+        return escribir_parquet(destino, _campos(cursor), lotes, definicion['tipos'],
+                                {'dataset': dataset, **(metadatos or {})})
+
+def instantanea_parquet(directorio, datasets=None):
+    """
+    Guarda en directorio un archivo Parquet por tabla de la cartera y un manifiesto JSON con
+    la fecha, la versión del esquema y las filas de cada archivo. Todas las tablas se leen
+    dentro de la misma transacción, así que la instantánea es consistente.
+
+    Returns:
+        El manifiesto
+    """
+    datasets = list(datasets or DATASETS_PARQUET)
+    os.makedirs(directorio, exist_ok=True)
+    with usar_conexion() as conn:
+        conn.execute("BEGIN")
+        try:
+            manifiesto = {
+                'generado_en': _ahora(),
+                'version_esquema': version_esquema(conn),
+                'archivos': {},
+            }
+            for dataset in datasets:
+                archivo = f"{dataset}.parquet"
+                ruta = os.path.join(directorio, archivo)
+                filas = exportar_parquet(dataset, ruta + ".parcial", conn,
+                                         {'generado_en': manifiesto['generado_en']})
+                os.replace(ruta + ".parcial", ruta)
+                manifiesto['archivos'][dataset] = {'archivo': archivo, 'filas': filas}
+        finally:
+            conn.rollback()
+    with open(os.path.join(directorio, MANIFIESTO_INSTANTANEA), 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, ensure_ascii=False, indent=2)
+    return manifiesto